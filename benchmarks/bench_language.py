@@ -0,0 +1,63 @@
+"""
+Microbenchmarks for the language engine: catalog loading and the formatting done on every outgoing message
+(see bot.modules.lang_filter.LangFilter.pre_send_message).
+Run it from the bot's root directory: python benchmarks/bench_language.py
+"""
+import sys
+import tempfile
+import timeit
+from os import path
+
+sys.path.insert(0, path.dirname(path.dirname(path.abspath(__file__))))
+
+from discord import Embed  # noqa: E402
+
+from bot.lib.language import Language  # noqa: E402
+
+VARIABLES = {'PX': '!', 'AU': 'someone', 'NM': 'help', 'CMD': '!help'}
+
+
+def modlog_embed():
+    embed = Embed(description='A deleted message that mentioned something, with some more text around it.')
+    embed.set_footer(text='$[modlog-msg-sent]: 2021-01-01 12:00:00, $[modlog-msg-edited]: 2021-01-01 12:05:00')
+    embed.add_field(name='$[modlog-file-name]', value='[image.png](https://example.com/image.png)')
+    embed.add_field(name='$[modlog-attached-other]', value='[a.txt](https://example.com/a.txt)')
+    return embed
+
+
+def help_embed():
+    embed = Embed(title='$[help-title]', description='$[help-description]')
+    for name in ['modlog-channel-help', 'modlog-toggle-help', 'modlog-search-help', 'starboard-help',
+                 'feed-help', 'reddit-help', 'http-help', 'modlog-note-help']:
+        embed.add_field(name='$CMD ' + name.split('-')[0], value='$[{}]'.format(name), inline=False)
+    embed.set_footer(text='$[help-footer]')
+    return embed
+
+
+def bench(name, func):
+    number, total = timeit.Timer(func).autorange()
+    print('{:<40} {:>12.2f} us'.format(name, total / number * 1e6))
+
+
+def main():
+    bench('load (YAML, no cache)', lambda: Language('lang', autoload=True))
+    with tempfile.TemporaryDirectory() as cache_dir:
+        cache_path = path.join(cache_dir, 'lang.cache')
+        Language('lang', autoload=True, cache_path=cache_path)  # Writes the cache
+        bench('load (cache hit)', lambda: Language('lang', autoload=True, cache_path=cache_path))
+
+    lang = Language('lang', autoload=True)
+    single = lang.get_single('es_CL')
+
+    bench('plain text', lambda: single.format('Just some text without placeholders', None, VARIABLES))
+    bench('placeholders', lambda: single.format('$[format]: $[modlog-channel-format]'))
+    bench('placeholders and variables', lambda: single.format('$[format]: $[modlog-channel-format]', None, VARIABLES))
+    bench('placeholders and locales', lambda: single.format('$[modlog-channel-set]', {'channel_id': 123}, VARIABLES))
+    bench('embed creation only (ModLog)', modlog_embed)
+    bench('ModLog embed', lambda: single.format(modlog_embed(), {'username': 'someone'}, VARIABLES))
+    bench('embed creation only (Help)', help_embed)
+    bench('Help embed', lambda: single.format(help_embed(), None, VARIABLES))
+
+
+if __name__ == '__main__':
+    main()
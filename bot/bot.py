@@ -2,13 +2,19 @@ import asyncio
 import platform
 import sys
 from datetime import datetime
+from os import path
 
 import discord
 
 from bot import Language, Manager, constants
 from bot.lib.guild_configuration import GuildConfiguration
 from bot.database import BotDatabase
+from bot.lib.bot_counters import BotCounters
 from bot.lib.configuration import BotConfiguration
+from bot.lib.http_client import HttpClient
+from bot.lib.message_queue import MessageQueue, PRIORITY_HIGH, PRIORITY_NORMAL
+from bot.lib.modlog_buffer import ModlogBuffer
+from bot.lib.language_resolver import LanguageResolver
 from bot.logger import new_logger
 from bot.utils import auto_int
 
@@ -37,6 +43,11 @@ class AlexisBot(discord.Client):
         self.connect_delta = None
 
         self.lang = {}
+        self.lang_resolver = LanguageResolver(self)
+        self.counters = BotCounters(self)
+        self.http_client = HttpClient(self)
+        self.message_queue = MessageQueue()
+        self.modlog_buffer = ModlogBuffer(self)
         self.deleted_messages = []
         self.deleted_messages_nolog = []
 
@@ -50,6 +61,7 @@ class AlexisBot(discord.Client):
             def make_handler(event_name, event_args):
                 async def dispatch(*args):
                     kwargs = dict(zip(event_args, args))
+                    self.counters.handle_event(event_name, kwargs)
                     await self.manager.dispatch(event_name=event_name, **kwargs)
 
                 return dispatch
@@ -108,6 +120,7 @@ class AlexisBot(discord.Client):
 
         self.initialized = True
         self.manager.create_tasks()
+        self.manager.schedule(self.counters.recompute, BotCounters.recompute_interval, force=True)
         await self.manager.dispatch('on_ready')
 
     def load_config(self):
@@ -131,7 +144,15 @@ class AlexisBot(discord.Client):
         """
         try:
             log.info('Loading language stuff...')
-            self.lang = Language('lang', default=self.config['default_lang'], autoload=True)
+            cache_path = None
+            if self.config['lang_cache']:
+                cache_path = path.join(constants.bot_root, 'cache', 'lang_catalog.bin')
+
+            self.lang = Language('lang', default=self.config['default_lang'], cache_path=cache_path)
+            # Files are parsed in parallel only on the cold start, as forking a process with running threads
+            # (event loop, HTTP and database connections) could deadlock
+            self.lang.load(parallel=not self.loop.is_running())
+            self.lang_resolver.clear()
             log.info('Loaded languages: %s, default: %s', list(self.lang.lib.keys()), self.config['default_lang'])
             return True
         except Exception as ex:
@@ -151,42 +172,62 @@ class AlexisBot(discord.Client):
 
         # Stop tasks
         self.manager.cancel_tasks()
+        self.message_queue.cancel()
+        self.modlog_buffer.cancel()
+
+    def get_modlog_channel(self, guild: discord.Guild, logtype=None):
+        """
+        Retrieves the modlog channel of a guild, if the modlog channel is set and the logtype is enabled.
+        Modules should call this before building a modlog entry, to avoid building it if it won't be sent.
+        :param guild: The guild.
+        :param logtype: The modlog type. Guilds can disable individual modlog types.
+        :return: The discord.TextChannel instance, or None if the entry should not be sent.
+        """
+        config = GuildConfiguration.get_instance(guild)
+        chanid = config.get('join_send_channel')
+        if chanid == '':
+            return None
+
+        if logtype and logtype in config.get_list('logtype_disabled'):
+            return None
+
+        return self.get_channel(auto_int(chanid))
 
     async def send_modlog(self, guild: discord.Guild, message=None, embed: discord.Embed = None,
                           locales=None, logtype=None):
         """
         Sends a message to the modlog channel of a guild, if modlog channel is set, and if the
-        logtype is enabled.
+        logtype is enabled. Entries are buffered for a moment and sent together (see
+        `bot.lib.modlog_buffer.ModlogBuffer`).
         :param guild: The guild to send the modlog message.
         :param message: The message content.
         :param embed: An embed for the message.
         :param locales: Locale variables for language messages.
         :param logtype: The modlog type of the message. Guilds can disable individual modlog types.
         """
-        config = GuildConfiguration.get_instance(guild)
-        chanid = config.get('join_send_channel')
-        if chanid == '':
-            return
-
-        if logtype and logtype in config.get_list('logtype_disabled'):
-            return
-
-        chan = self.get_channel(auto_int(chanid))
+        chan = self.get_modlog_channel(guild, logtype)
         if chan is None:
             return
 
-        await self.send_message(chan, content=message, embed=embed, locales=locales)
+        self.modlog_buffer.add(chan, message, embed, locales, logtype)
 
-    async def send_message(self, destination, content='', **kwargs):
+    async def send_message(self, destination, content='', priority=None, max_age=None, **kwargs):
         """
         Method that proxies all messages sent to Discord, to fire other calls
         like event handlers, message filters and bot logging. Allows original method's parameters.
+        Messages are sent through the destination's queue (see `bot.lib.message_queue.MessageQueue`).
         :param destination: Where to send the message, must be a discord.abc.Messageable compatible instance.
         :param content: The content of the message to send.
-        :return: The message sent
+        :param priority: The message priority on the queue. By default, messages answering an event
+        have high priority, and the rest have normal priority.
+        :param max_age: The time in seconds after which the message is dropped if it's still queued.
+        :return: The message sent, or None if it was dropped.
         """
+        if priority is None:
+            priority = PRIORITY_HIGH if kwargs.get('event') is not None else PRIORITY_NORMAL
 
         kwargs['content'] = content
+        kwargs['destination'] = destination
         if not isinstance(destination, discord.abc.Messageable):
             raise RuntimeError('destination must be a discord.abc.Messageable compatible instance')
 
@@ -210,8 +251,9 @@ class AlexisBot(discord.Client):
             del kwargs['locales']
         if 'event' in kwargs:
             del kwargs['event']
+        del kwargs['destination']
 
-        return await destination.send(**kwargs)
+        return await self.message_queue.send(destination, kwargs, priority, max_age)
 
     async def delete_message(self, message, silent=False):
         """
@@ -1,10 +1,4 @@
-import aiohttp
-import asyncio
-import discord
-
 from bot.utils import lazy_property
-from . import SingleLanguage
-from bot.lib.guild_configuration import GuildConfiguration
 from .logger import new_logger
 from . import categories
 
@@ -14,6 +8,10 @@ class Command:
     __version__ = '0.0.0'
     system = False
     db_models = []
+    # Default timeout for the module's HTTP requests, in seconds. If it's None, the bot's default is used.
+    http_timeout = None
+    # Share the result of concurrent identical GET requests made by the module
+    http_coalesce = False
 
     def __init__(self, bot):
         self.bot = bot
@@ -48,37 +46,25 @@ class Command:
 
     def get_lang(self, guild=None, channel=None):
         """
-        Creates a SingleLanguage instance for a specific server or server channel or default language.
+        Retrieves the SingleLanguage instance for a specific server or server channel or default language.
         :param guild: The discord.Guild instance to get the language. If it's None, the default language is used.
         :param channel: The channel instance to get channel-specific language. If not set, the server language is used.
         :return: The SingleLanguage instance with the determined language.
         """
-        lang_code = self.bot.config['default_lang']
-
-        if isinstance(guild, discord.Guild):
-            guildcfg = GuildConfiguration.get_instance(guild)
-            lang_code = guildcfg.get('lang', self.bot.config['default_lang'])
-
-            # Use channel language if the argument has been passed
-            if isinstance(channel, discord.TextChannel):
-                chanid = channel if not isinstance(channel, discord.TextChannel) else str(channel.id)
-                lang_code = guildcfg.get('lang#' + chanid, lang_code)
-
-        return SingleLanguage(self.bot.lang, lang_code)
+        return self.bot.lang_resolver.get(guild, channel)
 
     @lazy_property
     def http(self):
         """
-        Creates a http session instance with its own cookie storage and user-agent.
-        :return: The http session instance.
+        Creates a http session instance with its own cookie storage and user-agent, using the bot's
+        shared connection pool.
+        :return: The `bot.lib.http_client.HttpSession` instance.
         """
         headers = {'User-Agent': '{}/{} {}/{} (https://discord.cl/bot)'.format(
             self.__class__.__name__, self.__class__.__version__,
             self.bot.__class__.name, self.bot.__class__.__version__)}
 
-        return aiohttp.ClientSession(
-            loop=asyncio.get_event_loop(), headers=headers, cookie_jar=aiohttp.CookieJar(unsafe=True)
-        )
+        return self.bot.http_client.session(self.__class__.__name__, headers, self.http_timeout, self.http_coalesce)
 
     @lazy_property
     def log(self):
@@ -17,6 +17,9 @@ EVENT_HANDLERS = {
     'user_update': ['before', 'after'],
     'message_delete': ['message'],
     'message_edit': ['before', 'after'],
+    'raw_message_delete': ['payload'],
+    'raw_bulk_message_delete': ['payload'],
+    'raw_message_edit': ['payload'],
     'guild_join': ['guild'],
     'guild_remove': ['guild'],
     'member_ban': ['guild', 'user'],
@@ -29,7 +29,7 @@ class BotDatabase:
     @staticmethod
     def initialize():
         ins = BotDatabase.get_instance()
-        ins.create_tables([ServerConfig], safe=True)
+        ins.create_tables([ServerConfig, GuildString], safe=True)
         return ins
 
 
@@ -42,3 +42,15 @@ class ServerConfig(BaseModel):
     serverid = peewee.TextField()
     name = peewee.TextField()
     value = peewee.TextField(default='')
+
+
+class GuildString(BaseModel):
+    serverid = peewee.TextField()
+    lang = peewee.TextField()
+    name = peewee.TextField()
+    value = peewee.TextField()
+
+    class Meta:
+        indexes = (
+            (('serverid', 'lang', 'name'), True),
+        )
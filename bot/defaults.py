@@ -14,6 +14,14 @@ config = {
     'log_path': 'logs',
     'log_to_files': False,
     'log_format': default_log_format,
+    'lang_cache': True,
+    'http_timeout': 15,
+    'http_limit': 100,
+    'http_limit_per_host': 10,
+    'http_disk_cache': False,
+    'http_mode': 'live',
+    'http_cassette_path': 'cassettes',
+    'http_replay_latency': 0,
     'whitelist': False,
     'whitelist_autoleave': False,
     'whitelist_contact': '130324995984326656',
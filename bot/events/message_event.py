@@ -3,7 +3,6 @@ import discord
 from discord import Embed
 
 from bot.lib.guild_configuration import GuildConfiguration
-from bot.lib.language import SingleLanguage
 from bot.utils import no_tags, auto_int
 from bot.regex import pat_usertag, pat_channel, pat_snowflake
 
@@ -226,11 +225,7 @@ class MessageEvent:
     @property
     def lang(self):
         if self._lang is None:
-            if self.guild is None:
-                self._lang = SingleLanguage(self.bot.lang, self.bot.config['default_lang'])
-            else:
-                lang_code = self.config.get('lang', self.bot.config['default_lang'])
-                self._lang = SingleLanguage(self.bot.lang, lang_code)
+            self._lang = self.bot.lang_resolver.get(self.guild)
 
         return self._lang
 
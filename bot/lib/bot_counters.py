@@ -0,0 +1,145 @@
+import asyncio
+
+from bot.logger import new_logger
+
+log = new_logger('BotCounters')
+
+
+class BotCounters:
+    """
+    Keeps bot-wide guild, member and unique user counters, updated from the guild and member events, so they
+    can be retrieved without walking all the cached members. Unique users are counted from the cached members
+    by keeping the amount of guilds each user is in. The counters can be recomputed with `recompute`, which the
+    bot runs when it connects and then every *recompute_interval* seconds, as members are cached on demand.
+    """
+    recompute_interval = 900
+
+    def __init__(self, bot):
+        self.bot = bot
+        self.guilds = 0
+        self.members = 0
+        self._refs = {}
+        self._bots = set()
+        # While recomputing, the changes that the recomputed counters could miss, and the guilds already counted
+        self._changes = None
+        self._counted = None
+
+    @property
+    def users(self):
+        """
+        :return: The amount of unique users that are not bots.
+        """
+        return len(self._refs) - len(self._bots)
+
+    @property
+    def bots(self):
+        """
+        :return: The amount of unique bot users.
+        """
+        return len(self._bots)
+
+    def handle_event(self, event_name, kwargs):
+        """
+        Updates the counters from a bot event. The bot calls it for every event before the modules handle them,
+        so the counters don't depend on any module.
+        :param event_name: The event handler name (e.g. "on_member_join").
+        :param kwargs: The event parameters.
+        """
+        if event_name == 'on_guild_join':
+            self.add_guild(kwargs['guild'])
+        elif event_name == 'on_guild_remove':
+            self.remove_guild(kwargs['guild'])
+        elif event_name == 'on_member_join':
+            self.add_member(kwargs['member'])
+        elif event_name == 'on_member_remove':
+            self.remove_member(kwargs['member'])
+
+    def add_guild(self, guild):
+        self._record(self.add_guild, guild)
+        self.guilds += 1
+        self.members += guild.member_count or 0
+        for member in guild.members:
+            self._add_user(member)
+
+    def remove_guild(self, guild):
+        self._record(self.remove_guild, guild)
+        self.guilds = max(0, self.guilds - 1)
+        self.members = max(0, self.members - (guild.member_count or 0))
+        for member in guild.members:
+            self._remove_user(member)
+
+    def add_member(self, member):
+        self._record(self.add_member, member, member.guild.id)
+        self.members += 1
+        self._add_user(member)
+
+    def remove_member(self, member):
+        self._record(self.remove_member, member, member.guild.id)
+        self.members = max(0, self.members - 1)
+        self._remove_user(member)
+
+    async def recompute(self, batch_size=50):
+        """
+        Recomputes the counters from the guilds and cached members. The work is split in batches of guilds,
+        yielding to the event loop between them, so it can be run in the background. The events received
+        meanwhile that the recomputed counters can't include are applied again to them at the end.
+        :param batch_size: The amount of guilds processed on each batch.
+        :return: A dict with the difference between the previous and the recomputed counters, or None if the
+        counters were already being recomputed.
+        """
+        if self._changes is not None:
+            return None
+
+        self._changes, self._counted = [], set()
+        try:
+            guilds, members, refs, bots = 0, 0, {}, set()
+            for i, guild in enumerate(list(self.bot.guilds)):
+                guilds += 1
+                members += guild.member_count or 0
+                for member in list(guild.members):
+                    refs[member.id] = refs.get(member.id, 0) + 1
+                    if member.bot:
+                        bots.add(member.id)
+                self._counted.add(guild.id)
+
+                if (i + 1) % batch_size == 0:
+                    await asyncio.sleep(0)
+        finally:
+            changes = self._changes
+            self._changes = self._counted = None
+
+        previous = {'guilds': self.guilds, 'members': self.members, 'users': self.users, 'bots': self.bots}
+
+        self.guilds, self.members, self._refs, self._bots = guilds, members, refs, bots
+        for method, arg in changes:
+            method(arg)
+
+        drift = {
+            'guilds': self.guilds - previous['guilds'],
+            'members': self.members - previous['members'],
+            'users': self.users - previous['users'],
+            'bots': self.bots - previous['bots']
+        }
+        if any(v != 0 for v in drift.values()):
+            log.debug('Counters recomputed with differences: %s', drift)
+
+        return drift
+
+    def _record(self, method, arg, guild_id=None):
+        # Guild changes are always missed by a running recompute, as it uses a copy of the guilds list. Member
+        # changes are only missed if their guild was already counted.
+        if self._changes is not None and (guild_id is None or guild_id in self._counted):
+            self._changes.append((method, arg))
+
+    def _add_user(self, member):
+        self._refs[member.id] = self._refs.get(member.id, 0) + 1
+        if member.bot:
+            self._bots.add(member.id)
+
+    def _remove_user(self, member):
+        count = self._refs.get(member.id, 0) - 1
+        if count > 0:
+            self._refs[member.id] = count
+        else:
+            self._refs.pop(member.id, None)
+            self._bots.discard(member.id)
@@ -18,6 +18,7 @@ class GuildConfiguration:
     _list_separator = ','
     _comma_escape = '\1\1'
     _instances = {}
+    _listeners = []
 
     @classmethod
     def get_instance(cls, guild: Guild = None, defaults=None):
@@ -35,6 +36,24 @@ class GuildConfiguration:
 
         return GuildConfiguration._instances[guild_id]
 
+    @classmethod
+    def add_listener(cls, listener):
+        """
+        Registers a function to be called when a configuration value is set or unset through this class.
+        :param listener: The function, called as listener(guild_id, name).
+        """
+        if listener not in cls._listeners:
+            cls._listeners.append(listener)
+
+    @classmethod
+    def remove_listener(cls, listener):
+        """
+        Removes a function registered with add_listener.
+        :param listener: The function.
+        """
+        if listener in cls._listeners:
+            cls._listeners.remove(listener)
+
     @staticmethod
     def get_all(guild_id=None):
         """
@@ -137,6 +156,7 @@ class GuildConfiguration:
         :return: The stored value.
         """
         self._config[name] = self.set_value(self.guild_id, name, value)
+        self._notify(name)
         return self._config[name]
 
     def unset(self, name):
@@ -152,6 +172,7 @@ class GuildConfiguration:
             ins = ServerConfig.get(serverid=self.guild_id, name=name)
             ins.delete_instance()
             del self._config[name]
+            self._notify(name)
             return True
         except ServerConfig.DoesNotExist:
             return False
@@ -258,6 +279,10 @@ class GuildConfiguration:
         self.set_list(name, values)
         return values
 
+    def _notify(self, name):
+        for listener in self._listeners:
+            listener(self.guild_id, name)
+
     # Specific values
 
     @property
@@ -0,0 +1,111 @@
+import time
+from collections import deque
+
+import aiohttp
+
+
+class ServiceUnavailable(aiohttp.ClientConnectionError):
+    """
+    Raised when a request is not made because the host's circuit breaker is open.
+    """
+
+    def __init__(self, host, retry_in):
+        super().__init__('Service {} unavailable, retrying in {:.0f} seconds'.format(host, retry_in))
+        self.host = host
+        self.retry_in = retry_in
+
+
+class CircuitBreaker:
+    """
+    Tracks the failures and latencies of the requests to a host. After *threshold* consecutive failures, the
+    circuit is opened and requests fail immediately. Once the open time passes, a single trial request is allowed
+    (half-open): if it succeeds the circuit is closed, otherwise it's opened again for a longer time.
+    """
+
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half-open'
+
+    threshold = 5
+    open_time = 30
+    max_open_time = 600
+    # Latency samples kept to calculate the adaptive timeout, and the minimum needed to use it
+    samples = 100
+    min_samples = 20
+    min_timeout = 3
+
+    def __init__(self, host):
+        self.host = host
+        self.state = CircuitBreaker.CLOSED
+        self.failures = 0
+        self.total_failures = 0
+        self.opened_at = 0
+        self.open_for = CircuitBreaker.open_time
+        self.trial_running = False
+        self.latencies = deque(maxlen=CircuitBreaker.samples)
+
+    def before_request(self):
+        """
+        Checks if a request can be made.
+        :raise ServiceUnavailable: If the circuit is open, or it's half-open and the trial request is running.
+        """
+        if self.state == CircuitBreaker.CLOSED:
+            return
+
+        now = time.monotonic()
+        if self.state == CircuitBreaker.OPEN and now >= self.opened_at + self.open_for:
+            self.state = CircuitBreaker.HALF_OPEN
+            self.trial_running = False
+
+        if self.state == CircuitBreaker.HALF_OPEN and not self.trial_running:
+            self.trial_running = True
+            return
+
+        raise ServiceUnavailable(self.host, max(0, self.opened_at + self.open_for - now))
+
+    def abort(self):
+        """
+        Called when a request ends without a result (e.g. it was cancelled), to allow another trial request.
+        """
+        self.trial_running = False
+
+    def success(self, latency):
+        self.latencies.append(latency)
+        self.failures = 0
+        if self.state != CircuitBreaker.CLOSED:
+            self.state = CircuitBreaker.CLOSED
+            self.open_for = CircuitBreaker.open_time
+            self.trial_running = False
+
+    def failure(self):
+        self.failures += 1
+        self.total_failures += 1
+        if self.state == CircuitBreaker.HALF_OPEN:
+            # The trial request failed, wait more time before the next one
+            self.open_for = min(self.max_open_time, self.open_for * 2)
+            self._open()
+        elif self.state == CircuitBreaker.CLOSED and self.failures >= self.threshold:
+            self._open()
+
+    def percentile(self, pct):
+        if len(self.latencies) == 0:
+            return None
+
+        values = sorted(self.latencies)
+        return values[min(len(values) - 1, int(len(values) * pct / 100))]
+
+    def timeout(self, default):
+        """
+        Calculates the timeout for the host's requests, based on its recent latencies.
+        :param default: The timeout used when there are not enough samples. It's also the maximum timeout.
+        :return: The timeout in seconds.
+        """
+        if len(self.latencies) < self.min_samples:
+            return default
+
+        return max(self.min_timeout, min(default, self.percentile(95) * 3))
+
+    def _open(self):
+        self.state = CircuitBreaker.OPEN
+        self.opened_at = time.monotonic()
+        self.trial_running = False
@@ -0,0 +1,211 @@
+import hashlib
+import json
+import marshal
+import time
+from collections import OrderedDict
+from os import path, makedirs, remove
+
+from multidict import CIMultiDict, CIMultiDictProxy
+from yarl import URL
+
+from bot.logger import new_logger
+
+log = new_logger('HttpCache')
+
+
+class CachedResponse:
+    """
+    A fully read HTTP response, with the parts of aiohttp.ClientResponse's interface used by modules.
+    """
+    __slots__ = ('method', 'url', 'status', 'reason', 'headers', 'body', 'from_cache')
+
+    def __init__(self, method, url, status, reason, headers, body, from_cache=False):
+        self.method = method
+        self.url = URL(url)
+        self.status = status
+        self.reason = reason
+        self.headers = CIMultiDictProxy(CIMultiDict(headers))
+        self.body = body
+        self.from_cache = from_cache
+
+    @property
+    def ok(self):
+        return self.status < 400
+
+    @property
+    def content_type(self):
+        return self.headers.get('Content-Type', 'application/octet-stream').split(';')[0].strip().lower()
+
+    @property
+    def charset(self):
+        for param in self.headers.get('Content-Type', '').split(';')[1:]:
+            key, _, value = param.partition('=')
+            if key.strip().lower() == 'charset':
+                return value.strip().strip('"')
+        return None
+
+    async def read(self):
+        return self.body
+
+    async def text(self, encoding=None, errors='strict'):
+        encoding = encoding or self.charset
+        if encoding is None:
+            return self.body.decode('utf-8', 'replace')
+        return self.body.decode(encoding, errors)
+
+    async def json(self, *, encoding=None, loads=json.loads, content_type='application/json'):
+        # The content type is not checked, as the response was already validated when it was fetched
+        text = await self.text(encoding)
+        return loads(text) if text.strip() else None
+
+    def release(self):
+        pass
+
+    def copy(self, from_cache=True):
+        return CachedResponse(self.method, self.url, self.status, self.reason, self.headers, self.body, from_cache)
+
+
+class CacheEntry:
+    __slots__ = ('response', 'expires', 'stale_until')
+
+    def __init__(self, response, expires, stale_until):
+        self.response = response
+        self.expires = expires
+        self.stale_until = stale_until
+
+    @property
+    def size(self):
+        return len(self.response.body)
+
+
+class ResponseCache:
+    """
+    Stores successful HTTP responses for a time, in a memory tier bounded by size and, optionally, in a disk
+    tier. After an entry expires it can still be served while it's refreshed (stale-while-revalidate).
+    """
+
+    def __init__(self, max_bytes=32 * 1024 * 1024, max_entries=2000, disk_path=None):
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        self.disk_path = disk_path
+        self.size = 0
+        self.stats = {'hits': 0, 'stale_hits': 0, 'disk_hits': 0, 'misses': 0, 'stores': 0, 'evictions': 0}
+        self._entries = OrderedDict()
+
+    @staticmethod
+    def make_key(name, method, url, params=None, headers=None):
+        """
+        Creates a cache key for a request. The query parameters are sorted so equivalent URLs share the key.
+        :param name: The session name. Keys are not shared between sessions, as they could use different credentials.
+        :param method: The HTTP method.
+        :param url: The request URL.
+        :param params: The request query parameters, passed apart from the URL.
+        :param headers: The request-specific headers.
+        :return: The cache key as a string.
+        """
+        url = URL(url)
+        if params:
+            url = url.update_query(params)
+        url = url.with_query(sorted(url.query.items()))
+        extra = sorted((k.lower(), v) for k, v in (headers or {}).items())
+        return '{} {} {} {}'.format(name, method.upper(), str(url), extra if extra else '')
+
+    def get(self, key):
+        """
+        Retrieves a response from the cache.
+        :param key: The cache key.
+        :return: A tuple with the response and a boolean telling if it's stale, or (None, False) if the key is not
+        stored or it's too old.
+        """
+        entry = self._entries.get(key)
+        if entry is None and self.disk_path is not None:
+            entry = self._load(key)
+            if entry is not None:
+                self.stats['disk_hits'] += 1
+                self._store(key, entry)
+
+        now = time.time()
+        if entry is None or entry.stale_until <= now:
+            self.stats['misses'] += 1
+            return None, False
+
+        self._entries.move_to_end(key)
+        stale = entry.expires <= now
+        self.stats['stale_hits' if stale else 'hits'] += 1
+        return entry.response.copy(), stale
+
+    def set(self, key, response, ttl, stale=0):
+        """
+        Stores a response.
+        :param key: The cache key.
+        :param response: The CachedResponse instance.
+        :param ttl: The time in seconds that the response is fresh.
+        :param stale: The time in seconds, after the response expires, that it can be served while it's refreshed.
+        """
+        if len(response.body) > self.max_bytes // 10:
+            return
+
+        now = time.time()
+        entry = CacheEntry(response, now + ttl, now + ttl + stale)
+        self._store(key, entry)
+        self.stats['stores'] += 1
+
+        if self.disk_path is not None:
+            self._save(key, entry)
+
+    def get_stats(self):
+        stats = self.stats.copy()
+        stats.update(entries=len(self._entries), bytes=self.size)
+        lookups = stats['hits'] + stats['stale_hits'] + stats['misses']
+        stats['hit_rate'] = 0 if lookups == 0 else (stats['hits'] + stats['stale_hits']) / lookups
+        return stats
+
+    def clear(self):
+        self._entries.clear()
+        self.size = 0
+
+    def _store(self, key, entry):
+        if key in self._entries:
+            self.size -= self._entries.pop(key).size
+
+        self._entries[key] = entry
+        self.size += entry.size
+        while len(self._entries) > self.max_entries or self.size > self.max_bytes:
+            _, old = self._entries.popitem(last=False)
+            self.size -= old.size
+            self.stats['evictions'] += 1
+
+    def _disk_file(self, key):
+        return path.join(self.disk_path, hashlib.sha1(key.encode('utf-8')).hexdigest())
+
+    def _save(self, key, entry):
+        r = entry.response
+        data = (key, entry.expires, entry.stale_until, r.method, str(r.url), r.status, r.reason,
+                list(r.headers.items()), r.body)
+        try:
+            makedirs(self.disk_path, exist_ok=True)
+            with open(self._disk_file(key), 'wb') as f:
+                marshal.dump(data, f)
+        except (OSError, ValueError) as e:
+            log.debug('Could not store a response on disk: %s', str(e))
+
+    def _load(self, key):
+        filename = self._disk_file(key)
+        if not path.isfile(filename):
+            return None
+
+        try:
+            with open(filename, 'rb') as f:
+                stored_key, expires, stale_until, method, url, status, reason, headers, body = marshal.load(f)
+        except (OSError, EOFError, ValueError, TypeError) as e:
+            log.debug('Could not load a response from disk: %s', str(e))
+            return None
+
+        if stored_key != key or stale_until <= time.time():
+            try:
+                remove(filename)
+            except OSError:
+                pass
+            return None
+
+        return CacheEntry(CachedResponse(method, url, status, reason, headers, body, True), expires, stale_until)
@@ -0,0 +1,90 @@
+import base64
+import hashlib
+import json
+from os import path, makedirs
+
+import aiohttp
+from yarl import URL
+
+from bot.lib.http_cache import CachedResponse
+from bot.logger import new_logger
+
+log = new_logger('HttpCassette')
+
+
+class CassetteMiss(aiohttp.ClientConnectionError):
+    """
+    Raised on replay mode when there's no recorded response for a request.
+    """
+    pass
+
+
+class Cassette:
+    """
+    Stores HTTP responses on a directory, one JSON file per request, so they can be served later without
+    network access. Requests are identified by their method, URL (with sorted query parameters) and body.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.stats = {'recorded': 0, 'replayed': 0, 'missing': 0}
+
+    @staticmethod
+    def make_key(method, url, params=None, data=None, json_data=None):
+        url = URL(url)
+        if params:
+            url = url.update_query(params)
+        url = url.with_query(sorted(url.query.items()))
+
+        if json_data is not None:
+            body = json.dumps(json_data, sort_keys=True)
+        elif isinstance(data, dict):
+            body = json.dumps(data, sort_keys=True)
+        else:
+            body = data if isinstance(data, (str, bytes)) else ('' if data is None else repr(data))
+        if isinstance(body, str):
+            body = body.encode('utf-8')
+
+        return '{} {} {}'.format(method.upper(), str(url), hashlib.sha1(body).hexdigest())
+
+    def load(self, key):
+        """
+        Loads a recorded response.
+        :param key: The request key, from `make_key`.
+        :return: The CachedResponse instance.
+        :raise CassetteMiss: If the request was not recorded.
+        """
+        filename = self._file(key)
+        if not path.isfile(filename):
+            self.stats['missing'] += 1
+            raise CassetteMiss('No recorded response for ' + key)
+
+        with open(filename, encoding='utf-8') as f:
+            data = json.load(f)
+
+        self.stats['replayed'] += 1
+        return CachedResponse(data['method'], data['url'], data['status'], data['reason'], data['headers'],
+                              base64.b64decode(data['body']), True)
+
+    def save(self, key, response):
+        """
+        Records a response.
+        :param key: The request key, from `make_key`.
+        :param response: The CachedResponse instance.
+        """
+        data = {
+            'key': key, 'method': response.method, 'url': str(response.url), 'status': response.status,
+            'reason': response.reason, 'headers': list(response.headers.items()),
+            'body': base64.b64encode(response.body).decode('ascii')
+        }
+
+        try:
+            makedirs(self.directory, exist_ok=True)
+            with open(self._file(key), 'w', encoding='utf-8') as f:
+                json.dump(data, f, indent=2)
+            self.stats['recorded'] += 1
+        except OSError as e:
+            log.error('Could not record a response: %s', str(e))
+
+    def _file(self, key):
+        return path.join(self.directory, hashlib.sha1(key.encode('utf-8')).hexdigest() + '.json')
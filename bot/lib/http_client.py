@@ -0,0 +1,331 @@
+import asyncio
+import time
+from os import path
+
+import aiohttp
+from yarl import URL
+
+from bot import constants
+from bot.lib.http_breaker import CircuitBreaker
+from bot.lib.http_cache import CachedResponse, ResponseCache
+from bot.lib.http_cassette import Cassette
+from bot.lib.http_metrics import HttpMetrics
+from bot.logger import new_logger
+
+log = new_logger('HttpClient')
+
+
+class RequestContext:
+    """
+    The result of a HttpSession request. Like aiohttp's requests, it can be awaited to get the response,
+    or used with "async with" to release the response when finished.
+    """
+    __slots__ = ('_coro', '_resp')
+
+    def __init__(self, coro):
+        self._coro = coro
+        self._resp = None
+
+    def __await__(self):
+        return self._coro.__await__()
+
+    async def __aenter__(self):
+        self._resp = await self._coro
+        return self._resp
+
+    async def __aexit__(self, exc_type, exc, tb):
+        self._resp.release()
+
+
+class HttpSession:
+    """
+    A module's view of the shared HttpClient. It has its own default headers, timeout and cookies,
+    but the connections are taken from the shared pool.
+    """
+
+    def __init__(self, client, name, headers=None, timeout=None, coalesce=False):
+        self.client = client
+        self.name = name
+        self.headers = headers or {}
+        self.timeout = timeout
+        self.coalesce = coalesce
+        self._session = None
+
+    @property
+    def session(self):
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(
+                connector=self.client.connector, connector_owner=False, headers=self.headers,
+                cookie_jar=aiohttp.CookieJar(unsafe=True),
+                trace_configs=[self.client.trace_config, self.client.metrics.trace_config],
+                timeout=aiohttp.ClientTimeout(total=self.timeout or self.client.timeout)
+            )
+        return self._session
+
+    @property
+    def closed(self):
+        return self._session is None or self._session.closed
+
+    def request(self, method, url, **kwargs):
+        return RequestContext(self.client.request(self, method, url, **kwargs))
+
+    def get(self, url, **kwargs):
+        return self.request('GET', url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request('POST', url, **kwargs)
+
+    def put(self, url, **kwargs):
+        return self.request('PUT', url, **kwargs)
+
+    def delete(self, url, **kwargs):
+        return self.request('DELETE', url, **kwargs)
+
+    def head(self, url, **kwargs):
+        return self.request('HEAD', url, **kwargs)
+
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
+
+
+class HttpClient:
+    """
+    Shared HTTP client for the bot and its modules. All the requests use a single connection pool, with
+    limits per host, DNS cache and keep-alive connections. Each module gets a HttpSession with its own
+    default headers and timeout through `session`.
+
+    GET requests can be cached by passing the "cache" option with the time in seconds the response is fresh,
+    and optionally "cache_stale", the time after that in which the cached response is still returned while it's
+    fetched again on the background (by default, the same as "cache"). Cached responses are CachedResponse
+    instances, fully read.
+
+    Concurrent identical GET requests can share a single upstream request (single-flight). This is always done
+    for cached requests, and for the rest if the session has "coalesce" enabled or the "coalesce" request option
+    is set.
+
+    Each host has a CircuitBreaker: while a host keeps failing, requests to it fail immediately with
+    `bot.lib.http_breaker.ServiceUnavailable`. Once a host has enough samples, the timeout to wait for each
+    response read is adapted to its recent latencies.
+
+    Requests counts, status codes, received bytes and latencies are recorded per host and per module on `metrics`.
+
+    With the "http_mode" setting as "record", all the responses are stored on the "http_cassette_path" folder,
+    and as "replay" they are served from there, without network access, after waiting "http_replay_latency"
+    seconds. Requests that were not recorded fail with `bot.lib.http_cassette.CassetteMiss`.
+    """
+
+    def __init__(self, bot):
+        self.bot = bot
+        self.sessions = {}
+        self.stats = {'requests': 0, 'pending': 0, 'coalesced': 0, 'connections_created': 0,
+                      'connections_reused': 0, 'errors': 0}
+        self._connector = None
+        self._cache = None
+        self._inflight = {}
+        self.breakers = {}
+        self.metrics = HttpMetrics()
+        self._cassette = None
+
+        self.trace_config = aiohttp.TraceConfig()
+        self.trace_config.on_connection_create_end.append(self._on_connection_created)
+        self.trace_config.on_connection_reuseconn.append(self._on_connection_reused)
+
+    @property
+    def timeout(self):
+        return self.bot.config['http_timeout']
+
+    @property
+    def connector(self):
+        if self._connector is None or self._connector.closed:
+            self._connector = aiohttp.TCPConnector(
+                limit=self.bot.config['http_limit'], limit_per_host=self.bot.config['http_limit_per_host'],
+                ttl_dns_cache=300, keepalive_timeout=30, enable_cleanup_closed=True
+            )
+        return self._connector
+
+    @property
+    def cache(self):
+        if self._cache is None:
+            disk_path = None
+            if self.bot.config['http_disk_cache']:
+                disk_path = path.join(constants.bot_root, 'cache', 'http')
+            self._cache = ResponseCache(disk_path=disk_path)
+        return self._cache
+
+    @property
+    def mode(self):
+        return self.bot.config['http_mode']
+
+    @property
+    def cassette(self):
+        if self._cassette is None:
+            self._cassette = Cassette(path.join(constants.bot_root, self.bot.config['http_cassette_path']))
+        return self._cassette
+
+    def session(self, name, headers=None, timeout=None, coalesce=False):
+        """
+        Creates a session for a module. If the module is reloaded, its previous session is reused.
+        :param name: The session name, used to identify the module making the requests.
+        :param headers: The default headers for the session requests.
+        :param timeout: The default total timeout for the session requests, in seconds. By default, the
+        "http_timeout" configuration value is used.
+        :param coalesce: Share the result of concurrent identical GET requests.
+        :return: The HttpSession instance.
+        """
+        if name not in self.sessions:
+            self.sessions[name] = HttpSession(self, name, headers, timeout, coalesce)
+        return self.sessions[name]
+
+    async def request(self, session, method, url, cache=None, cache_stale=None, coalesce=None, **kwargs):
+        """
+        Makes a request for a session. Per-request options are passed to aiohttp as they are.
+        :param cache: The time in seconds to cache the response. Only used with GET requests.
+        :param cache_stale: The time in seconds an expired response can be used while it's refreshed.
+        :param coalesce: Share the result with concurrent identical requests. By default, the session's
+        setting is used.
+        :return: The aiohttp.ClientResponse instance, or a CachedResponse if the response was fully read to
+        be cached or shared.
+        """
+        coalesce = session.coalesce if coalesce is None else coalesce
+        if method.upper() != 'GET' or (cache is None and not coalesce):
+            return await self._request(session, method, url, **kwargs)
+
+        key = ResponseCache.make_key(session.name, method, url, kwargs.get('params'), kwargs.get('headers'))
+        if cache is not None:
+            cache_stale = cache if cache_stale is None else cache_stale
+            response, stale = self.cache.get(key)
+            if response is not None:
+                if stale and key not in self._inflight:
+                    self._single_flight(key, session, method, url, cache, cache_stale, kwargs).add_done_callback(
+                        self._refresh_done)
+                return response
+
+        task = self._inflight.get(key)
+        if task is None:
+            task = self._single_flight(key, session, method, url, cache, cache_stale, kwargs)
+        else:
+            self.stats['coalesced'] += 1
+
+        # The shared request is not cancelled if a caller is
+        response = await asyncio.shield(task)
+        return response.copy(from_cache=False)
+
+    def _single_flight(self, key, session, method, url, ttl, stale, kwargs):
+        task = asyncio.get_event_loop().create_task(self._fetch_full(key, session, method, url, ttl, stale, kwargs))
+        self._inflight[key] = task
+        task.add_done_callback(lambda _: self._inflight.pop(key, None))
+        return task
+
+    async def _fetch_full(self, key, session, method, url, ttl, stale, kwargs):
+        trace_ctx = HttpMetrics.request_context(session.name)
+        trace_ctx.read_by_client = True
+        start = time.monotonic()
+
+        resp = await self._request(session, method, url, trace_request_ctx=trace_ctx, **kwargs)
+        try:
+            body = await resp.read()
+        finally:
+            resp.release()
+
+        self.metrics.record_total(URL(url).host, session.name, time.monotonic() - start)
+
+        response = CachedResponse(method, resp.url, resp.status, resp.reason, resp.headers, body)
+        if ttl is not None and 200 <= resp.status < 300:
+            self.cache.set(key, response, ttl, stale)
+        return response
+
+    @staticmethod
+    def _refresh_done(task):
+        if not task.cancelled() and task.exception() is not None:
+            log.debug('Could not refresh a cached response: %s', str(task.exception()))
+
+    async def _request(self, session, method, url, **kwargs):
+        if self.mode == 'replay':
+            key = Cassette.make_key(method, url, kwargs.get('params'), kwargs.get('data'), kwargs.get('json'))
+            await asyncio.sleep(self.bot.config['http_replay_latency'])
+            self.stats['requests'] += 1
+            return self.cassette.load(key)
+
+        resp = await self._request_live(session, method, url, **kwargs)
+        if self.mode != 'record':
+            return resp
+
+        try:
+            body = await resp.read()
+        finally:
+            resp.release()
+
+        response = CachedResponse(method, resp.url, resp.status, resp.reason, resp.headers, body)
+        key = Cassette.make_key(method, url, kwargs.get('params'), kwargs.get('data'), kwargs.get('json'))
+        self.cassette.save(key, response)
+        return response
+
+    async def _request_live(self, session, method, url, **kwargs):
+        breaker = self.get_breaker(URL(url).host)
+        breaker.before_request()
+
+        if 'timeout' not in kwargs:
+            total = session.timeout or self.timeout
+            kwargs['timeout'] = aiohttp.ClientTimeout(total=total, sock_read=breaker.timeout(total))
+
+        if 'trace_request_ctx' not in kwargs:
+            kwargs['trace_request_ctx'] = HttpMetrics.request_context(session.name)
+
+        self.stats['requests'] += 1
+        self.stats['pending'] += 1
+        start = time.monotonic()
+        resp = None
+        try:
+            resp = await session.session.request(method, url, **kwargs)
+        except (aiohttp.ClientError, asyncio.TimeoutError):
+            self.stats['errors'] += 1
+            breaker.failure()
+            raise
+        finally:
+            self.stats['pending'] -= 1
+            if resp is None and breaker.trial_running:
+                breaker.abort()
+
+        # Server errors and rate limits count as failures
+        if resp.status >= 500 or resp.status == 429:
+            breaker.failure()
+        else:
+            breaker.success(time.monotonic() - start)
+
+        return resp
+
+    def get_breaker(self, host):
+        if host not in self.breakers:
+            self.breakers[host] = CircuitBreaker(host)
+        return self.breakers[host]
+
+    def get_stats(self):
+        """
+        :return: A dict with the request and connection counters, and the amount of connections currently open.
+        """
+        stats = self.stats.copy()
+        stats['cache'] = self.cache.get_stats()
+        stats['metrics'] = self.metrics.snapshot()
+        if self.mode != 'live':
+            stats['cassette'] = self.cassette.stats.copy()
+        stats['sessions'] = len([s for s in self.sessions.values() if not s.closed])
+        if self._connector is not None and not self._connector.closed:
+            # aiohttp doesn't expose these counters publicly
+            stats['connections_idle'] = sum(len(c) for c in self._connector._conns.values())
+            stats['connections_acquired'] = len(self._connector._acquired)
+        return stats
+
+    async def close(self):
+        for session in self.sessions.values():
+            await session.close()
+
+        if self._connector is not None:
+            await self._connector.close()
+        log.debug('HTTP sessions closed.')
+
+    async def _on_connection_created(self, session, ctx, params):
+        self.stats['connections_created'] += 1
+
+    async def _on_connection_reused(self, session, ctx, params):
+        self.stats['connections_reused'] += 1
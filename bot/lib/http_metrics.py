@@ -0,0 +1,171 @@
+import time
+from collections import Counter
+from types import SimpleNamespace
+
+import aiohttp
+
+
+class LatencyHistogram:
+    """
+    Counts latencies in fixed buckets, so percentiles can be estimated without keeping every sample.
+    """
+    __slots__ = ('counts', 'count', 'total')
+
+    # Upper bounds of the buckets, in seconds
+    buckets = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, float('inf'))
+
+    def __init__(self):
+        self.counts = [0] * len(self.buckets)
+        self.count = 0
+        self.total = 0
+
+    def add(self, value):
+        for idx, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[idx] += 1
+                break
+
+        self.count += 1
+        self.total += value
+
+    @property
+    def mean(self):
+        return 0 if self.count == 0 else self.total / self.count
+
+    def percentile(self, pct):
+        """
+        :return: The upper bound of the bucket where the percentile is, or None if there are no samples.
+        """
+        if self.count == 0:
+            return None
+
+        target = self.count * pct / 100
+        acc = 0
+        for idx, amount in enumerate(self.counts):
+            acc += amount
+            if acc >= target:
+                return self.buckets[idx]
+
+        return self.buckets[-1]
+
+
+class RequestStats:
+    """
+    Request counters and latency histograms for a host or a module.
+    """
+    __slots__ = ('requests', 'errors', 'statuses', 'bytes_in', 'latencies')
+
+    phases = ('dns', 'connect', 'ttfb', 'total')
+
+    def __init__(self):
+        self.requests = 0
+        self.errors = 0
+        self.statuses = Counter()
+        self.bytes_in = 0
+        self.latencies = {phase: LatencyHistogram() for phase in self.phases}
+
+    def summary(self):
+        p50, p95 = self.latencies['total'].percentile(50), self.latencies['total'].percentile(95)
+        return {
+            'requests': self.requests, 'errors': self.errors, 'bytes_in': self.bytes_in,
+            'statuses': dict(self.statuses),
+            'latency': {phase: {'count': h.count, 'mean': h.mean, 'p50': h.percentile(50), 'p95': h.percentile(95)}
+                        for phase, h in self.latencies.items()},
+            'p50': p50, 'p95': p95
+        }
+
+
+class HttpMetrics:
+    """
+    Collects the HTTP requests statistics per host and per module, using aiohttp's tracing. The module name is
+    passed to the trace through the request's trace_request_ctx (see `request_context`).
+    DNS and connection times are only recorded when a new connection is made. The total time goes from the
+    request start until the response is fully read, if it's read by the HTTP client, or until the headers are
+    received otherwise.
+    """
+
+    def __init__(self):
+        self.hosts = {}
+        self.modules = {}
+
+        self.trace_config = aiohttp.TraceConfig(trace_config_ctx_factory=SimpleNamespace)
+        self.trace_config.on_request_start.append(self._on_request_start)
+        self.trace_config.on_dns_resolvehost_start.append(self._on_dns_start)
+        self.trace_config.on_dns_resolvehost_end.append(self._on_dns_end)
+        self.trace_config.on_connection_create_start.append(self._on_connection_start)
+        self.trace_config.on_connection_create_end.append(self._on_connection_end)
+        self.trace_config.on_request_end.append(self._on_request_end)
+        self.trace_config.on_response_chunk_received.append(self._on_chunk_received)
+        self.trace_config.on_request_exception.append(self._on_request_exception)
+
+    @staticmethod
+    def request_context(module):
+        return SimpleNamespace(module=module, read_by_client=False)
+
+    def get_stats(self, host, module):
+        if host not in self.hosts:
+            self.hosts[host] = RequestStats()
+        if module not in self.modules:
+            self.modules[module] = RequestStats()
+        return self.hosts[host], self.modules[module]
+
+    def record_total(self, host, module, value):
+        for stats in self.get_stats(host, module):
+            stats.latencies['total'].add(value)
+
+    def snapshot(self):
+        """
+        :return: A dict with the statistics summaries, by host and by module.
+        """
+        return {
+            'hosts': {host: stats.summary() for host, stats in self.hosts.items()},
+            'modules': {module: stats.summary() for module, stats in self.modules.items()}
+        }
+
+    def _record(self, ctx, phase, value):
+        for stats in self.get_stats(ctx.host, ctx.module):
+            stats.latencies[phase].add(value)
+
+    @staticmethod
+    def _module(ctx):
+        return getattr(ctx.trace_request_ctx, 'module', None) or 'unknown'
+
+    async def _on_request_start(self, session, ctx, params):
+        ctx.start = time.monotonic()
+        ctx.host = params.url.host
+        ctx.module = self._module(ctx)
+        for stats in self.get_stats(ctx.host, ctx.module):
+            stats.requests += 1
+
+    async def _on_dns_start(self, session, ctx, params):
+        ctx.dns_start = time.monotonic()
+
+    async def _on_dns_end(self, session, ctx, params):
+        if hasattr(ctx, 'dns_start') and hasattr(ctx, 'host'):
+            self._record(ctx, 'dns', time.monotonic() - ctx.dns_start)
+
+    async def _on_connection_start(self, session, ctx, params):
+        ctx.connect_start = time.monotonic()
+
+    async def _on_connection_end(self, session, ctx, params):
+        if hasattr(ctx, 'connect_start') and hasattr(ctx, 'host'):
+            self._record(ctx, 'connect', time.monotonic() - ctx.connect_start)
+
+    async def _on_request_end(self, session, ctx, params):
+        elapsed = time.monotonic() - ctx.start
+        self._record(ctx, 'ttfb', elapsed)
+        if not getattr(ctx.trace_request_ctx, 'read_by_client', False):
+            self._record(ctx, 'total', elapsed)
+
+        for stats in self.get_stats(ctx.host, ctx.module):
+            stats.statuses[params.response.status] += 1
+
+    async def _on_chunk_received(self, session, ctx, params):
+        if hasattr(ctx, 'host'):
+            for stats in self.get_stats(ctx.host, ctx.module):
+                stats.bytes_in += len(params.chunk)
+
+    async def _on_request_exception(self, session, ctx, params):
+        if hasattr(ctx, 'host'):
+            for stats in self.get_stats(ctx.host, ctx.module):
+                stats.errors += 1
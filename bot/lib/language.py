@@ -1,6 +1,14 @@
 import glob
+import marshal
+import os
 import re
 import codecs
+import time
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from string import Formatter
+from sys import intern
 
 from os import path
 from ruamel import yaml
@@ -9,64 +17,346 @@ from discord import Embed
 from bot.logger import new_logger
 
 pat_lang_placeholder = re.compile(r'\$\[([a-zA-Z0-9_\-]+)\]')
+pat_lang_variable = re.compile(r'\$(?:\[([a-zA-Z0-9_\-]+)\]|(CMD|AU|NM|PX))')
+pat_variable = re.compile(r'\$(CMD|AU|NM|PX)')
+pat_simple_field = re.compile(r'^[^.\[\]]+$')
 log = new_logger('Language')
 
+_formatter = Formatter()
+
+
+class Template:
+    """
+    A language string compiled into a sequence of tokens. Literal tokens are strings and field tokens
+    are (name, format_spec, conversion) tuples, so rendering is a single pass without re-parsing the text.
+    Restricted templates (used for the guilds' custom strings) only accept simple fields without format specs
+    or conversions, and are never rendered with str.format; otherwise, the text is kept as it is.
+    """
+    __slots__ = ('raw', 'tokens', 'static')
+
+    def __init__(self, raw, restricted=False):
+        self.raw = raw
+        self.tokens = None
+        self.static = None
+
+        try:
+            tokens = []
+            for literal, field, spec, conv in _formatter.parse(raw):
+                if literal:
+                    tokens.append(literal)
+                if field is None:
+                    continue
+                if restricted and (spec or conv or not is_simple_field(field)):
+                    tokens = [raw]
+                    break
+                if not is_simple_field(field):
+                    # Positional or attribute/index fields are left to str.format
+                    tokens = None
+                    break
+                tokens.append((field, spec, conv))
+        except ValueError:
+            # Unbalanced braces, keep the text as it is
+            tokens = [raw]
+
+        if tokens is not None and all(isinstance(t, str) for t in tokens):
+            self.static = ''.join(tokens)
+        self.tokens = tokens
+
+    def field_names(self):
+        """
+        :return: A set with the names of the template's simple fields.
+        """
+        try:
+            return {field for _, field, _, _ in _formatter.parse(self.raw)
+                    if field is not None and is_simple_field(field)}
+        except ValueError:
+            return set()
+
+    def render(self, kwargs):
+        """
+        Renders the template with the given values. If a value is missing, the raw text is returned.
+        :param kwargs: A dict with the values for the template fields.
+        :return: The rendered text.
+        """
+        if self.static is not None:
+            return self.static
+
+        if self.tokens is None:
+            try:
+                return self.raw.format(**kwargs)
+            except KeyError:
+                return self.raw
+
+        result = []
+        for token in self.tokens:
+            if isinstance(token, str):
+                result.append(token)
+                continue
+
+            name, spec, conv = token
+            if name not in kwargs:
+                return self.raw
+
+            value = kwargs[name]
+            if conv:
+                value = _formatter.convert_field(value, conv)
+            result.append(format(value, spec))
+
+        return ''.join(result)
+
+
+def is_simple_field(field):
+    """
+    :return: True if the format field is a keyword name, without attributes or indexes.
+    """
+    return field != '' and not field.isdigit() and pat_simple_field.match(field) is not None
+
+
+def check_override(raw, base):
+    """
+    Checks that a custom string only uses the fields of the string it replaces, without format specs,
+    conversions, attributes or indexes.
+    :param raw: The custom string.
+    :param base: The Template of the replaced string.
+    :return: A boolean depending if the custom string can be used.
+    """
+    allowed = base.field_names()
+    try:
+        for _, field, spec, conv in _formatter.parse(raw):
+            if field is not None and (spec or conv or field not in allowed):
+                return False
+    except ValueError:
+        return False
+
+    return True
+
+
+def parse_file(lang_file):
+    """
+    Reads a language file. Only string and number values are kept.
+    :param lang_file: The language file path. Its name (without extension) is the language code.
+    :return: A (language code, strings dict) tuple, or None if the file is not a valid language file.
+    """
+    with codecs.open(lang_file, 'r', encoding='utf8') as f:
+        yml = yaml.safe_load(f)
+
+    if not isinstance(yml, dict):
+        return None
+
+    lang = intern(path.basename(lang_file)[:-4])
+    strings = {intern(str(k)): str(v) for k, v in yml.items()
+               if isinstance(v, str) or isinstance(v, int) or isinstance(v, float)}
+    return lang, strings
+
+
+class CatalogOverlay(dict):
+    """
+    A language catalog with some of its strings replaced. Only the replaced strings are stored on this dict,
+    the rest of them are looked up on the base catalog, so the base catalog is never copied.
+    """
+    __slots__ = ('base',)
+
+    def __init__(self, base, overrides):
+        super().__init__(overrides)
+        self.base = base
+
+    def __missing__(self, key):
+        return self.base[key]
+
+    def __contains__(self, key):
+        return dict.__contains__(self, key) or key in self.base
+
+    def get(self, key, default=None):
+        value = dict.get(self, key)
+        return self.base.get(key, default) if value is None else value
+
 
 class Language:
-    def __init__(self, langpath, default='en', autoload=False):
+    format_cache_size = 4096
+    cache_version = 1
+
+    def __init__(self, langpath, default='en', autoload=False, cache_path=None):
         self.lib = {}
+        self.catalog = {}
         self.path = langpath
         self.default = default
+        self.cache_path = cache_path
+        self._format_cache = OrderedDict()
+        self._singles = {}
 
         if autoload:
             self.load()
 
-    def load(self):
-        self.lib = {}
+    def load(self, parallel=False):
+        """
+        Loads the language files. If a cache path was given and none of the files changed since the
+        cache was written, the catalog is read from the cache instead of parsing every YAML file.
+        :param parallel: Parse the files with multiple processes. Only use it before the event loop and other
+        threads are started, as the worker processes are forked.
+        """
+        start = time.perf_counter()
         p = path.join(self.path, "**{s}*.yml".format(s=path.sep))
-        lang_files = glob.iglob(p, recursive=True)
+        lang_files = sorted(f for f in glob.iglob(p, recursive=True) if path.isfile(f))
+        signature = Language.get_signature(lang_files)
+
+        self.lib = self.load_cache(signature)
+        from_cache = self.lib is not None
+        if not from_cache:
+            self.lib = {}
+            for lang_file, result in zip(lang_files, Language.parse_files(lang_files, parallel)):
+                if result is None:
+                    log.warning('The file "%s" contains an invalid YAML structure.', lang_file)
+                    continue
+
+                lang, strings = result
+                if len(strings) > 0:
+                    self.lib.setdefault(lang, {}).update(strings)
+
+            self.save_cache(signature)
+
+        parsed = time.perf_counter()
+        self.compile()
+        log.info('Loaded %i language files %s in %.3f seconds (compiled in %.3f seconds)',
+                 len(lang_files), 'from cache' if from_cache else 'from YAML',
+                 parsed - start, time.perf_counter() - parsed)
 
+    def load_cache(self, signature):
+        """
+        Reads the language catalog from the cache file.
+        :param signature: The current language files signature.
+        :return: The catalog dict, or None if the cache is not usable.
+        """
+        if not self.cache_path or not path.isfile(self.cache_path):
+            return None
+
+        try:
+            with open(self.cache_path, 'rb') as f:
+                data = marshal.load(f)
+        except (OSError, EOFError, ValueError, TypeError) as e:
+            log.warning('Could not read the language cache: %s', str(e))
+            return None
+
+        if not isinstance(data, dict) or data.get('version') != Language.cache_version \
+                or data.get('files') != signature:
+            return None
+
+        return {intern(lang): {intern(k): v for k, v in strings.items()} for lang, strings in data['lib'].items()}
+
+    def save_cache(self, signature):
+        """
+        Stores the loaded language catalog on the cache file.
+        :param signature: The language files signature that generated the catalog.
+        """
+        if not self.cache_path:
+            return
+
+        try:
+            cache_dir = path.dirname(self.cache_path)
+            if cache_dir and not path.isdir(cache_dir):
+                os.makedirs(cache_dir)
+
+            tmp_path = self.cache_path + '.tmp'
+            with open(tmp_path, 'wb') as f:
+                marshal.dump({'version': Language.cache_version, 'files': signature, 'lib': self.lib}, f)
+            os.replace(tmp_path, self.cache_path)
+        except OSError as e:
+            log.warning('Could not write the language cache: %s', str(e))
+
+    @staticmethod
+    def get_signature(lang_files):
+        """
+        Generates a signature of the language files, used to validate the cache.
+        :param lang_files: The language files paths.
+        :return: A dict with the file paths as keys and its modification time and size as values.
+        """
+        signature = {}
         for lang_file in lang_files:
-            fn = path.basename(lang_file)
-            if not path.isfile(lang_file) or not fn.endswith('.yml'):
-                continue
+            st = os.stat(lang_file)
+            signature[lang_file] = (st.st_mtime_ns, st.st_size)
 
-            with codecs.open(lang_file, 'r', encoding='utf8') as f:
-                yml = yaml.safe_load(f)
-                lang = fn[:-4]
+        return signature
 
-                if not isinstance(yml, dict):
-                    log.warning('The file "%s" contains an invalid YAML structure.', lang_file)
-                else:
-                    for k, v in yml.items():
-                        if not isinstance(v, str) and not isinstance(v, int) and not isinstance(v, float):
-                            continue
+    @staticmethod
+    def parse_files(lang_files, parallel=False):
+        """
+        Parses the language files.
+        :param lang_files: The language files paths.
+        :param parallel: Use multiple processes if possible. See `Language.load`.
+        :return: A list with the parse_file results for every file, in the same order.
+        """
+        workers = min(os.cpu_count() or 1, 8)
+        if parallel and workers > 1 and len(lang_files) > workers:
+            try:
+                with ProcessPoolExecutor(max_workers=workers) as executor:
+                    chunksize = max(1, len(lang_files) // (workers * 4))
+                    results = list(executor.map(parse_file, lang_files, chunksize=chunksize))
+                return [r if r is None else (intern(r[0]), {intern(k): v for k, v in r[1].items()})
+                        for r in results]
+            except (OSError, BrokenProcessPool) as e:
+                log.warning('Could not parse language files in parallel: %s', str(e))
+
+        return [parse_file(f) for f in lang_files]
+
+    def compile(self):
+        """
+        Compiles the loaded language strings into templates, flattening each language's fallback chain
+        (e.g. es_CL -> es -> default language) into a single dict per language.
+        """
+        templates = {}
+        for lang, strings in self.lib.items():
+            templates[lang] = {k: Template(v) for k, v in strings.items() if v.strip() != ''}
 
-                        if lang not in self.lib:
-                            self.lib[lang] = {}
+        self.catalog = {}
+        for lang in self.lib.keys():
+            flat = {}
+            for fallback in reversed(self.get_chain(lang)):
+                flat.update(templates.get(fallback, {}))
+            self.catalog[lang] = flat
 
-                        self.lib[lang][k] = str(v)
+        self._format_cache.clear()
+
+    def get_chain(self, lang):
+        """
+        Determines the fallback chain for a language code. For example, "es_CL" falls back
+        to "es" and then to the default language.
+        :param lang: The language code.
+        :return: A list of language codes, from the most to the least specific.
+        """
+        chain = []
+        parts = lang.split('_')
+        for i in range(len(parts), 0, -1):
+            code = '_'.join(parts[:i])
+            if code in self.lib and code not in chain:
+                chain.append(code)
+
+        if self.default not in chain:
+            chain.append(self.default)
+
+        return chain
 
     def get(self, name, __lang=None, **kwargs):
         if __lang is None:
             __lang = self.default
 
-        if __lang not in self.lib:
-            text = __lang + '_' + name
-        elif name not in self.lib[__lang] or self.lib[__lang][name].strip() == '':
-            if __lang == self.default:
-                text = '[{}:{}]'.format(__lang, name)
-            else:
-                text = self.get(name, self.default, **kwargs)
-        else:
-            text = self.lib[__lang][name]
+        return self.render(name, __lang, self.catalog.get(__lang), kwargs)
 
-            try:
-                text = text.format(**kwargs)
-            except KeyError:
-                pass
+    def render(self, name, lang, catalog, kwargs):
+        """
+        Renders a language string from a catalog.
+        :param name: The language string name.
+        :param lang: The language code, used for missing language messages.
+        :param catalog: The catalog to look up the string, or None if the language is not available.
+        :param kwargs: Values used to format the language string.
+        :return: The rendered string.
+        """
+        if catalog is None:
+            return lang + '_' + name
 
-        return text
+        template = catalog.get(name)
+        if template is None:
+            return '[{}:{}]'.format(self.default, name)
+
+        return template.render(kwargs)
 
     def get_list(self, name, separator='|', __lang=None, **kwargs):
         val = self.get(name, __lang, **kwargs)
@@ -75,40 +365,123 @@ class Language:
     def has(self, lang):
         return lang in self.lib
 
+    def get_single(self, lang):
+        """
+        Retrieves a shared SingleLanguage instance for a language code.
+        :param lang: The language code.
+        :return: The SingleLanguage instance.
+        """
+        single = self._singles.get(lang)
+        if single is None:
+            single = self._singles[lang] = SingleLanguage(self, lang)
+        return single
+
+    def format(self, message, lang=None, locales=None, variables=None, catalog=None):
+        """
+        Replaces all the $[name] placeholders from a text, in a single pass. If variables are given, the
+        $CMD, $AU, $NM and $PX variables are replaced too, including those coming from the language strings.
+        For texts without locales, the placeholders' results are kept on a LRU cache and the variables are
+        replaced on them afterwards, so the cache is shared by every author and guild prefix.
+        :param message: The text to format.
+        :param lang: The language code to use.
+        :param locales: Values used to format the language strings.
+        :param variables: A dict with the values of the variables, by its name without the "$" (e.g. "PX").
+        Variables that are not on this dict are left untouched.
+        :param catalog: A catalog to use instead of the language's one (e.g. a CatalogOverlay).
+        :return: The formatted text.
+        """
+        if lang is None:
+            lang = self.default
+
+        if '$' not in message:
+            return message
+
+        if locales or catalog is not None:
+            return self._format(message, lang, locales or {}, variables or None, catalog, 0)
+
+        result = message
+        if '$[' in message:
+            key = (lang, message)
+            cache = self._format_cache
+            if key in cache:
+                cache.move_to_end(key)
+                result = cache[key]
+            else:
+                result = self._format(message, lang, {}, None, None, 0)
+                cache[key] = result
+                if len(cache) > self.format_cache_size:
+                    cache.popitem(last=False)
+
+        if variables and '$' in result:
+            result = pat_variable.sub(lambda m: variables.get(m.group(1), m.group(0)), result)
+
+        return result
+
+    def _format(self, message, lang, locales, variables, catalog, depth):
+        if catalog is None:
+            catalog = self.catalog.get(lang)
+
+        def replace(m):
+            name = m.group(1)
+            if name is None:
+                return variables.get(m.group(2), m.group(0))
+
+            text = self.render(name, lang, catalog, locales)
+            if depth < 5 and '$' in text:
+                text = self._format(text, lang, locales, variables, catalog, depth + 1)
+            return text
+
+        pattern = pat_lang_placeholder if variables is None else pat_lang_variable
+        return pattern.sub(replace, message)
+
 
 class SingleLanguage:
-    def __init__(self, instance, lang):
+    def __init__(self, instance, lang, catalog=None):
+        """
+        :param instance: The Language instance.
+        :param lang: The language code.
+        :param catalog: A catalog to use instead of the language's one, for example, a CatalogOverlay
+        with a guild's custom strings.
+        """
         self.instance = instance
         self.lang = lang
+        self.catalog = catalog
 
     def get(self, name, **kwargs):
-        return self.instance.get(name, self.lang, **kwargs)
+        if self.catalog is None:
+            return self.instance.get(name, self.lang, **kwargs)
+        return self.instance.render(name, self.lang, self.catalog, kwargs)
 
     def get_list(self, name, separator='|', **kwargs):
-        return self.instance.get_list(name, separator, self.lang, **kwargs)
+        val = self.get(name, **kwargs)
+        return [f.strip() for f in val.split(separator) if f.strip() != '']
 
-    def format(self, message, locales=None):
+    def format(self, message, locales=None, variables=None):
+        """
+        Formats a text or every text of an embed (title, description, footer and fields) with this language.
+        :param message: The text or the discord.Embed instance. Other values are str()'d.
+        :param locales: Values used to format the language strings.
+        :param variables: Values for the $CMD, $AU, $NM and $PX variables. See `Language.format`.
+        :return: The formatted text, or the same embed instance with its texts formatted.
+        """
         if isinstance(message, str):
-            locales = locales or {}
-            for m in pat_lang_placeholder.finditer(message):
-                message = message.replace(m.group(0), self.get(m.group(1), **locales))
-
-            return self.format(message) if pat_lang_placeholder.search(message) else message
+            return self.instance.format(message, self.lang, locales, variables, self.catalog)
         elif isinstance(message, Embed):
             if message.title != Embed.Empty:
-                message.title = self.format(message.title, locales)
+                message.title = self.format(message.title, locales, variables)
             if message.description != Embed.Empty:
-                message.description = self.format(message.description, locales)
+                message.description = self.format(message.description, locales, variables)
             if message.footer.text != Embed.Empty:
-                message.set_footer(text=self.format(message.footer.text, locales), icon_url=message.footer.icon_url)
+                message.set_footer(text=self.format(message.footer.text, locales, variables),
+                                   icon_url=message.footer.icon_url)
 
             for idx, field in enumerate(message.fields):
                 message.set_field_at(idx,
-                                     name=self.format(field.name, locales),
-                                     value=self.format(field.value, locales),
+                                     name=self.format(field.name, locales, variables),
+                                     value=self.format(field.value, locales, variables),
                                      inline=field.inline)
             return message
         elif message is None:
             return None
         else:
-            return self.format(str(message), locales)
+            return self.format(str(message), locales, variables)
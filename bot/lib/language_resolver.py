@@ -0,0 +1,215 @@
+from collections import OrderedDict
+
+import discord
+
+from bot.database import GuildString
+from bot.lib.guild_configuration import GuildConfiguration
+from bot.lib.language import CatalogOverlay, SingleLanguage, Template
+
+
+class LanguageResolver:
+    """
+    Determines which language is used for guilds, guild channels and users (via DMs), keeping a bounded
+    cache of the resolved SingleLanguage instances. The cache is invalidated when a guild's "lang" or
+    "lang#<channel_id>" configuration values are changed through GuildConfiguration.
+    Guilds can also replace language strings; those are applied as an overlay over the language catalog.
+    """
+
+    cache_size = 10000
+
+    def __init__(self, bot):
+        self.bot = bot
+        self._resolved = OrderedDict()
+        self._user_langs = OrderedDict()
+        self._user_guilds = {}
+        self._guild_langs = OrderedDict()
+
+        GuildConfiguration.add_listener(self.on_config_change)
+
+    def get(self, guild=None, channel=None):
+        """
+        Retrieves the language for a guild or a guild channel.
+        :param guild: The discord.Guild instance. If it's None, the default language is used.
+        :param channel: The channel to get the channel-specific language. If it's not a discord.TextChannel,
+        the guild language is used.
+        :return: The SingleLanguage instance with the determined language.
+        """
+        if not isinstance(guild, discord.Guild):
+            return self.get_by_code(None)
+
+        chanid = str(channel.id) if isinstance(channel, discord.TextChannel) else None
+        key = (str(guild.id), chanid)
+        if key in self._resolved:
+            self._resolved.move_to_end(key)
+            return self._resolved[key]
+
+        default = self.bot.config['default_lang']
+        guildcfg = GuildConfiguration.get_instance(guild)
+        lang_code = guildcfg.get('lang', default)
+        if chanid is not None:
+            lang_code = guildcfg.get('lang#' + chanid, lang_code)
+
+        lang = self.get_by_code(lang_code, key[0])
+        self._store(self._resolved, key, lang)
+        return lang
+
+    def get_by_code(self, lang_code, guild_id=None):
+        """
+        Retrieves the SingleLanguage instance for a language code. The instance is shared unless the guild
+        has custom strings for the language.
+        :param lang_code: The language code. If it's None, the default language is used.
+        :param guild_id: The ID of the guild whose custom strings are applied.
+        :return: The SingleLanguage instance.
+        """
+        lang_code = lang_code or self.bot.config['default_lang']
+        if guild_id is not None:
+            guild_lang = self._get_guild_langs(guild_id).get(lang_code)
+            if guild_lang is not None:
+                return guild_lang
+
+        return self.bot.lang.get_single(lang_code)
+
+    def get_overrides(self, guild_id):
+        """
+        Retrieves the custom strings of a guild.
+        :param guild_id: The guild ID.
+        :return: A dict with the language codes as keys and dicts of the strings names and values as values.
+        """
+        overrides = {}
+        for item in GuildString.select().where(GuildString.serverid == str(guild_id)):
+            overrides.setdefault(item.lang, {})[item.name] = item.value
+
+        return overrides
+
+    def set_override(self, guild_id, lang_code, name, value):
+        """
+        Sets a custom string for a guild.
+        :param guild_id: The guild ID.
+        :param lang_code: The language code of the string.
+        :param name: The language string name.
+        :param value: The new value for the string.
+        """
+        guild_id = str(guild_id)
+        item, created = GuildString.get_or_create(
+            serverid=guild_id, lang=lang_code, name=name, defaults={'value': value})
+        if not created and item.value != value:
+            item.value = value
+            item.save()
+
+        self.invalidate_guild(guild_id)
+
+    def remove_override(self, guild_id, lang_code, name):
+        """
+        Removes a custom string from a guild.
+        :param guild_id: The guild ID.
+        :param lang_code: The language code of the string.
+        :param name: The language string name.
+        :return: A boolean depending if the custom string existed.
+        """
+        guild_id = str(guild_id)
+        deleted = GuildString.delete().where(
+            (GuildString.serverid == guild_id) & (GuildString.lang == lang_code) & (GuildString.name == name)
+        ).execute()
+
+        self.invalidate_guild(guild_id)
+        return deleted > 0
+
+    def invalidate_guild(self, guild_id):
+        """
+        Drops the cached languages of a guild.
+        :param guild_id: The guild ID.
+        """
+        guild_id = str(guild_id)
+        for key in [k for k in self._resolved.keys() if k[0] == guild_id]:
+            del self._resolved[key]
+        self._guild_langs.pop(guild_id, None)
+
+    def get_for_user(self, user):
+        """
+        Determines the language for a user, by using the most used language between the guilds shared
+        by the user and the bot.
+        :param user: The discord.User instance.
+        :return: The SingleLanguage instance with the determined language.
+        """
+        if user.id in self._user_langs:
+            self._user_langs.move_to_end(user.id)
+            return self.get_by_code(self._user_langs[user.id])
+
+        langs = []
+        for guild_id in self._user_guilds.get(user.id, ()):
+            guild = self.bot.get_guild(guild_id)
+            if guild is not None:
+                langs.append(self.get(guild).lang)
+
+        # If there are no common guilds, just use the default language
+        lang_code = self.bot.config['default_lang'] if len(langs) == 0 else max(set(langs), key=langs.count)
+        self._store(self._user_langs, user.id, lang_code)
+        return self.get_by_code(lang_code)
+
+    def index_guild(self, guild):
+        """
+        Adds the cached members of a guild to the user-to-guilds index.
+        :param guild: The discord.Guild instance.
+        """
+        for member in guild.members:
+            self._user_guilds.setdefault(member.id, set()).add(guild.id)
+
+    def unindex_guild(self, guild):
+        """
+        Removes a guild from the user-to-guilds index.
+        :param guild: The discord.Guild instance.
+        """
+        for member in guild.members:
+            self.unindex_member(member)
+
+    def index_member(self, member):
+        self._user_guilds.setdefault(member.id, set()).add(member.guild.id)
+        self._user_langs.pop(member.id, None)
+
+    def unindex_member(self, member):
+        guilds = self._user_guilds.get(member.id)
+        if guilds is None:
+            return
+
+        guilds.discard(member.guild.id)
+        if len(guilds) == 0:
+            del self._user_guilds[member.id]
+        self._user_langs.pop(member.id, None)
+
+    def on_config_change(self, guild_id, name):
+        if name != 'lang' and not name.startswith('lang#'):
+            return
+
+        self.invalidate_guild(guild_id)
+        self._user_langs.clear()
+
+    def clear(self):
+        """
+        Clears the resolved languages cache. The user-to-guilds index is kept.
+        """
+        self._resolved.clear()
+        self._user_langs.clear()
+        self._guild_langs.clear()
+
+    def _get_guild_langs(self, guild_id):
+        if guild_id in self._guild_langs:
+            self._guild_langs.move_to_end(guild_id)
+            return self._guild_langs[guild_id]
+
+        lang = self.bot.lang
+        guild_langs = {}
+        for lang_code, strings in self.get_overrides(guild_id).items():
+            if not lang.has(lang_code):
+                continue
+
+            overrides = {k: Template(v, restricted=True) for k, v in strings.items()}
+            overlay = CatalogOverlay(lang.catalog[lang_code], overrides)
+            guild_langs[lang_code] = SingleLanguage(lang, lang_code, overlay)
+
+        self._store(self._guild_langs, guild_id, guild_langs)
+        return guild_langs
+
+    def _store(self, cache, key, value):
+        cache[key] = value
+        if len(cache) > self.cache_size:
+            cache.popitem(last=False)
@@ -0,0 +1,219 @@
+import asyncio
+import heapq
+import itertools
+import time
+
+import discord
+from discord.http import Route
+
+from bot.lib.http_metrics import LatencyHistogram
+from bot.logger import new_logger
+
+log = new_logger('MessageQueue')
+
+PRIORITY_HIGH = 0
+PRIORITY_NORMAL = 1
+PRIORITY_LOW = 2
+
+# discord.py versions where send_embeds posts the message with the library's internals (see send_embeds)
+RAW_EMBEDS_VERSIONS = [(1, 5), (1, 6), (1, 7)]
+
+
+async def send_embeds(destination, content=None, embeds=None):
+    """
+    Compatibility function to send a message with many embeds (up to 10).
+    discord.py 2.0+ supports it with send(embeds=...). discord.py 1.5 to 1.7 only allow one embed per message, so
+    on those versions the message is posted with private APIs (Messageable._get_channel, the state's HTTP client
+    and ConnectionState.create_message), which are known to exist there. On any other version, or if those APIs
+    are missing, an embed is sent per message.
+    :param destination: The discord.abc.Messageable instance.
+    :param content: The message content.
+    :param embeds: The list of discord.Embed instances.
+    :return: The sent discord.Message (the last one, if many messages were sent).
+    """
+    embeds = embeds or []
+    version = (discord.version_info.major, discord.version_info.minor)
+    if version >= (2, 0):
+        return await destination.send(content=content or None, embeds=embeds)
+
+    if version in RAW_EMBEDS_VERSIONS:
+        state = getattr(destination, '_state', None)
+        if hasattr(destination, '_get_channel') and hasattr(state, 'create_message'):
+            channel = await destination._get_channel()
+            payload = {'embeds': [embed.to_dict() for embed in embeds]}
+            if content:
+                payload['content'] = content
+            if state.allowed_mentions is not None:
+                payload['allowed_mentions'] = state.allowed_mentions.to_dict()
+
+            route = Route('POST', '/channels/{channel_id}/messages', channel_id=channel.id)
+            data = await state.http.request(route, json=payload)
+            return state.create_message(channel=channel, data=data)
+
+    message = None
+    if content:
+        message = await destination.send(content=content)
+    for embed in embeds:
+        message = await destination.send(embed=embed)
+    return message
+
+
+class QueuedMessage:
+    __slots__ = ('kwargs', 'priority', 'max_age', 'enqueued', 'future')
+
+    def __init__(self, kwargs, priority, max_age, future):
+        self.kwargs = kwargs
+        self.priority = priority
+        self.max_age = max_age
+        self.enqueued = time.monotonic()
+        self.future = future
+
+    @property
+    def is_text(self):
+        """
+        :return: True if the message only has text content, so it can be joined with other messages.
+        """
+        others = [v for k, v in self.kwargs.items() if k != 'content']
+        return isinstance(self.kwargs.get('content'), str) and all(v is None for v in others)
+
+    def resolve(self, result=None, exception=None):
+        if self.future.done():
+            return
+        if exception is not None:
+            self.future.set_exception(exception)
+            # Mark the exception as retrieved, so it's not logged if nobody awaits the future
+            self.future.exception()
+        else:
+            self.future.set_result(result)
+
+
+class MessageQueue:
+    """
+    Sends the bot's messages through a queue for each destination, so messages with more priority (e.g. command
+    answers) are sent before the rest when a channel has many messages waiting. Each destination's messages
+    are sent one at a time, as they share Discord's rate limits; different destinations are sent concurrently.
+    Consecutive low priority text messages are joined in a single message, and low priority messages can have
+    a maximum age after which they are dropped.
+    """
+
+    max_length = 2000
+
+    def __init__(self, loop=None):
+        self.loop = loop or asyncio.get_event_loop()
+        self.stats = {'enqueued': 0, 'sent': 0, 'coalesced': 0, 'dropped': 0, 'errors': 0, 'max_depth': 0}
+        self.latency = LatencyHistogram()
+        self._queues = {}
+        self._workers = {}
+        self._seq = itertools.count()
+
+    def send(self, destination, kwargs, priority=PRIORITY_NORMAL, max_age=None):
+        """
+        Adds a message to the destination's queue.
+        :param destination: The discord.abc.Messageable instance.
+        :param kwargs: The destination.send() arguments.
+        :param priority: The message priority. Lower values are sent first.
+        :param max_age: The time in seconds after which the message is dropped if it was not sent yet.
+        :return: A future with the sent discord.Message, or None if the message was dropped.
+        """
+        key = (destination.__class__.__name__, destination.id)
+        future = self.loop.create_future()
+        queue = self._queues.setdefault(key, [])
+        heapq.heappush(queue, (priority, next(self._seq), QueuedMessage(kwargs, priority, max_age, future)))
+
+        self.stats['enqueued'] += 1
+        self.stats['max_depth'] = max(self.stats['max_depth'], len(queue))
+        if key not in self._workers:
+            self._workers[key] = self.loop.create_task(self._work(key, destination))
+
+        return future
+
+    @property
+    def depth(self):
+        return sum(len(q) for q in self._queues.values())
+
+    def get_stats(self):
+        stats = self.stats.copy()
+        stats.update(depth=self.depth, queues=len(self._queues), latency_mean=self.latency.mean,
+                     latency_p95=self.latency.percentile(95))
+        return stats
+
+    def cancel(self):
+        for worker in self._workers.values():
+            worker.cancel()
+
+        for queue in self._queues.values():
+            for _, _, item in queue:
+                item.future.cancel()
+
+        self._workers.clear()
+        self._queues.clear()
+
+    async def _work(self, key, destination):
+        queue = self._queues[key]
+        try:
+            while len(queue) > 0:
+                batch = self._next_batch(queue)
+                if len(batch) == 0:
+                    continue
+
+                kwargs = batch[0].kwargs
+                if len(batch) > 1:
+                    kwargs = {'content': '\n'.join(item.kwargs['content'] for item in batch)}
+                    self.stats['coalesced'] += len(batch) - 1
+
+                try:
+                    if 'embeds' in kwargs:
+                        message = await send_embeds(destination, **kwargs)
+                    else:
+                        message = await destination.send(**kwargs)
+                except asyncio.CancelledError:
+                    raise
+                except Exception as e:
+                    self.stats['errors'] += 1
+                    log.debug('Could not send a message to %s: %s', destination, str(e))
+                    for item in batch:
+                        item.resolve(exception=e)
+                    continue
+
+                now = time.monotonic()
+                self.stats['sent'] += 1
+                for item in batch:
+                    self.latency.add(now - item.enqueued)
+                    item.resolve(message)
+        finally:
+            self._workers.pop(key, None)
+            if len(queue) == 0:
+                self._queues.pop(key, None)
+
+    def _next_batch(self, queue):
+        now = time.monotonic()
+        _, _, item = heapq.heappop(queue)
+        if item.max_age is not None and now - item.enqueued > item.max_age:
+            self.stats['dropped'] += 1
+            item.resolve(None)
+            return []
+
+        batch = [item]
+        if item.priority != PRIORITY_LOW or not item.is_text:
+            return batch
+
+        length = len(item.kwargs['content'])
+        while len(queue) > 0:
+            _, _, other = queue[0]
+            if other.priority != PRIORITY_LOW or not other.is_text:
+                break
+
+            new_length = length + 1 + len(other.kwargs['content'])
+            if new_length > self.max_length:
+                break
+
+            heapq.heappop(queue)
+            if other.max_age is not None and now - other.enqueued > other.max_age:
+                self.stats['dropped'] += 1
+                other.resolve(None)
+                continue
+
+            batch.append(other)
+            length = new_length
+
+        return batch
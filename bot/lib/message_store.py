@@ -0,0 +1,151 @@
+from collections import OrderedDict, deque
+
+from bot import constants
+
+
+class StoredMessage:
+    """
+    The parts of a discord.Message needed to log it after it's deleted or edited.
+    """
+    __slots__ = ('id', 'guild_id', 'channel_id', 'author_id', 'author_name', 'content', 'attachments',
+                 'created_at', 'edited_at')
+
+    # Approximate size of a record without its texts, used to bound the store's memory
+    overhead = 300
+
+    def __init__(self, msg_id, guild_id, channel_id, author_id, author_name, content, attachments, created_at,
+                 edited_at=None):
+        self.id = msg_id
+        self.guild_id = guild_id
+        self.channel_id = channel_id
+        self.author_id = author_id
+        self.author_name = author_name
+        self.content = content
+        self.attachments = attachments
+        self.created_at = created_at
+        self.edited_at = edited_at
+
+    @staticmethod
+    def from_message(message):
+        """
+        :param message: The discord.Message instance.
+        :return: The StoredMessage for the message. Attachments are stored as (filename, url, is_image) tuples.
+        """
+        return StoredMessage(
+            message.id, message.guild.id if message.guild else None, message.channel.id, message.author.id,
+            message.author.display_name, message.content,
+            tuple((f.filename, f.url, bool(f.width)) for f in message.attachments),
+            message.created_at, message.edited_at)
+
+    @property
+    def link(self):
+        return '{}/channels/{}/{}/{}'.format(constants.DISCORD_BASE, self.guild_id or '@me', self.channel_id, self.id)
+
+    @property
+    def size(self):
+        return self.overhead + len(self.content) + sum(len(name) + len(url) for name, url, _ in self.attachments)
+
+
+class MessageStore:
+    """
+    Keeps the recent messages of each channel as compact records, so they're available when the raw message
+    delete and edit events are received, without depending on discord.py's message cache. Each channel keeps
+    its last *channel_size* messages, and the oldest messages of all channels are removed when the records
+    exceed *max_bytes*.
+    """
+
+    def __init__(self, channel_size=500, max_bytes=16 * 1024 * 1024):
+        self.channel_size = channel_size
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.stats = {'stored': 0, 'evicted': 0}
+        self._messages = OrderedDict()
+        self._channels = {}
+
+    def __len__(self):
+        return len(self._messages)
+
+    def __contains__(self, message_id):
+        return message_id in self._messages
+
+    def add(self, message):
+        """
+        Stores a message.
+        :param message: The discord.Message instance.
+        :return: The StoredMessage instance.
+        """
+        record = StoredMessage.from_message(message)
+        old = self._messages.pop(record.id, None)
+        if old is not None:
+            # The message keeps its place on the channel's list
+            self.size -= old.size
+        self._messages[record.id] = record
+        self.size += record.size
+        self.stats['stored'] += 1
+
+        channel = self._channels.setdefault(record.channel_id, deque())
+        if old is None:
+            channel.append(record.id)
+        while len(channel) > self.channel_size:
+            self._remove(channel[0])
+            self.stats['evicted'] += 1
+
+        while self.size > self.max_bytes and len(self._messages) > 0:
+            _, old = self._messages.popitem(last=False)
+            self.size -= old.size
+            self._unlink(old)
+            self.stats['evicted'] += 1
+
+        return record
+
+    def get(self, message_id):
+        return self._messages.get(message_id)
+
+    def pop(self, message_id):
+        """
+        Removes a message from the store.
+        :param message_id: The message ID.
+        :return: The StoredMessage instance, or None if the message was not stored.
+        """
+        return self._remove(message_id)
+
+    def update(self, message_id, content, edited_at):
+        """
+        Updates the content of a stored message.
+        :return: The updated StoredMessage instance, or None if the message was not stored.
+        """
+        record = self._messages.get(message_id)
+        if record is None:
+            return None
+
+        self.size += len(content) - len(record.content)
+        record.content = content
+        record.edited_at = edited_at
+        return record
+
+    def _remove(self, message_id):
+        record = self._messages.pop(message_id, None)
+        if record is not None:
+            self.size -= record.size
+            self._unlink(record)
+        return record
+
+    def _unlink(self, record):
+        """
+        Removes a message from its channel's list. Messages are usually removed from the start of the list, so
+        that case avoids a search.
+        """
+        channel = self._channels.get(record.channel_id)
+        if channel is None:
+            return
+
+        if len(channel) > 0 and channel[0] == record.id:
+            channel.popleft()
+        else:
+            try:
+                channel.remove(record.id)
+            except ValueError:
+                pass
+
+        if len(channel) == 0:
+            del self._channels[record.channel_id]
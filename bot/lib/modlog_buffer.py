@@ -0,0 +1,152 @@
+import asyncio
+from collections import Counter
+
+import discord
+
+from bot.lib.message_queue import PRIORITY_LOW
+from bot.logger import new_logger
+from bot.utils import text_cut
+
+log = new_logger('ModlogBuffer')
+
+
+class ModlogEntry:
+    __slots__ = ('content', 'embed', 'logtype')
+
+    def __init__(self, content, embed, logtype):
+        self.content = content
+        self.embed = embed
+        self.logtype = logtype
+
+
+class ModlogBuffer:
+    """
+    Buffers the modlog entries of each modlog channel for a short time, and sends them together in messages
+    with up to 10 embeds each, instead of a message per entry. When there are too many entries (e.g. a purge or
+    a raid), only the first messages are sent and the rest of the entries are summarized in a single message.
+    """
+
+    flush_delay = 2
+    max_embeds = 10
+    # Discord's limits for a message
+    max_content = 2000
+    max_embeds_length = 6000
+    max_description = 2048
+    # Messages sent per flush before the remaining entries are summarized
+    max_messages = 5
+
+    def __init__(self, bot):
+        self.bot = bot
+        self.stats = {'entries': 0, 'messages': 0, 'summarized': 0}
+        self._entries = {}
+        self._tasks = {}
+
+    def add(self, channel, content=None, embed=None, locales=None, logtype=None):
+        """
+        Adds an entry to the channel's buffer. The texts are translated right away, as each entry has its own
+        locales.
+        :param channel: The modlog channel.
+        :param content: The entry text.
+        :param embed: The entry embed.
+        :param locales: Locale variables for language messages.
+        :param logtype: The modlog type of the entry, used on the summary.
+        """
+        kwargs = {'content': content, 'embed': embed, 'locales': locales, 'destination': channel}
+        self.bot.manager.dispatch_ref('pre_send_message', kwargs)
+        if not kwargs['content'] and kwargs['embed'] is None:
+            return
+
+        self._entries.setdefault(channel.id, []).append(ModlogEntry(kwargs['content'], kwargs['embed'], logtype))
+        self.stats['entries'] += 1
+        if channel.id not in self._tasks:
+            self._tasks[channel.id] = self.bot.loop.create_task(self._flush_later(channel))
+
+    def cancel(self):
+        for task in self._tasks.values():
+            task.cancel()
+
+        self._tasks.clear()
+        self._entries.clear()
+
+    async def _flush_later(self, channel):
+        # The task stays registered until its messages are sent, and the entries added meanwhile are flushed
+        # afterwards by the same task, so the messages of a channel are never sent out of order
+        try:
+            while channel.id in self._entries:
+                await asyncio.sleep(self.flush_delay)
+                await self._flush(channel, self._entries.pop(channel.id, []))
+        finally:
+            self._tasks.pop(channel.id, None)
+
+    async def _flush(self, channel, entries):
+        messages = self.pack(entries)
+        for content, embeds, _ in messages[:self.max_messages]:
+            await self._send(channel, content, embeds)
+
+        omitted = [entry for msg in messages[self.max_messages:] for entry in msg[2]]
+        if len(omitted) > 0:
+            self.stats['summarized'] += len(omitted)
+            types = Counter(entry.logtype or 'other' for entry in omitted)
+            types = ', '.join('{} ({})'.format(k, v) for k, v in types.most_common())
+            kwargs = {'content': '$[modlog-summary]', 'locales': {'count': len(omitted), 'types': types},
+                      'destination': channel}
+            self.bot.manager.dispatch_ref('pre_send_message', kwargs)
+            await self._send(channel, kwargs['content'], [])
+
+    def pack(self, entries):
+        """
+        Groups entries in messages, respecting Discord's limits and the order of the entries. As a message's text
+        is shown above its embeds, a text entry that follows an embed starts a new message.
+        :param entries: The list of ModlogEntry instances.
+        :return: A list of (content, embeds, entries) tuples.
+        """
+        messages = []
+        lines, embeds, packed = [], [], []
+        content_len = embeds_len = 0
+
+        for entry in entries:
+            content = entry.content or ''
+            embed = entry.embed
+            if embed is not None and content:
+                # Keep the entry's text next to its embed
+                desc = embed.description if embed.description != discord.Embed.Empty else ''
+                embed.description = text_cut(content + ('\n\n' + desc if desc else ''), self.max_description)
+                content = ''
+
+            entry_len = len(embed) if embed is not None else 0
+            full = content and len(embeds) > 0 or \
+                len(embeds) >= self.max_embeds and embed is not None or \
+                embeds_len + entry_len > self.max_embeds_length or \
+                content_len + len(content) + 1 > self.max_content
+            if full and len(packed) > 0:
+                messages.append(('\n'.join(lines), embeds, packed))
+                lines, embeds, packed = [], [], []
+                content_len = embeds_len = 0
+
+            if content:
+                lines.append(text_cut(content, self.max_content))
+                content_len += len(lines[-1]) + 1
+            if embed is not None:
+                embeds.append(embed)
+                embeds_len += entry_len
+            packed.append(entry)
+
+        if len(packed) > 0:
+            messages.append(('\n'.join(lines), embeds, packed))
+
+        return messages
+
+    async def _send(self, channel, content, embeds):
+        if len(embeds) > 1:
+            kwargs = {'content': content, 'embeds': embeds}
+        else:
+            kwargs = {'content': content, 'embed': embeds[0] if len(embeds) == 1 else None}
+
+        # The texts were already translated when the entries were added, the message is only logged here
+        self.stats['messages'] += 1
+        log.debug('Sending modlog message "%s" to %s (IDS %s#%s) with %s embeds: %s', content, channel, channel.id,
+                  channel.guild.id, len(embeds), [embed.to_dict() for embed in embeds])
+        try:
+            await self.bot.message_queue.send(channel, kwargs, PRIORITY_LOW)
+        except discord.HTTPException as e:
+            log.debug('Could not send modlog entries to %s: %s', channel, str(e))
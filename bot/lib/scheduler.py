@@ -0,0 +1,238 @@
+import asyncio
+import heapq
+import itertools
+import random
+import time
+from datetime import datetime
+
+from bot.lib.http_breaker import ServiceUnavailable
+from bot.logger import new_logger
+
+log = new_logger('Scheduler')
+
+
+class ScheduledJob:
+    """
+    A task registered on the Scheduler, with its settings and run statistics.
+    """
+    __slots__ = ('name', 'task', 'interval', 'mode', 'jitter', 'max_concurrency', 'missed', 'scheduled',
+                 'next_run', 'running', 'runs', 'failures', 'skipped', 'last_start', 'last_duration', 'last_error',
+                 'cancelled', 'handles')
+
+    FIXED_RATE = 'rate'
+    FIXED_DELAY = 'delay'
+    MISSED_SKIP = 'skip'
+    MISSED_RUN_ONCE = 'run_once'
+
+    def __init__(self, name, task, interval=0, mode=FIXED_RATE, jitter=0, max_concurrency=1, missed=MISSED_SKIP):
+        if interval < 0:
+            raise RuntimeError('Task interval time must be positive')
+        if mode not in [ScheduledJob.FIXED_RATE, ScheduledJob.FIXED_DELAY]:
+            raise ValueError('Invalid task mode: {}'.format(mode))
+        if missed not in [ScheduledJob.MISSED_SKIP, ScheduledJob.MISSED_RUN_ONCE]:
+            raise ValueError('Invalid missed runs policy: {}'.format(missed))
+
+        self.name = name
+        self.task = task
+        self.interval = interval
+        self.mode = mode
+        self.jitter = jitter
+        self.max_concurrency = max(1, max_concurrency)
+        self.missed = missed
+        self.scheduled = None
+        self.next_run = None
+        self.running = 0
+        self.runs = 0
+        self.failures = 0
+        self.skipped = 0
+        self.last_start = None
+        self.last_duration = None
+        self.last_error = None
+        self.cancelled = False
+        self.handles = set()
+
+    @property
+    def repeats(self):
+        return self.interval > 0
+
+
+class Scheduler:
+    """
+    Runs all the bot's scheduled tasks from a single loop, by using a heap ordered by the next run time.
+    Times are handled with the event loop's monotonic clock, so they are not affected by system clock changes.
+    """
+
+    def __init__(self, loop=None):
+        self.loop = loop or asyncio.get_event_loop()
+        self.jobs = {}
+        self._heap = []
+        self._seq = itertools.count()
+        self._runner = None
+        self._wakeup = None
+
+    def add(self, name, task, interval=0, *, delay=0, force=False, **options):
+        """
+        Registers a task to be run every *interval* seconds, or once if the interval is zero.
+        :param name: The job name. It must be unique.
+        :param task: The coroutine function to run.
+        :param interval: The time in seconds between runs.
+        :param delay: The time in seconds to wait before the first run.
+        :param force: What to do if the job already exists. If True, the job is replaced.
+        :param options: ScheduledJob options: mode (fixed "rate" or "delay"), jitter (seconds), max_concurrency
+        and missed (the missed runs policy for fixed rate jobs: "skip" drops the late runs, "run_once" runs
+        once to catch up).
+        :return: The ScheduledJob instance, or the current one if it already existed and force is False.
+        """
+        if name in self.jobs:
+            if not force:
+                return self.jobs[name]
+            self.remove(name)
+
+        job = ScheduledJob(name, task, interval, **options)
+        self.jobs[name] = job
+        self._push(job, self.loop.time() + delay)
+
+        if job.repeats:
+            log.debug('Task "%s" created, repeating every %s seconds (%s)', name, interval, job.mode)
+        else:
+            log.debug('Task "%s" created, running once', name)
+
+        return job
+
+    def add_at(self, name, task, when, force=False):
+        """
+        Registers a task to be run once at an absolute time.
+        :param name: The job name.
+        :param task: The coroutine function to run.
+        :param when: A datetime (local time) or a UNIX timestamp.
+        :param force: Replace the job if it already exists.
+        :return: The ScheduledJob instance.
+        """
+        if isinstance(when, datetime):
+            delay = (when - datetime.now()).total_seconds()
+        else:
+            delay = when - time.time()
+
+        return self.add(name, task, 0, delay=max(0, delay), force=force)
+
+    def remove(self, name):
+        """
+        Removes a job, cancelling its running executions.
+        :param name: The job name.
+        :return: A boolean depending if the job existed.
+        """
+        job = self.jobs.pop(name, None)
+        if job is None:
+            return False
+
+        # The heap entry is discarded when it's popped
+        job.cancelled = True
+        for handle in list(job.handles):
+            handle.cancel()
+
+        log.debug('Task "%s" removed', name)
+        return True
+
+    def stop(self):
+        """
+        Removes all the jobs and stops the scheduler loop.
+        """
+        for name in list(self.jobs.keys()):
+            self.remove(name)
+
+        self._heap = []
+        if self._runner is not None:
+            self._runner.cancel()
+            self._runner = None
+
+    def _push(self, job, scheduled):
+        # The jitter is not accumulated between runs, only the scheduled time is used to calculate the next one
+        when = scheduled
+        if job.jitter > 0:
+            when += random.uniform(0, job.jitter)
+
+        job.scheduled = scheduled
+        job.next_run = when
+        heapq.heappush(self._heap, (when, next(self._seq), job))
+
+        if self._runner is None or self._runner.done():
+            self._runner = self.loop.create_task(self._run())
+        elif self._wakeup is not None and self._heap[0][2] is job:
+            self._wakeup.set()
+
+    async def _run(self):
+        self._wakeup = asyncio.Event()
+        while True:
+            if len(self._heap) == 0:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+
+            when, _, job = self._heap[0]
+            now = self.loop.time()
+            if when > now:
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), when - now)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            heapq.heappop(self._heap)
+            if job.cancelled or job.next_run != when:
+                continue
+
+            late = job.repeats and job.mode == ScheduledJob.FIXED_RATE and now - job.scheduled >= job.interval
+            if late and job.missed == ScheduledJob.MISSED_SKIP:
+                job.skipped += 1
+                log.debug('Task "%s" missed its run time, skipping run', job.name)
+            elif job.running >= job.max_concurrency:
+                job.skipped += 1
+                log.debug('Task "%s" is still running, skipping run', job.name)
+            else:
+                # The slot is taken before the task starts, so the limit applies to runs started on this same pass
+                job.running += 1
+                handle = self.loop.create_task(self._execute(job))
+                job.handles.add(handle)
+                handle.add_done_callback(job.handles.discard)
+
+            if job.repeats and job.mode == ScheduledJob.FIXED_RATE:
+                self._push(job, self._next_rate_time(job, now))
+            elif not job.repeats:
+                self.jobs.pop(job.name, None)
+
+    def _next_rate_time(self, job, now):
+        next_run = job.scheduled + job.interval
+        if next_run >= now:
+            return next_run
+
+        # Runs were missed (e.g. the loop was blocked). The late run was already skipped, or run as the catch-up run
+        # with the "run_once" policy, so the next run keeps the original alignment.
+        missed = int((now - job.scheduled) // job.interval)
+        job.skipped += missed
+        return job.scheduled + (missed + 1) * job.interval
+
+    async def _execute(self, job):
+        # job.running was already increased by _run
+        job.last_start = datetime.now()
+        start = self.loop.time()
+
+        try:
+            await job.task()
+            job.last_error = None
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            job.failures += 1
+            job.last_error = '{}: {}'.format(e.__class__.__name__, str(e))
+            if isinstance(e, ServiceUnavailable):
+                log.debug('Task "%s" failed: %s', job.name, str(e))
+            else:
+                log.exception(e)
+        finally:
+            job.running -= 1
+            job.runs += 1
+            job.last_duration = self.loop.time() - start
+
+            if job.repeats and job.mode == ScheduledJob.FIXED_DELAY and not job.cancelled and job.running == 0:
+                self._push(job, self.loop.time() + job.interval)
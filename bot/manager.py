@@ -2,10 +2,10 @@ import asyncio
 import importlib
 import inspect
 
-import aiohttp
 
 from bot.logger import new_logger
 from .command import Command
+from .lib.scheduler import Scheduler
 
 import modules as bot_modules
 from bot import modules as sys_modules
@@ -20,14 +20,14 @@ class Manager:
         self.bot = bot
 
         self.cmds = {}
-        self.tasks = {}
         self.swhandlers = {}
         self.cmd_instances = []
         self.mention_handlers = []
         self.tasks_loop = asyncio.get_event_loop()
+        self.scheduler = Scheduler(self.tasks_loop)
 
         headers = {'User-Agent': '{}/{} +discord.cl/bot'.format(bot.__class__.name, bot.__class__.__version__)}
-        self.http = aiohttp.ClientSession(headers=headers, cookie_jar=aiohttp.CookieJar(unsafe=True))
+        self.http = bot.http_client.session('Manager', headers)
 
     def load_instances(self):
         """Loads instances for the command classes loaded"""
@@ -54,6 +54,9 @@ class Manager:
             return
 
         log.debug('Disabling %s module...', name)
+        if hasattr(instance, 'on_unload'):
+            log.debug('Calling on_unload for "%s"', name)
+            instance.on_unload()
 
         # Unload commands
         cmd_names = [n for n in [instance.name] + instance.aliases if n != '']
@@ -75,12 +78,11 @@ class Manager:
             if mhandler.__class__.__name__ == name:
                 self.mention_handlers.remove(mhandler)
 
-        # Hackily unload task
-        for task_name in list(self.tasks.keys()):
+        # Unload scheduled tasks
+        for task_name in list(self.scheduler.jobs.keys()):
             if task_name.startswith(name+'.'):
                 log.debug('Cancelling task %s', task_name)
-                self.tasks[task_name].cancel()
-                del self.tasks[task_name]
+                self.scheduler.remove(task_name)
 
         # Remove from instances list
         self.cmd_instances.remove(instance)
@@ -128,63 +130,42 @@ class Manager:
         instances = self.cmd_instances if instance is None else [instance]
 
         for instance in instances:
-            # Scheduled (repetitive) tasks
-            if isinstance(instance.schedule, list):
-                for (task, seconds) in instance.schedule:
-                    self.schedule(task, seconds)
-            elif isinstance(instance.schedule, tuple):
-                task, seconds = instance.schedule
-                self.schedule(task, seconds)
-
-    async def run_task(self, task, time=0):
-        """
-        Runs a task on a given interval
-        :param task: The task function
-        :param time: The time in seconds to repeat the task
-        """
-        while 1:
-            try:
-                # log.debug('Running task %s', repr(task))
-                await task()
-            except Exception as e:
-                log.exception(e)
-            finally:
-                if time == 0:
-                    log.debug('Run-once task finished: %s', repr(task))
-                    break
-                if self.bot.loop.is_closed():
-                    log.debug('Bot stopped before running, task not running anymore: %s', repr(task))
-                    break
-                await asyncio.sleep(time)
-                if self.bot.loop.is_closed():
-                    log.debug('Bot stopped, task not running anymore: %s', repr(task))
-                    break
-
-    def schedule(self, task, time=0, force=False):
+            # Scheduled (repetitive) tasks, as (task, seconds) or (task, seconds, options) tuples
+            schedule = instance.schedule
+            if isinstance(schedule, tuple):
+                schedule = [schedule]
+            if not isinstance(schedule, list):
+                continue
+
+            for item in schedule:
+                options = item[2] if len(item) > 2 else {}
+                self.schedule(item[0], item[1], **options)
+
+    def schedule(self, task, time=0, force=False, **options):
         """
-        Adds a task to the loop to be run every *time* seconds.
+        Adds a task to the scheduler to be run every *time* seconds.
         :param task: The task function
-        :param time: The time in seconds to repeat the task
+        :param time: The time in seconds to repeat the task. If it's zero, the task is run once.
         :param force: What to do if the task was already created. If True, the task is cancelled and created again.
+        :param options: Additional scheduling options (see `bot.lib.scheduler.ScheduledJob`): mode
+        ("rate" or "delay"), jitter, max_concurrency and missed ("skip" or "run_once").
+        :return: The `bot.lib.scheduler.ScheduledJob` instance.
         """
-        if time < 0:
-            raise RuntimeError('Task interval time must be positive')
-
         task_name = '{}.{}'.format(task.__self__.__class__.__name__, task.__name__)
-        if task_name in self.tasks:
-            if not force:
-                return
-            self.tasks[task_name].cancel()
-
-        task_ins = self.tasks_loop.create_task(self.run_task(task, time))
-        self.tasks[task_name] = task_ins
+        return self.scheduler.add(task_name, task, time, force=force, **options)
 
-        if time > 0:
-            log.debug('Task "%s" created, repeating every %i seconds', task_name, time)
-        else:
-            log.debug('Task "%s" created, running once', task_name)
-
-        return task_ins
+    def schedule_at(self, task, when, name=None, force=False):
+        """
+        Runs a task once at an absolute time.
+        :param task: The task function
+        :param when: A datetime or a UNIX timestamp.
+        :param name: The job name. By default, it's the task's class and function names.
+        :param force: If True and the job already existed, it's replaced.
+        :return: The `bot.lib.scheduler.ScheduledJob` instance.
+        """
+        if name is None:
+            name = '{}.{}'.format(task.__self__.__class__.__name__, task.__name__)
+        return self.scheduler.add_at(name, task, when, force=force)
 
     def get_handlers(self, name):
         return [getattr(c, name, None) for c in self.cmd_instances if callable(getattr(c, name, None))]
@@ -281,9 +262,7 @@ class Manager:
         return False
 
     def cancel_tasks(self):
-        for task_name in list(self.tasks.keys()):
-            self.tasks[task_name].cancel()
-            del self.tasks[task_name]
+        self.scheduler.stop()
         log.debug('All tasks cancelled.')
 
     def close_http(self):
@@ -291,12 +270,8 @@ class Manager:
         loop.create_task(self.close_http_async())
 
     async def close_http_async(self):
-        for i in self.cmd_instances:
-            await i.http.close()
-
-        await self.http.close()
+        await self.bot.http_client.close()
         await self.bot.http.close()
-        log.debug('HTTP sessions closed.')
 
     def __getitem__(self, item):
         return self.get_cmd(item)
@@ -18,11 +18,13 @@ class BotStats(Command):
             'dpy_version': discord.__version__,
             'bot_class': self.bot.__class__.__name__,
             'bot_version': self.bot.__version__,
-            'num_users': len(self.bot.users),
-            'num_bots': len([x for x in self.bot.users if x.bot]),
-            'num_guilds': len(self.bot.guilds),
+            'num_users': self.bot.counters.users + self.bot.counters.bots,
+            'num_bots': self.bot.counters.bots,
+            'num_guilds': self.bot.counters.guilds,
             'uptime': deltatime_to_time(self.bot.uptime),
         }
+        queue = self.bot.message_queue.get_stats()
+        queue['latency_mean'] = int(queue['latency_mean'] * 1000)
 
         machine_info = '{system} {release} ({machine}) @ {node}'.format(**platform.uname()._asdict())
         await cmd.answer(
@@ -30,8 +32,10 @@ class BotStats(Command):
             f'Machine: {machine_info}\n'
             'Version: Python {python_version}, discord.py {dpy_version}, {bot_class} {bot_version}\n'
             'Users: {num_users} ({num_bots} bots), {num_guilds} guilds\n'
-            'Uptime: {uptime}'
-            '```'.format(**data),
+            'Uptime: {uptime}\n'
+            'Messages queue: {depth} queued, {sent} sent, {coalesced} joined, {dropped} dropped, '
+            'mean wait {latency_mean}ms'
+            '```'.format(**data, **queue),
             as_embed=True,
             title=':desktop: Bot system information'
         )
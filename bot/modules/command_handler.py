@@ -5,6 +5,7 @@ from discord import Colour
 from bot import Command, CommandEvent, BotMentionEvent, MessageEvent
 from bot.lib.common import is_bot_owner, is_owner, is_pm
 from bot.lib.guild_configuration import GuildConfiguration
+from bot.lib.http_breaker import ServiceUnavailable
 
 
 class CommandHandler(Command):
@@ -24,6 +25,9 @@ class CommandHandler(Command):
 
         try:
             await event.handle()
+        except ServiceUnavailable as e:
+            await event.answer('$[http-service-unavailable]', locales={'host': e.host})
+            self.log.debug(str(e))
         except Exception as e:
             if self.bot.config['debug']:
                 content = '```{}```'.format(traceback.format_exc())
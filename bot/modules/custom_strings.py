@@ -0,0 +1,65 @@
+from discord import Embed
+
+from bot import Command, categories
+from bot.lib.language import check_override
+from bot.utils import text_cut
+
+
+class CustomStrings(Command):
+    max_length = 1500
+    max_strings = 100
+
+    def __init__(self, bot):
+        super().__init__(bot)
+        self.name = 'customstring'
+        self.aliases = ['customstrings']
+        self.help = '$[customstring-help]'
+        self.format = '$[customstring-format]'
+        self.category = categories.STAFF
+        self.allow_pm = False
+        self.owner_only = True
+
+    async def handle(self, cmd):
+        resolver = self.bot.lang_resolver
+        lang_code = self.get_lang(cmd.guild).lang
+        strings = resolver.get_overrides(cmd.guild.id).get(lang_code, {})
+
+        if cmd.argc == 0:
+            if len(strings) == 0:
+                await cmd.answer('$[customstring-none]', locales={'lang': lang_code})
+                return
+
+            items = ['`{}`: {}'.format(k, text_cut(v, 100)) for k, v in sorted(strings.items())]
+            embed = Embed(title='$[customstring-list-title]', description=text_cut('\n'.join(items), 2000))
+            await cmd.answer(embed, locales={'lang': lang_code})
+            return
+
+        name = cmd.args[0]
+        if name not in self.bot.lang.catalog.get(lang_code, {}):
+            await cmd.answer('$[customstring-not-found]', locales={'name': name})
+            return
+
+        if cmd.argc == 1:
+            if resolver.remove_override(cmd.guild.id, lang_code, name):
+                await cmd.answer('$[customstring-removed]', locales={'name': name})
+            else:
+                await cmd.answer('$[customstring-not-custom]', locales={'name': name})
+            return
+
+        value = cmd.text[len(name):].strip()
+        if len(value) > self.max_length:
+            await cmd.answer('$[customstring-too-long]', locales={'limit': self.max_length})
+            return
+
+        base = self.bot.lang.catalog[lang_code][name]
+        if not check_override(value, base):
+            fields = ', '.join('`{{{}}}`'.format(f) for f in sorted(base.field_names())) or '-'
+            await cmd.answer('$[customstring-invalid-fields]', locales={'fields': fields})
+            return
+
+        if name not in strings and len(strings) >= self.max_strings:
+            await cmd.answer('$[customstring-limit]', locales={'limit': self.max_strings})
+            return
+
+        resolver.set_override(cmd.guild.id, lang_code, name, value)
+        await cmd.answer('$[customstring-set]', locales={'name': name, 'lang': lang_code})
@@ -0,0 +1,64 @@
+from bot import Command, categories
+
+
+class HttpStatusCmd(Command):
+    def __init__(self, bot):
+        super().__init__(bot)
+        self.name = 'http'
+        self.help = '$[http-help]'
+        self.format = '$[http-format]'
+        self.bot_owner_only = True
+        self.category = categories.SETTINGS
+
+    async def handle(self, cmd):
+        client = self.bot.http_client
+        if cmd.argc > 0 and cmd.args[0] == 'modules':
+            items = ['{}: {}'.format(name, self.format_stats(stats))
+                     for name, stats in sorted(client.metrics.modules.items())]
+        elif cmd.argc > 0 and cmd.args[0] == 'client':
+            stats = client.get_stats()
+            cache = stats['cache']
+            items = [
+                'requests: {requests}, pending: {pending}, coalesced: {coalesced}, errors: {errors}'.format(**stats),
+                'sessions: {}, connections created: {}, reused: {}, idle: {}, acquired: {}'.format(
+                    stats['sessions'], stats['connections_created'], stats['connections_reused'],
+                    stats.get('connections_idle', 0), stats.get('connections_acquired', 0)),
+                'cache: {} entries ({} KiB), hit rate {:.1%}, stale hits {}, evictions {}'.format(
+                    cache['entries'], cache['bytes'] // 1024, cache['hit_rate'], cache['stale_hits'],
+                    cache['evictions'])
+            ]
+        elif cmd.argc == 0:
+            items = []
+            for host, breaker in sorted(client.breakers.items()):
+                host_stats = self.format_stats(client.metrics.hosts.get(host))
+                items.append('{}: {}, {}'.format(host, breaker.state, host_stats))
+                if breaker.failures > 0:
+                    items.append('  consecutive failures: {}, read timeout {:.1f}s'.format(
+                        breaker.failures, breaker.timeout(client.timeout)))
+        else:
+            await cmd.answer('$[format]: $[http-format]')
+            return
+
+        if len(items) == 0:
+            await cmd.answer('$[http-no-hosts]')
+            return
+
+        await cmd.answer('```yml\n{}```'.format('\n'.join(items)), as_embed=True,
+                         title=':globe_with_meridians: $[http-title]')
+
+    @staticmethod
+    def format_stats(stats):
+        if stats is None:
+            return 'no requests'
+
+        total = stats.latencies['total']
+        statuses = ' '.join('{}x{}'.format(code, amount) for code, amount in sorted(stats.statuses.items()))
+        return '{} requests, {} errors, {} KiB, p50 {} p95 {} [{}]'.format(
+            stats.requests, stats.errors, stats.bytes_in // 1024, HttpStatusCmd.format_time(total.percentile(50)),
+            HttpStatusCmd.format_time(total.percentile(95)), statuses or '-')
+
+    @staticmethod
+    def format_time(value):
+        if value is None:
+            return '-'
+        return '>30s' if value == float('inf') else '≤{}ms'.format(int(value * 1000))
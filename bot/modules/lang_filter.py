@@ -2,24 +2,50 @@ import discord
 
 from bot import Command, CommandEvent
 from bot.lib.guild_configuration import GuildConfiguration
-from bot.utils import replace_everywhere
 
 
 class LangFilter(Command):
     def __init__(self, bot):
         super().__init__(bot)
         self.priority = 10
-        self.autolang_cache = {}
         self.name = 'resetlangs'
         self.help = '$[config-resetlangs-help]'
         self.bot_owner_only = True
 
     async def handle(self, cmd):
-        self.autolang_cache = {}
+        self.bot.lang_resolver.clear()
         await cmd.answer('$[config-resetlangs-done]')
 
+    async def on_ready(self):
+        for guild in self.bot.guilds:
+            self.bot.lang_resolver.index_guild(guild)
+
+    async def on_guild_join(self, guild):
+        self.bot.lang_resolver.index_guild(guild)
+
+    async def on_guild_remove(self, guild):
+        self.bot.lang_resolver.unindex_guild(guild)
+
+    async def on_member_join(self, member):
+        self.bot.lang_resolver.index_member(member)
+
+    async def on_member_remove(self, member):
+        self.bot.lang_resolver.unindex_member(member)
+
     def pre_send_message(self, kwargs):
         lang = self.auto_lang(kwargs)
+        evt = kwargs.get('event', None)
+        locales = kwargs.get('locales', None)
+        prefix = GuildConfiguration.get_instance(getattr(evt, 'guild', None)).prefix
+
+        # All the variables and language placeholders are replaced on a single pass per text
+        variables = {'PX': prefix}
+        if evt:
+            variables['AU'] = evt.author_name
+            if isinstance(evt, CommandEvent):
+                variables['NM'] = evt.cmdname
+            variables['CMD'] = prefix + variables.get('NM', '$NM')
+
         if 'content' in kwargs:
             if kwargs['content'] is None:
                 kwargs['content'] = ''
@@ -28,35 +54,10 @@ class LangFilter(Command):
                 kwargs['content'] = str(kwargs['content'])
 
             if kwargs['content'] != '':
-                kwargs['content'] = lang.format(kwargs['content'], kwargs.get('locales', None))
-
-        if kwargs.get('embed', None) is not None:
-            kwargs['embed'] = lang.format(kwargs['embed'], kwargs.get('locales', None))
-
-        if kwargs.get('event', None):
-            kwargs['content'] = kwargs['content'].replace('$AU', kwargs['event'].author_name)
-            kwargs['content'] = kwargs['content'].replace('$CMD', '$PX$NM')
-
-            if kwargs.get('embed', None) is not None:
-                replace_everywhere(kwargs['embed'], '$CMD', '$PX$NM')
-                replace_everywhere(kwargs['embed'], '$AU', kwargs['event'].author_name)
-
-            if isinstance(kwargs['event'], CommandEvent):
-                kwargs['content'] = kwargs['content'].replace('$NM', kwargs['event'].cmdname)
-
-                if kwargs.get('embed', None) is not None:
-                    replace_everywhere(kwargs['embed'], '$NM', kwargs['event'].cmdname)
-
-        evt = kwargs.get('event')
-        guild = getattr(evt, 'guild', None)
-        prefix = GuildConfiguration.get_instance(guild).prefix
-
-        if 'content' in kwargs and kwargs['content']:
-            kwargs['content'] = kwargs['content'].replace('$PX', prefix)
-            kwargs['content'] = kwargs['content'].lstrip(prefix)
+                kwargs['content'] = lang.format(kwargs['content'], locales, variables).lstrip(prefix)
 
         if kwargs.get('embed', None) is not None:
-            replace_everywhere(kwargs['embed'], '$PX', prefix)
+            kwargs['embed'] = lang.format(kwargs['embed'], locales, variables)
 
     def auto_lang(self, kwargs):
         """
@@ -76,37 +77,21 @@ class LangFilter(Command):
             return self.get_lang(destination.guild, destination)
 
         # If the destination is a user
-        elif isinstance(destination, discord.channel.DMChannel) \
-                or isinstance(destination, discord.channel.GroupChannel):
+        elif isinstance(destination, (discord.channel.DMChannel, discord.channel.GroupChannel, discord.abc.User)):
             # The event could've been triggered from a guild, so use its language
-            if hasattr(kwargs, 'event') and not kwargs['event'].is_pm:
-                return self.get_lang(kwargs['event'].guild, kwargs['event'].channel)
+            event = kwargs.get('event', None)
+            if event is not None and not event.is_pm:
+                return self.get_lang(event.guild, event.channel)
 
             if isinstance(destination, discord.channel.GroupChannel):
                 user = destination.owner
-            else:
+            elif isinstance(destination, discord.channel.DMChannel):
                 user = destination.recipient
+            else:
+                user = destination
 
-            if user.id in self.autolang_cache:
-                return self.get_lang(self.autolang_cache[user.id])
-
-            # Fetch common guilds between the user and the bot, and get the guilds languages.
-            langs = [
-                self.bot.sv_config.get(sv.id, 'lang', self.bot.config['default_lang'])
-                for sv in self.bot.servers if sv.get_member(user.id) is not None
-            ]
-
-            # If there are no common guilds, just use the default language
-            # (but it's kinda rare to talk to a bot that you don't have any guild in common, right?)
-            if len(langs) == 0:
-                return self.get_lang()
-
-            # Get the mode language from the common user-bot guilds and use it.
-            mode_lang = max(set(langs), key=langs.count)
-            self.autolang_cache[user.id] = mode_lang
-            self.log.debug('Language automatically set to %s for user "%s"', mode_lang, str(user))
-
-            return self.get_lang(mode_lang)
+            # The most used language between the guilds in common with the user is used
+            return self.bot.lang_resolver.get_for_user(user)
 
         # Return the default language
         else:
@@ -22,9 +22,9 @@ class BotStatus(Command):
             lambda: 'version {}'.format(AlexisBot.__version__),
             lambda: 'add with !invite',
             lambda: '!help = commands',
-            lambda: 'in {} guilds'.format(len(self.bot.guilds)),
-            lambda: 'with {} users'.format(len(set([u.id for u in self.bot.get_all_members() if not u.bot]))),
-            lambda: 'with {} bots'.format(len(set([u.id for u in self.bot.get_all_members() if u.bot]))),
+            lambda: 'in {} guilds'.format(self.bot.counters.guilds),
+            lambda: 'with {} users'.format(self.bot.counters.users),
+            lambda: 'with {} bots'.format(self.bot.counters.bots),
             lambda: 'since {}'.format(deltatime_to_time(self.bot.uptime))
         ]
 
@@ -0,0 +1,43 @@
+from bot import Command, categories
+
+
+class TasksCmd(Command):
+    def __init__(self, bot):
+        super().__init__(bot)
+        self.name = 'tasks'
+        self.help = '$[tasks-help]'
+        self.bot_owner_only = True
+        self.category = categories.SETTINGS
+
+    async def handle(self, cmd):
+        scheduler = self.bot.manager.scheduler
+        now = scheduler.loop.time()
+        jobs = sorted(scheduler.jobs.values(), key=lambda j: j.next_run)
+
+        if len(jobs) == 0:
+            await cmd.answer('$[tasks-none]')
+            return
+
+        items = []
+        for job in jobs:
+            if job.repeats:
+                every = '$[tasks-every] {}s ($[tasks-mode-{}])'.format(job.interval, job.mode)
+            else:
+                every = '$[tasks-once]'
+
+            if job.running > 0 and job.next_run <= now:
+                # Fixed delay jobs are scheduled again once the running execution finishes
+                status = '$[tasks-running]'
+            else:
+                status = '$[tasks-next-in] {:.1f}s'.format(max(0, job.next_run - now))
+                if job.running > 0:
+                    status += ', $[tasks-running]'
+
+            last = '-' if job.last_duration is None else '{:.3f}s'.format(job.last_duration)
+            items.append('{}: {}, {}, $[tasks-last-took] {}, $[tasks-runs] {}, $[tasks-failures] {}, '
+                         '$[tasks-skipped] {}'.format(job.name, every, status, last, job.runs, job.failures,
+                                                      job.skipped))
+            if job.last_error:
+                items.append('  $[tasks-last-error]: {}'.format(job.last_error))
+
+        await cmd.answer('```yml\n{}```'.format('\n'.join(items)), as_embed=True, title=':clock3: $[tasks-title]')
@@ -401,7 +401,7 @@ def get_session():
     return aiohttp.ClientSession(headers=headers, timeout=aiohttp.ClientTimeout(total=15))
 
 
-async def download(filename, url, filesize=None):
+async def download(filename, url, filesize=None, session=None):
     basedir = path.abspath(path.join(path.dirname(path.realpath(__file__)), '..', 'cache'))
     if not path.exists(basedir):
         try:
@@ -422,25 +422,33 @@ async def download(filename, url, filesize=None):
 
     try:
         log.debug('Downloading %s from %s', filename, url)
-        async with get_session() as s:
-            async with s.get(url) as r:
-                log.info('File %s downloaded', filename)
-                data = await r.read()
-                try:
-                    with open(filepath, 'wb') as f:
-                        f.write(data)
-                        log.info('File %s stored to %s', filename, filepath)
-                        return filepath
-                except OSError as e:
-                    log.error('Could not store %s file', filename)
-                    log.exception(e)
-                    return None
+        if session is None:
+            async with get_session() as s:
+                data = await _download_data(s, url)
+        else:
+            data = await _download_data(session, url)
+
+        log.info('File %s downloaded', filename)
+        try:
+            with open(filepath, 'wb') as f:
+                f.write(data)
+                log.info('File %s stored to %s', filename, filepath)
+                return filepath
+        except OSError as e:
+            log.error('Could not store %s file', filename)
+            log.exception(e)
+            return None
     except Exception as e:
         log.error('Could not download the %s file', filename)
         log.exception(e)
         return None
 
 
+async def _download_data(session, url):
+    async with session.get(url) as r:
+        return await r.read()
+
+
 def lazy_property(fn):
     """
     Decorator that makes a property lazy-evaluated.
@@ -98,7 +98,7 @@ class BooruSearch(Command):
 
         self.log.debug('Loading %s', search_url)
         await cmd.typing()
-        async with self.http.get(search_url) as r:
+        async with self.http.get(search_url, cache=300) as r:
             if search_types[search_type].get('format', 'json') == 'xml':
                 posts = parsexml(await r.text()).findall('post')
             else:
@@ -1,9 +1,24 @@
+import asyncio
+import calendar
+import random
 import re
+import time
 from base64 import b64encode
-from discord import Embed
+from collections import deque
+from datetime import datetime
+from urllib.parse import urlsplit
 
-from bot import Command
+import aiohttp
+import discord
 import feedparser
+import peewee
+from bs4 import BeautifulSoup
+from discord import Embed
+
+from bot import Command, BaseModel, categories
+from bot.lib.message_queue import PRIORITY_LOW
+from bot.regex import pat_channel
+from bot.utils import text_cut, auto_int
 
 pat_twitter = re.compile(r'^((https?://)?(www\.)?twitter\.com/|@)[a-zA-Z0-9_]{1,50}$')
 pat_reddit_user = re.compile(r'^(https?://(www\.)?reddit.com/u(ser)?/|/?u/)[a-zA-Z0-9_\-]{1,50}$')
@@ -12,29 +27,199 @@ pat_tumblr = re.compile(r'^(?:https?://)?([a-zA-Z0-9\-]{1,50})\.tumblr\.com/?$')
 pat_url = re.compile(r'^https?://[-a-zA-Z0-9@%._+~=]{2,256}\.[a-z]{2,10}\b([-a-zA-Z0-9@:%_+.~#?&/=]*)$')
 
 
-#
-# WIP
-#
+class FeedSource(BaseModel):
+    url = peewee.TextField(unique=True)
+    title = peewee.TextField(default='')
+    etag = peewee.TextField(null=True)
+    last_modified = peewee.TextField(null=True)
+
+
+class FeedFollow(BaseModel):
+    url = peewee.TextField()
+    serverid = peewee.TextField()
+    channelid = peewee.TextField()
+
+    class Meta:
+        indexes = (
+            (('url', 'channelid'), True),
+        )
+
+
+class FeedSeenEntry(BaseModel):
+    url = peewee.TextField()
+    entry_id = peewee.TextField()
+    timestamp = peewee.IntegerField(default=0)
+
+    class Meta:
+        indexes = (
+            (('url', 'timestamp'), False),
+        )
+
+
+class FeedState:
+    """
+    Polling state for a followed feed.
+    """
+    __slots__ = ('url', 'next_check', 'failures')
+
+    def __init__(self, url, next_check):
+        self.url = url
+        self.next_check = next_check
+        self.failures = 0
+
+
+def parse_feed(content):
+    """
+    Parses a feed and extracts the data needed to show its entries. It's run outside of the event loop.
+    :param content: The feed content.
+    :return: A tuple with the feed title and a list of entries as dicts, in the feed's order.
+    """
+    data = feedparser.parse(content)
+    entries = []
+    for entry in data.entries:
+        entry_id = entry.get('id') or entry.get('link') or entry.get('title')
+        if not entry_id:
+            continue
+
+        published = entry.get('published_parsed') or entry.get('updated_parsed')
+        summary = entry.get('summary', '')
+        if '<' in summary:
+            summary = BeautifulSoup(summary, 'html.parser').get_text(' ')
+
+        image = None
+        for media in entry.get('media_thumbnail', []) + entry.get('media_content', []):
+            if media.get('url', '').startswith('http'):
+                image = media['url']
+                break
+
+        entries.append({
+            'id': entry_id, 'title': entry.get('title', ''), 'link': entry.get('link', ''),
+            'summary': ' '.join(summary.split()), 'timestamp': calendar.timegm(published) if published else 0,
+            'image': image
+        })
+
+    return data.feed.get('title', ''), entries
+
 
 class Feed(Command):
+    __version__ = '1.0.0'
+    db_models = [FeedSource, FeedFollow, FeedSeenEntry]
+
+    # Time between checks of each feed, and maximum time when a feed keeps failing, in seconds
+    check_interval = 300
+    max_interval = 3600
+    # Simultaneous requests, in total and for each host
+    max_requests = 10
+    max_host_requests = 2
+    # Minimum amount of seen entry IDs kept per feed (IDs still listed on the feed are always kept), and maximum
+    # amount of entries delivered per check
+    seen_window = 100
+    max_catchup = 5
+    max_guild_feeds = 20
+
     def __init__(self, bot):
         super().__init__(bot)
         self.default_enabled = False
 
         self.name = 'feed'
+        self.help = '$[feed-help]'
+        self.format = '$[feed-format]'
         self.owner_only = True
+        self.allow_pm = False
+        self.category = categories.STAFF
+        self.schedule = (self.poll_task, 30)
         self.default_config = {
             'twitter_key': '',
             'twitter_secret': ''
         }
 
         self.twitter_token = None
+        self.chans = {}
+        self.sources = {}
+        self.states = {}
+        self.seen = {}
+        self.host_limits = {}
+
+    def on_loaded(self):
+        self.load_feeds()
 
     async def handle(self, cmd):
         if cmd.argc == 0:
-            await cmd.answer('xd')
+            await cmd.answer('$[format]: $[feed-format]')
+            return
+
+        if cmd.args[0] in ['follow', 'unfollow']:
+            await self.handle_follow(cmd)
+        elif cmd.args[0] == 'list':
+            follows = FeedFollow.select().where(FeedFollow.serverid == str(cmd.guild.id))
+            if len(follows) == 0:
+                await cmd.answer('$[feed-no-feeds]')
+                return
+
+            items = ['- <{}> ➡ <#{}>'.format(f.url, f.channelid) for f in follows]
+            await cmd.answer('$[feed-list-title]:\n{}'.format('\n'.join(items)))
+        else:
+            await self.show_info(cmd)
+
+    async def handle_follow(self, cmd):
+        if cmd.argc < 2:
+            await cmd.answer('$[format]: $[feed-format-follow]')
+            return
+
+        url, url_type = self.normalize_url(cmd.args[1])
+        if url_type not in ['tumblr', 'generic', 'reddit']:
+            await cmd.answer('$[feed-error-url]')
             return
+        if url_type == 'reddit':
+            url = url[:-len('.json')] + '.rss'
+
+        channel = cmd.channel
+        if cmd.argc > 2:
+            chan_match = pat_channel.match(cmd.args[2])
+            channel = None if not chan_match else cmd.guild.get_channel(auto_int(chan_match.group(1)))
+            if channel is None:
+                await cmd.answer('$[feed-error-channel]')
+                return
 
+        if cmd.args[0] == 'unfollow':
+            deleted = FeedFollow.delete().where(
+                (FeedFollow.url == url) & (FeedFollow.channelid == str(channel.id))).execute()
+            if deleted == 0:
+                await cmd.answer('$[feed-error-not-followed]')
+                return
+
+            self.remove_follow(url, str(channel.id))
+            await cmd.answer('$[feed-removed]')
+            return
+
+        if FeedFollow.select().where(FeedFollow.serverid == str(cmd.guild.id)).count() >= self.max_guild_feeds:
+            await cmd.answer('$[feed-error-max-feeds]', locales={'max': self.max_guild_feeds})
+            return
+
+        if url not in self.chans:
+            # The feed is fetched once to check it, and its current entries are marked as seen, so only entries
+            # published after following the feed are sent
+            await cmd.typing()
+            source = FeedSource.get_or_none(FeedSource.url == url) or FeedSource(url=url)
+            entries = await self.fetch_feed(source, conditional=False)
+            if entries is None:
+                await cmd.answer('$[feed-error-fetch]')
+                return
+
+            source.save()
+            self.sources[url] = source
+            self.mark_seen(url, self.unseen_entries(url, entries), entries)
+
+        follow, created = FeedFollow.get_or_create(
+            url=url, channelid=str(channel.id), defaults={'serverid': str(cmd.guild.id)})
+        if not created:
+            await cmd.answer('$[feed-error-already-followed]')
+            return
+
+        self.add_follow(url, follow.channelid)
+        await cmd.answer('$[feed-added]', locales={'title': self.sources[url].title or url})
+
+    async def show_info(self, cmd):
         await cmd.typing()
         url, url_type = self.normalize_url(cmd.text)
         self.log.debug('URL: %s', url)
@@ -66,10 +251,10 @@ class Feed(Command):
                 await cmd.answer(tweet_url)
         elif url_type == 'tumblr' or url_type == 'generic':
             async with self.http.get(url) as r:
-                p = feedparser.parse(await r.text())
+                p = await asyncio.get_event_loop().run_in_executor(None, feedparser.parse, await r.text())
                 embed = Embed(title='Feed information')
                 embed.description = '**Title**: {}\n**Description**: {}'.format(
-                    p['feed']['title'], p['feed']['subtitle']
+                    p['feed'].get('title', ''), p['feed'].get('subtitle', '')
                 )
                 await cmd.answer(embed)
         else:
@@ -131,3 +316,225 @@ class Feed(Command):
 
             self.twitter_token = data['access_token']
             self.log.info('Twitter token retrieved')
+
+    async def poll_task(self):
+        start = time.perf_counter()
+        now = time.monotonic()
+        due = [self.get_state(url) for url in list(self.chans.keys())]
+        due = [state for state in due if state.next_check <= now]
+        if len(due) == 0:
+            return
+
+        semaphore = asyncio.Semaphore(self.max_requests)
+
+        async def check(state):
+            async with semaphore, self.get_host_limit(state.url):
+                entries = await self.fetch_feed(self.sources[state.url])
+
+            if entries is None:
+                # Retry later, waiting more while the feed keeps failing
+                state.failures += 1
+                state.next_check = time.monotonic() + min(
+                    self.max_interval, self.check_interval * 2 ** state.failures)
+                return
+
+            state.failures = 0
+            state.next_check = time.monotonic() + self.check_interval
+            await self.process_entries(state.url, entries)
+
+        results = await asyncio.gather(*[check(state) for state in due if state.url in self.sources],
+                                       return_exceptions=True)
+        for state, result in zip([s for s in due if s.url in self.sources], results):
+            if isinstance(result, Exception):
+                self.log.exception('Error checking feed %s', state.url, exc_info=result)
+
+        self.log.debug('Checked %i feeds, took %.3f seconds', len(due), time.perf_counter() - start)
+
+    async def fetch_feed(self, source, conditional=True):
+        """
+        Fetches and parses a feed, using a conditional request with the values from the previous response.
+        :param source: The FeedSource instance. Its title and conditional request values are updated.
+        :param conditional: If False, the ETag and Last-Modified values are not sent.
+        :return: A list with the feed entries, an empty list if the feed was not modified, or None if the
+        request failed.
+        """
+        headers = {}
+        if conditional and source.etag:
+            headers['If-None-Match'] = source.etag
+        if conditional and source.last_modified:
+            headers['If-Modified-Since'] = source.last_modified
+
+        try:
+            async with self.http.get(source.url, headers=headers, timeout=aiohttp.ClientTimeout(total=20)) as r:
+                if r.status == 304:
+                    return []
+
+                if r.status != 200:
+                    self.log.debug('Error fetching feed %s (HTTP %i)', source.url, r.status)
+                    return None
+
+                content = await r.read()
+                etag, modified = r.headers.get('ETag'), r.headers.get('Last-Modified')
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            self.log.debug('Error fetching feed %s: %s', source.url, str(e))
+            return None
+
+        try:
+            title, entries = await asyncio.get_event_loop().run_in_executor(None, parse_feed, content)
+        except Exception as e:
+            self.log.debug('Error parsing feed %s: %s', source.url, str(e))
+            return None
+
+        if title != source.title or etag != source.etag or modified != source.last_modified:
+            source.title, source.etag, source.last_modified = title, etag, modified
+            if source.id is not None:
+                source.save()
+
+        return entries
+
+    async def process_entries(self, url, entries):
+        new_entries = self.unseen_entries(url, entries)
+        if len(new_entries) == 0:
+            return
+
+        self.mark_seen(url, new_entries, entries)
+
+        # Feeds usually list the newest entries first, but the published dates are used if they are available
+        new_entries.reverse()
+        if all(e['timestamp'] > 0 for e in new_entries):
+            new_entries.sort(key=lambda e: e['timestamp'])
+
+        title = self.sources[url].title
+        embeds = [self.entry_to_embed(title, e) for e in new_entries[-self.max_catchup:]]
+        await asyncio.gather(*[self.send_entries(url, chan, embeds) for chan in list(self.chans.get(url, []))])
+
+    async def send_entries(self, url, channel, embeds):
+        chan = self.bot.get_channel(auto_int(channel))
+        if chan is None:
+            self.log.warning('Channel ID %s not found for feed %s, removing', channel, url)
+            FeedFollow.delete().where((FeedFollow.url == url) & (FeedFollow.channelid == channel)).execute()
+            self.remove_follow(url, channel)
+            return
+
+        # Entries are sent in order on each channel
+        for embed in embeds:
+            try:
+                await self.bot.send_message(chan, embed=embed.copy(), priority=PRIORITY_LOW, max_age=3600)
+            except discord.Forbidden:
+                self.log.debug('Could not send the feed %s to #%s (%s) due to missing permissions',
+                               url, chan.name, chan.id)
+                return
+            except discord.HTTPException as e:
+                self.log.debug('Could not send the feed %s to #%s (%s): %s', url, chan.name, chan.id, str(e))
+                return
+
+    @staticmethod
+    def entry_to_embed(feed_title, entry):
+        embed = Embed(title=text_cut(entry['title'] or entry['link'], 256), description=text_cut(entry['summary'], 500))
+        if entry['link'].startswith('http'):
+            embed.url = entry['link']
+        if feed_title:
+            embed.set_author(name=text_cut(feed_title, 256))
+        if entry['image']:
+            embed.set_thumbnail(url=entry['image'])
+        if entry['timestamp'] > 0:
+            embed.timestamp = datetime.utcfromtimestamp(entry['timestamp'])
+
+        return embed
+
+    def get_seen(self, url):
+        """
+        Retrieves the seen entries of a feed, loading them from the database if needed.
+        :param url: The feed URL.
+        :return: A tuple with the set of seen entry IDs and a deque with the same IDs, oldest first.
+        """
+        if url not in self.seen:
+            query = FeedSeenEntry.select(FeedSeenEntry.entry_id).where(FeedSeenEntry.url == url).order_by(
+                FeedSeenEntry.timestamp, FeedSeenEntry.id)
+            window = deque(e.entry_id for e in query)
+            self.seen[url] = (set(window), window)
+
+        return self.seen[url]
+
+    def unseen_entries(self, url, entries):
+        """
+        :return: The entries that were not seen before, without repeated IDs, in the feed's order.
+        """
+        seen_ids, _ = self.get_seen(url)
+        new_entries, new_ids = [], set()
+        for entry in entries:
+            if entry['id'] not in seen_ids and entry['id'] not in new_ids:
+                new_entries.append(entry)
+                new_ids.add(entry['id'])
+
+        return new_entries
+
+    def mark_seen(self, url, entries, feed_entries):
+        """
+        Marks entries as seen. When there are more seen IDs than *seen_window* and than the feed's length, the
+        oldest IDs are forgotten, except those still listed on the feed, so they're never sent again.
+        :param url: The feed URL.
+        :param entries: The new entries, in the feed's order.
+        :param feed_entries: All the entries from the last fetch of the feed.
+        """
+        if len(entries) == 0:
+            return
+
+        # Entries are ordered by the time they were seen, as the published dates are not always available
+        seen_ids, window = self.get_seen(url)
+        now = int(time.time())
+        for entry in reversed(entries):
+            window.append(entry['id'])
+            seen_ids.add(entry['id'])
+
+        FeedSeenEntry.insert_many([{'url': url, 'entry_id': e['id'], 'timestamp': now} for e in entries]).execute()
+
+        listed = {e['id'] for e in feed_entries}
+        excess = len(window) - max(self.seen_window, len(listed))
+        if excess <= 0:
+            return
+
+        evicted, kept = [], deque()
+        for entry_id in window:
+            if excess > 0 and entry_id not in listed:
+                evicted.append(entry_id)
+                excess -= 1
+            else:
+                kept.append(entry_id)
+
+        window.clear()
+        window.extend(kept)
+        seen_ids.difference_update(evicted)
+        FeedSeenEntry.delete().where((FeedSeenEntry.url == url) & (FeedSeenEntry.entry_id << evicted)).execute()
+
+    def load_feeds(self):
+        self.chans = {}
+        for follow in FeedFollow.select():
+            self.chans.setdefault(follow.url, []).append(follow.channelid)
+
+        self.sources = {s.url: s for s in FeedSource.select().where(FeedSource.url << list(self.chans.keys()))}
+
+    def add_follow(self, url, channel_id):
+        self.chans.setdefault(url, []).append(channel_id)
+
+    def remove_follow(self, url, channel_id):
+        if channel_id in self.chans.get(url, []):
+            self.chans[url].remove(channel_id)
+        if url in self.chans and len(self.chans[url]) == 0:
+            # The seen entries are kept on the database, and refreshed if the feed is followed again
+            del self.chans[url]
+            self.sources.pop(url, None)
+            self.states.pop(url, None)
+            self.seen.pop(url, None)
+
+    def get_state(self, url):
+        if url not in self.states:
+            # First checks are spread over the interval, so they are not all done at the same time
+            self.states[url] = FeedState(url, time.monotonic() + random.uniform(0, self.check_interval))
+        return self.states[url]
+
+    def get_host_limit(self, url):
+        host = urlsplit(url).hostname
+        if host not in self.host_limits:
+            self.host_limits[host] = asyncio.Semaphore(self.max_host_requests)
+        return self.host_limits[host]
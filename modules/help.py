@@ -25,8 +25,7 @@ class Help(Command):
                 await cmd.answer('$[command-not-available]')
             else:
                 lang = self.get_lang(cmd.guild, cmd.channel)
-                format_cont = lang.format(ins.format).replace('$CMD', '$PX$NM')
-                format_cont = format_cont.replace('$NM', cmd.args[0])
+                format_cont = lang.format(ins.format, variables={'CMD': '$PX' + cmd.args[0], 'NM': cmd.args[0]})
                 embed = Embed(title='$PX' + cmd.args[0], description=ins.help)
                 embed.add_field(name='$[help-format-title]', value=format_cont, inline=False)
                 embed.set_footer(text='$[help-footer-for]')
@@ -87,6 +87,8 @@ class InviteFilter(Command):
         if invite:
             self.log.debug('Removing invite in %s: %s by %s', message.guild, invite[0], message.author)
             await self.bot.delete_message(message, silent=True)
+            if self.bot.get_modlog_channel(message.guild, 'invite_filter') is None:
+                return
 
             embed = Embed(title='$[ifilter-message]')
             embed.description = '{}\nPor {} en {}'.format(invite[0], message.author.mention, message.channel.mention)
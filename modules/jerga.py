@@ -25,7 +25,7 @@ class Jerga(Command):
             self.log.debug('Loading %s...', (baseurl + text_url))
 
             await cmd.typing()
-            async with self.http.get(baseurl + text_url) as r:
+            async with self.http.get(baseurl + text_url, cache=86400) as r:
                 content = await r.text()
                 soup = BeautifulSoup(content, 'html.parser')
                 div_definition = soup.find_all('div', class_='definition')
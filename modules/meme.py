@@ -26,7 +26,7 @@ class Meme(Command):
         self.font_smaller = None
 
     async def on_ready(self):
-        self.mpath = await download('impact.ttf', furl)
+        self.mpath = await download('impact.ttf', furl, session=self.http)
         if self.mpath is None:
             self.log.warn('Could not retrieve the font')
             return
@@ -1,13 +1,20 @@
-from datetime import datetime
+import asyncio
+import re
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta
 
 import discord
 import peewee
 from discord.utils import escape_markdown
+from playhouse.sqlite_ext import FTS5Model, SearchField
 
 from bot import Command, utils, categories, BaseModel
+from bot.database import BotDatabase
 from discord import Embed, AuditLogAction
 
-from bot.regex import pat_channel
+from bot.lib.message_store import MessageStore, StoredMessage
+from bot.regex import pat_channel, pat_usertag, pat_snowflake
 from bot.utils import deltatime_to_str
 from modules.user import UserInfo
 
@@ -20,17 +27,328 @@ class UserNameReg(BaseModel):
     timestamp = peewee.DateTimeField(default=datetime.now)
 
 
+class ArchivedMessage(BaseModel):
+    serverid = peewee.TextField()
+    channelid = peewee.TextField()
+    messageid = peewee.TextField()
+    authorid = peewee.TextField()
+    author_name = peewee.TextField()
+    # "delete" or "edit". For edits, the content is the text before the edit.
+    kind = peewee.CharField(max_length=10)
+    content = peewee.TextField()
+    timestamp = peewee.DateTimeField(default=datetime.now, index=True)
+
+    class Meta:
+        indexes = (
+            (('serverid', 'timestamp'), False),
+            (('serverid', 'authorid', 'timestamp'), False),
+        )
+
+
+class ArchivedMessageIndex(FTS5Model):
+    """
+    Full-text index of the archived messages, used on SQLite. The rowid is the ArchivedMessage's id.
+    """
+    serverid = SearchField(unindexed=True)
+    content = SearchField()
+
+    class Meta:
+        database = BotDatabase.get_instance()
+        options = {'tokenize': 'unicode61 remove_diacritics 2'}
+
+
+class ModArchive:
+    """
+    Stores deleted and edited messages so they can be searched later. Messages are queued and inserted in batches,
+    and their text is indexed with FTS5 on SQLite, a FULLTEXT index on MySQL, or a GIN index on PostgreSQL.
+    Other databases fall back to a LIKE search.
+    """
+
+    batch_size = 500
+    max_pending = 5000
+    # Rows per INSERT on SQLite, as versions before 3.32 allow up to 999 variables per query
+    sqlite_chunk_size = 100
+
+    def __init__(self, db, log):
+        self.db = db
+        self.log = log
+        self.pending = []
+        self.stats = {'archived': 0, 'dropped': 0, 'pruned': 0}
+
+        if isinstance(db, peewee.SqliteDatabase):
+            self.engine = 'sqlite' if FTS5Model.fts5_installed() else None
+        elif isinstance(db, peewee.MySQLDatabase):
+            self.engine = 'mysql'
+        elif isinstance(db, peewee.PostgresqlDatabase):
+            self.engine = 'postgres'
+        else:
+            self.engine = None
+
+    def setup(self):
+        try:
+            if self.engine == 'sqlite':
+                self.db.create_tables([ArchivedMessageIndex], safe=True)
+            elif self.engine == 'mysql':
+                try:
+                    self.db.execute_sql(
+                        'CREATE FULLTEXT INDEX archivedmessage_content_fts ON archivedmessage (content)')
+                except peewee.OperationalError:
+                    pass  # The index already exists
+            elif self.engine == 'postgres':
+                self.db.execute_sql(
+                    'CREATE INDEX IF NOT EXISTS archivedmessage_content_fts ON archivedmessage '
+                    'USING GIN (to_tsvector(\'simple\', content))')
+            else:
+                self.log.warning('Full-text search is not available for this database, archive searches will be slow')
+        except peewee.DatabaseError as e:
+            self.log.error('Could not create the archive\'s full-text index: %s', str(e))
+            self.engine = None
+
+    def add(self, record, kind, content):
+        """
+        Queues a message to be archived.
+        :param record: The StoredMessage instance.
+        :param kind: "delete" or "edit".
+        :param content: The archived text.
+        """
+        if content == '' and len(record.attachments) > 0:
+            content = ' '.join(url for _, url, _ in record.attachments)
+        if content == '':
+            return
+
+        if len(self.pending) >= self.max_pending:
+            self.pending.pop(0)
+            self.stats['dropped'] += 1
+
+        self.pending.append({
+            'serverid': str(record.guild_id), 'channelid': str(record.channel_id), 'messageid': str(record.id),
+            'authorid': str(record.author_id), 'author_name': record.author_name, 'kind': kind, 'content': content,
+            'timestamp': datetime.now()
+        })
+
+    def flush(self):
+        """
+        Inserts the queued messages, in a single transaction per batch.
+        """
+        while len(self.pending) > 0:
+            rows, self.pending = self.pending[:self.batch_size], self.pending[self.batch_size:]
+            with self.db.atomic():
+                if self.engine == 'sqlite':
+                    # The new rows are indexed with a single INSERT ... SELECT
+                    last_id = ArchivedMessage.select(peewee.fn.MAX(ArchivedMessage.id)).scalar() or 0
+                    for chunk in peewee.chunked(rows, self.sqlite_chunk_size):
+                        ArchivedMessage.insert_many(chunk).execute()
+
+                    new_rows = ArchivedMessage.select(ArchivedMessage.id, ArchivedMessage.serverid,
+                                                      ArchivedMessage.content).where(ArchivedMessage.id > last_id)
+                    ArchivedMessageIndex.insert_from(new_rows, [
+                        ArchivedMessageIndex.rowid, ArchivedMessageIndex.serverid, ArchivedMessageIndex.content
+                    ]).execute()
+                else:
+                    ArchivedMessage.insert_many(rows).execute()
+
+            self.stats['archived'] += len(rows)
+
+    def search(self, guild_id, text=None, author_id=None, since=None, until=None, limit=10):
+        """
+        Searches archived messages of a guild, newest first.
+        :param guild_id: The guild ID.
+        :param text: Words that the messages must contain.
+        :param author_id: The author's user ID.
+        :param since: The minimum archive datetime.
+        :param until: The maximum archive datetime.
+        :param limit: The maximum amount of results.
+        :return: A list of ArchivedMessage instances.
+        """
+        guild_id = str(guild_id)
+        query = ArchivedMessage.select().where(ArchivedMessage.serverid == guild_id)
+        if author_id is not None:
+            query = query.where(ArchivedMessage.authorid == str(author_id))
+        if since is not None:
+            query = query.where(ArchivedMessage.timestamp >= since)
+        if until is not None:
+            query = query.where(ArchivedMessage.timestamp < until)
+
+        words = re.findall(r'\w+', text or '')
+        if len(words) > 0:
+            if self.engine == 'sqlite':
+                terms = ' '.join('"{}"'.format(w) for w in words)
+                ids = ArchivedMessageIndex.select(ArchivedMessageIndex.rowid).where(
+                    ArchivedMessageIndex.match(terms) & (ArchivedMessageIndex.serverid == guild_id))
+                query = query.where(ArchivedMessage.id.in_(ids))
+            elif self.engine == 'mysql':
+                terms = ' '.join('+' + w for w in words)
+                query = query.where(peewee.SQL('MATCH(content) AGAINST(%s IN BOOLEAN MODE)', (terms,)))
+            elif self.engine == 'postgres':
+                query = query.where(peewee.SQL(
+                    'to_tsvector(\'simple\', content) @@ plainto_tsquery(\'simple\', %s)', (' '.join(words),)))
+            else:
+                for word in words:
+                    query = query.where(ArchivedMessage.content.contains(word))
+
+        return list(query.order_by(ArchivedMessage.id.desc()).limit(limit))
+
+    def prune(self, max_days, max_rows):
+        """
+        Removes the archived messages older than *max_days*, and the oldest messages of the guilds with more than
+        *max_rows* messages.
+        """
+        cutoff = datetime.now() - timedelta(days=max_days)
+        last_id = ArchivedMessage.select(peewee.fn.MAX(ArchivedMessage.id)).where(
+            ArchivedMessage.timestamp < cutoff).scalar()
+        if last_id is not None:
+            self._delete(last_id)
+
+        count = peewee.fn.COUNT(ArchivedMessage.id)
+        over = ArchivedMessage.select(ArchivedMessage.serverid).group_by(ArchivedMessage.serverid).having(
+            count > max_rows)
+        for row in over:
+            last_id = ArchivedMessage.select(ArchivedMessage.id).where(ArchivedMessage.serverid == row.serverid)\
+                .order_by(ArchivedMessage.id.desc()).offset(max_rows).limit(1).scalar()
+            if last_id is not None:
+                self._delete(last_id, row.serverid)
+
+    def _delete(self, last_id, guild_id=None):
+        with self.db.atomic():
+            query = ArchivedMessage.delete().where(ArchivedMessage.id <= last_id)
+            if guild_id is not None:
+                query = query.where(ArchivedMessage.serverid == guild_id)
+            self.stats['pruned'] += query.execute()
+
+            if self.engine == 'sqlite':
+                query = ArchivedMessageIndex.delete().where(ArchivedMessageIndex.rowid <= last_id)
+                if guild_id is not None:
+                    query = query.where(ArchivedMessageIndex.serverid == guild_id)
+                query.execute()
+
+
+class AuditLogTail:
+    """
+    Keeps the recent audit log entries of a guild, fetching only the entries newer than the last one seen.
+    Concurrent events share the same fetch, and fetches are made at most once per *min_interval* seconds.
+    """
+
+    min_interval = 1
+    batch_size = 25
+    max_entries = 50
+    # Entries older than this (in seconds) are only used if they're the newest entry, as Discord updates
+    # aggregated entries (e.g. many deletes by the same user) without creating new ones.
+    match_window = 15
+    # Time to wait before retrying when the bot can't view the audit log
+    forbidden_retry = 300
+
+    def __init__(self, guild, log):
+        self.guild = guild
+        self.log = log
+        self.entries = OrderedDict()
+        self.last_id = None
+        self.last_fetch = 0
+        self.api_calls = 0
+        self.forbidden_at = None
+        self._fetch_task = None
+
+    @property
+    def forbidden(self):
+        return self.forbidden_at is not None and time.monotonic() - self.forbidden_at < self.forbidden_retry
+
+    async def find(self, predicate):
+        """
+        Refreshes the entries and looks for the newest entry matching a condition.
+        :param predicate: A function that receives a discord.AuditLogEntry and returns a boolean.
+        :return: The discord.AuditLogEntry instance, or None if no entry matched.
+        """
+        await self.refresh()
+
+        now = datetime.utcnow()
+        newest = next(reversed(self.entries), None)
+        for entry_id in reversed(self.entries):
+            entry = self.entries[entry_id]
+            if entry_id != newest and (now - entry.created_at).total_seconds() > self.match_window:
+                break
+            if predicate(entry):
+                return entry
+
+        return None
+
+    async def refresh(self):
+        if self.forbidden:
+            return
+        if self._fetch_task is None:
+            self._fetch_task = asyncio.ensure_future(self._fetch())
+        await asyncio.shield(self._fetch_task)
+
+    async def _fetch(self):
+        try:
+            wait = self.last_fetch + self.min_interval - time.monotonic()
+            if wait > 0:
+                await asyncio.sleep(wait)
+        finally:
+            # Events received from now on need a new fetch, as their entries may not be on this one
+            self._fetch_task = None
+
+        self.last_fetch = time.monotonic()
+        self.api_calls += 1
+        after = None if self.last_id is None else discord.Object(id=self.last_id)
+        try:
+            entries = await self.guild.audit_logs(limit=self.batch_size, after=after).flatten()
+        except discord.Forbidden:
+            self.forbidden_at = time.monotonic()
+            return
+        except AttributeError:
+            self.log.warning('There was probably an unknown (for discord.py) Audit Log action and triggered this error')
+            return
+
+        self.forbidden_at = None
+        for entry in sorted(entries, key=lambda e: e.id):
+            self.entries[entry.id] = entry
+        if len(entries) > 0:
+            self.last_id = max(self.last_id or 0, max(e.id for e in entries))
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+
 class ModLog(Command):
     __author__ = 'makzk'
-    __version__ = '1.0.2'
+    __version__ = '1.2.0'
     chan_config_name = 'join_send_channel'
 
+    db_models = [ArchivedMessage]
+
+    def __init__(self, bot):
+        super().__init__(bot)
+        self.alogs = {}
+        self.messages = MessageStore()
+        self.archive = ModArchive(self.bot.db, self.log)
+        self.schedule = [(self.archive_task, 5), (self.prune_task, 3600, {'delay': 600})]
+        self.default_config = {
+            'modlog_archive_days': 90,
+            'modlog_archive_max_rows': 200000
+        }
+
+    def on_loaded(self):
+        self.archive.setup()
+
+    async def archive_task(self):
+        self.archive.flush()
+
+    async def prune_task(self):
+        self.archive.prune(self.bot.config['modlog_archive_days'], self.bot.config['modlog_archive_max_rows'])
+
+    async def on_guild_remove(self, guild):
+        self.alogs.pop(guild.id, None)
+
     async def on_member_join(self, member):
+        if self.bot.get_modlog_channel(member.guild, 'user_join') is None:
+            return
+
         await self.bot.send_modlog(
             member.guild, '$[modlog-new-user]',
             embed=UserInfo.gen_embed(member, more=True), locales={'mid': member.id}, logtype='user_join')
 
     async def on_member_remove(self, member):
+        if self.bot.get_modlog_channel(member.guild, 'user_leave') is None:
+            return
+
         dt = deltatime_to_str(datetime.now() - member.joined_at)
         locales = {
             'mid': member.id,
@@ -40,95 +358,169 @@ class ModLog(Command):
 
         await self.bot.send_modlog(member.guild, '$[modlog-user-left]', locales=locales, logtype='user_leave')
 
-    async def on_message_delete(self, message):
+    async def on_message(self, message):
         if message.guild is None or message.author.id == self.bot.user.id:
             return
 
-        footer = '$[modlog-msg-sent]: ' + utils.format_date(message.created_at)
-        if message.edited_at is not None:
-            footer += ', $[modlog-msg-edited]: ' + utils.format_date(message.edited_at)
+        # Only keep messages if they could be logged
+        if self.bot.get_modlog_channel(message.guild, 'message_delete') is not None or \
+                self.bot.get_modlog_channel(message.guild, 'message_edit') is not None:
+            self.messages.add(message)
+
+    async def on_raw_message_delete(self, payload):
+        if payload.guild_id is None:
+            return
+
+        record = self.messages.pop(payload.message_id)
+        if record is None and payload.cached_message is not None:
+            record = StoredMessage.from_message(payload.cached_message)
+
+        if record is not None:
+            await self.log_delete(record)
+
+    async def on_raw_bulk_message_delete(self, payload):
+        if payload.guild_id is None:
+            return
+
+        cached = {m.id: m for m in payload.cached_messages}
+        for message_id in sorted(payload.message_ids):
+            record = self.messages.pop(message_id)
+            if record is None and message_id in cached:
+                record = StoredMessage.from_message(cached[message_id])
+
+            if record is not None:
+                await self.log_delete(record, bulk=True)
+
+    async def on_raw_message_edit(self, payload):
+        # Ignore updates without content (e.g. embeds added by Discord)
+        content = payload.data.get('content')
+        if payload.data.get('guild_id') is None or content is None:
+            return
+
+        edited_at = discord.utils.parse_time(payload.data.get('edited_timestamp'))
+        before = self.messages.get(payload.message_id)
+        if before is not None:
+            before_content = before.content
+            self.messages.update(payload.message_id, content, edited_at)
+        elif payload.cached_message is not None:
+            before = StoredMessage.from_message(payload.cached_message)
+            before_content = before.content
+        else:
+            return
+
+        await self.log_edit(before, before_content, content, edited_at)
 
-        embed = Embed(description='($[modlog-no-text])' if message.content == '' else message.content)
+    async def log_delete(self, record, bulk=False):
+        """
+        Sends the modlog entry for a deleted message.
+        :param record: The StoredMessage instance.
+        :param bulk: If the message was deleted in bulk. Audit logs are not checked for these messages.
+        """
+        guild = self.bot.get_guild(record.guild_id)
+        if guild is None or record.author_id == self.bot.user.id:
+            return
+
+        msg = '$[modlog-user-deleted-msg]'
+        if record.id in self.bot.deleted_messages:
+            if record.id in self.bot.deleted_messages_nolog:
+                self.bot.deleted_messages_nolog.remove(record.id)
+                return
+            else:
+                msg = '$[modlog-bot-deleted-msg]'
+
+        if self.bot.get_modlog_channel(guild, 'message_delete') is None:
+            return
+
+        self.archive.add(record, 'delete', record.content)
+        footer = '$[modlog-msg-sent]: ' + utils.format_date(record.created_at)
+        if record.edited_at is not None:
+            footer += ', $[modlog-msg-edited]: ' + utils.format_date(record.edited_at)
+
+        embed = Embed(description='($[modlog-no-text])' if record.content == '' else record.content)
         embed.set_footer(text=footer)
-        if len(message.attachments) > 0:
+        if len(record.attachments) > 0:
             with_img = False
-            if message.attachments[0].width:
-                fn_value = '[{}]({})'.format(message.attachments[0].filename, message.attachments[0].url)
-                embed.set_image(url=message.attachments[0].url)
-                embed.add_field(name='$[modlog-file-name]', value=fn_value)
+            filename, url, is_image = record.attachments[0]
+            if is_image:
+                embed.set_image(url=url)
+                embed.add_field(name='$[modlog-file-name]', value='[{}]({})'.format(filename, url))
                 with_img = True
 
-            if with_img and len(message.attachments) > 1 or not with_img:
+            if with_img and len(record.attachments) > 1 or not with_img:
                 i = 1 if with_img else 0
-                x = ['[{}]({})'.format(f.filename, f.url) for f in message.attachments[i:]]
+                x = ['[{}]({})'.format(name, url) for name, url, _ in record.attachments[i:]]
                 t = [
                         ['$[modlog-attatched]', '$[modlog-attached-other]'],
                         ['$[modlog-attached-single]', '$[modlog-attached-other-single]']
                     ][int(len(x) == 1)][i]
                 embed.add_field(name=t, value=', '.join(x))
 
-        msg = '$[modlog-user-deleted-msg]'
         locales = {
-            'username': escape_markdown(message.author.display_name),
-            'channel_name': message.channel.mention
+            'username': escape_markdown(self.get_author_name(guild, record)),
+            'channel_name': '<#{}>'.format(record.channel_id)
         }
 
-        if message.id in self.bot.deleted_messages:
-            if message.id in self.bot.deleted_messages_nolog:
-                self.bot.deleted_messages_nolog.remove(message.id)
-                return
-            else:
-                msg = '$[modlog-bot-deleted-msg]'
-        else:
-            try:
-                last = await self.get_last_alog(message.guild)
-                if last is not None and last.action == AuditLogAction.message_delete and \
-                        last.extra.channel.id == message.channel.id and last.target.id == message.author.id:
-                    who = last.user
-                    if who == self.bot.user.id:
-                        msg = '$[modlog-bot-deleted-msg]'
-                    else:
-                        locales['deleter_name'] = who.display_name
-                        msg = '$[modlog-user-deleted-other]'
-            except discord.Forbidden:
+        if bulk and record.id not in self.bot.deleted_messages:
+            msg = '$[modlog-somehow-deleted-msg]'
+        elif record.id not in self.bot.deleted_messages:
+            tail = self.get_alog_tail(guild)
+            last = await tail.find(
+                lambda e: e.action == AuditLogAction.message_delete and e.extra.channel.id == record.channel_id
+                and e.target.id == record.author_id)
+            if tail.forbidden:
                 msg = '$[modlog-somehow-deleted-msg]'
-
-        await self.bot.send_modlog(message.guild, msg, embed=embed, locales=locales, logtype='message_delete')
-
-    async def on_message_edit(self, before, after):
-        # Ignore on PM or self message
-        if not isinstance(before.channel, discord.TextChannel) or before.author.id == self.bot.user.id:
+            elif last is not None:
+                who = last.user
+                if who.id == self.bot.user.id:
+                    msg = '$[modlog-bot-deleted-msg]'
+                else:
+                    locales['deleter_name'] = who.display_name
+                    msg = '$[modlog-user-deleted-other]'
+
+        await self.bot.send_modlog(guild, msg, embed=embed, locales=locales, logtype='message_delete')
+
+    async def log_edit(self, record, before, after, edited_at):
+        """
+        Sends the modlog entry for an edited message.
+        :param record: The StoredMessage instance.
+        :param before: The previous content.
+        :param after: The new content.
+        :param edited_at: The edit datetime.
+        """
+        guild = self.bot.get_guild(record.guild_id)
+        # Ignore own messages, or if no content changes were made
+        if guild is None or record.author_id == self.bot.user.id or before.strip() == after.strip():
             return
 
-        # Ignore if no content changes were made
-        if before.content.strip() == after.content.strip():
+        if self.bot.get_modlog_channel(guild, 'message_edit') is None:
             return
 
+        self.archive.add(record, 'edit', before)
         footer = '$[modlog-msg-sent]: {}, $[modlog-msg-edited]: {}'.format(
-            utils.format_date(before.created_at),
-            utils.format_date(after.created_at)
+            utils.format_date(record.created_at),
+            utils.format_date(edited_at or datetime.utcnow())
         )
 
         embed = Embed(title='📝 $[modlog-user-edited-msg]', description='$[modlog-user-edited-channel]')
         embed.set_footer(text=footer)
 
         locales = {
-            'username': escape_markdown(after.author.display_name),
-            'channel': after.channel.mention,
-            'link': utils.message_link(after)
+            'username': escape_markdown(self.get_author_name(guild, record)),
+            'channel': '<#{}>'.format(record.channel_id),
+            'link': record.link
         }
 
-        cont_before = '($[modlog-no-text])' if before.content == '' else before.content
-        cont_after = '($[modlog-no-text])' if after.content == '' else after.content
+        cont_before = '($[modlog-no-text])' if before == '' else before
+        cont_after = '($[modlog-no-text])' if after == '' else after
         embed.add_field(name='$[modlog-user-edited-before]', value=utils.text_cut(cont_before, 1000), inline=False)
         embed.add_field(name='$[modlog-user-edited-after]', value=utils.text_cut(cont_after, 1000), inline=False)
 
-        await self.bot.send_modlog(after.guild, embed=embed, locales=locales, logtype='message_edit')
+        await self.bot.send_modlog(guild, embed=embed, locales=locales, logtype='message_edit')
 
     async def on_member_update(self, before, after):
         guild = after.guild
 
-        if before.name != after.name:
+        if before.name != after.name and self.bot.get_modlog_channel(guild, 'username') is not None:
             if after.display_name != after.name:
                 name_before = escape_markdown(before.name)
                 name_after = escape_markdown(after.name)
@@ -146,16 +538,12 @@ class ModLog(Command):
                     guild, '$[modlog-username-changed]',
                     locales={'prev_name': name_before, 'new_name': name_after}, logtype='username')
 
-        if (before.nick or after.nick) and before.nick != after.nick:
-            try:
-                alog = await self.get_last_alog(after.guild)
-            except discord.Forbidden:
-                alog = None
-
-            if alog is not None and alog.action == AuditLogAction.member_update and alog.changes.after.nick:
-                by = alog.user
-            else:
-                by = None
+        if (before.nick or after.nick) and before.nick != after.nick \
+                and self.bot.get_modlog_channel(guild, 'nick') is not None:
+            alog = await self.get_alog_tail(guild).find(
+                lambda e: e.action == AuditLogAction.member_update and e.target.id == after.id
+                and hasattr(e.changes.after, 'nick'))
+            by = None if alog is None else alog.user
 
             prev_nick = escape_markdown(before.nick or '') or '$[modlog-nick-none]'
             after_nick = escape_markdown(after.nick or '') or '$[modlog-nick-none]'
@@ -180,19 +568,89 @@ class ModLog(Command):
                 else:
                     await self.bot.send_modlog(guild, '$[modlog-nick-by]', logtype='nick', locales=locales)
 
-    async def get_last_alog(self, guild):
-        try:
-            entries = await guild.audit_logs(limit=1).flatten()
-        except discord.Forbidden:
-            return None
-        except AttributeError:
-            self.log.warning('There was probably an unknown (for discord.py) Audit Log action and triggered this error')
-            return None
+    @staticmethod
+    def get_author_name(guild, record):
+        member = guild.get_member(record.author_id)
+        return record.author_name if member is None else member.display_name
+
+    def get_alog_tail(self, guild):
+        if guild.id not in self.alogs:
+            self.alogs[guild.id] = AuditLogTail(guild, self.log)
+        return self.alogs[guild.id]
+
+
+class ModLogSearch(Command):
+    __author__ = 'makzk'
+    __version__ = '1.0.0'
+
+    max_results = 10
+
+    def __init__(self, bot):
+        super().__init__(bot)
+        self.name = 'logsearch'
+        self.aliases = ['modsearch']
+        self.help = '$[modlog-search-help]'
+        self.format = '$[modlog-search-format]'
+        self.owner_only = True
+        self.allow_pm = False
+        self.category = categories.STAFF
+
+    async def handle(self, cmd):
+        if cmd.argc == 0:
+            await cmd.send_usage()
+            return
+
+        words, author_id, since, until = [], None, None, None
+        for arg in cmd.args:
+            key, _, value = arg.partition(':')
+            if key == 'user' and value != '':
+                member = cmd.get_member(value)
+                if member is not None:
+                    author_id = member.id
+                elif pat_usertag.match(value) or pat_snowflake.match(value):
+                    author_id = int(value.strip('<@!>'))
+                else:
+                    await cmd.answer('$[user-not-found]')
+                    return
+            elif key in ['from', 'to'] and value != '':
+                try:
+                    date = datetime.strptime(value, '%Y-%m-%d')
+                except ValueError:
+                    await cmd.answer('$[modlog-search-invalid-date]', locales={'date': value})
+                    return
+
+                if key == 'from':
+                    since = date
+                else:
+                    until = date + timedelta(days=1)
+            else:
+                words.append(arg)
+
+        mod = self.bot.manager.get_mod('ModLog')
+        if mod is None:
+            await cmd.answer('$[modlog-search-none]')
+            return
+
+        # Include the messages that are still queued
+        mod.archive.flush()
+
+        start = time.perf_counter()
+        results = mod.archive.search(cmd.guild.id, ' '.join(words), author_id, since, until, self.max_results)
+        elapsed = (time.perf_counter() - start) * 1000
+
+        if len(results) == 0:
+            await cmd.answer('$[modlog-search-none]')
+            return
 
-        if len(entries) == 0:
-            return None
+        lines = []
+        for item in results:
+            lines.append('`{}` **{}** (<#{}>, {}): {}'.format(
+                item.timestamp.strftime('%Y-%m-%d %H:%M'), escape_markdown(item.author_name), item.channelid,
+                '$[modlog-search-deleted]' if item.kind == 'delete' else '$[modlog-search-edited]',
+                escape_markdown(utils.text_cut(item.content.replace('\n', ' '), 150))))
 
-        return entries[0]
+        await cmd.answer('$[modlog-search-results]\n' + utils.text_cut('\n'.join(lines), 1800),
+                         locales={'count': len(results), 'ms': '{:.1f}'.format(elapsed)})
 
 
 class ModLogChannel(Command):
@@ -1,3 +1,4 @@
+import heapq
 import re
 import datetime
 from datetime import datetime as dt
@@ -20,7 +21,7 @@ class MutedUser(BaseModel):
 
 
 class Mute(Command):
-    __version__ = '1.0.3'
+    __version__ = '1.1.0'
     __author__ = 'makzk'
 
     default_muted_role = 'Muted'
@@ -36,11 +37,34 @@ class Mute(Command):
         self.owner_only = True
         self.allow_pm = False
         self.category = categories.MODERATION
-        self.schedule = (self.mute_task, 5)
+
+        # In-memory copy of the active mutes, the database remains the source of truth.
+        # muted maps (guild_id, user_id) to the mute end time (None for a permanent mute), and
+        # expiry_heap has (until, guild_id, user_id) items for the timed mutes.
+        self.muted = {}
+        self.expiry_heap = []
+
+    def on_loaded(self):
+        # Also called when the module is enabled, so mutes are available before any event is handled
+        self.load_mutes()
+        if self.bot.initialized:
+            self.schedule_expiry()
+
+    async def on_ready(self):
+        self.schedule_expiry()
+
+    def load_mutes(self):
+        self.muted = {}
+        self.expiry_heap = []
+        for muteduser in MutedUser.select():
+            self.track_mute(auto_int(muteduser.serverid), auto_int(muteduser.userid), muteduser.until, False)
+
+        heapq.heapify(self.expiry_heap)
+        self.log.debug('Loaded %i active mutes', len(self.muted))
 
     async def handle(self, cmd):
         if cmd.argc < 1:
-            delta = Mute.current_delta(cmd.author.id, cmd.message.guild.id)
+            delta = self.current_delta(cmd.author.id, cmd.message.guild.id)
             if delta is None:
                 await cmd.answer('$[mute-actually-not]')
             else:
@@ -94,7 +118,7 @@ class Mute(Command):
             return
 
         # Remove mute from DB if user was already muted (i.e. change the mute time)
-        MutedUser.delete().where(MutedUser.userid == member.id).execute()
+        MutedUser.delete().where((MutedUser.userid == member.id) & (MutedUser.serverid == guild.id)).execute()
 
         # Check if the user already has the role
         mutedrole = None
@@ -118,6 +142,7 @@ class Mute(Command):
         str_reason = (' ' + cmd.lang.format('$[mute-reason]', locales={'reason': reason})) if reason != '' else ''
         MutedUser.insert(userid=member.id, serverid=guild.id, until=until, reason=reason,
                          author_name=str(cmd.author), author_id=cmd.author.id).execute()
+        self.track_mute(guild.id, member.id, until)
 
         # Tell the user about the mute, via PM
         if not member.bot:
@@ -133,6 +158,14 @@ class Mute(Command):
 
     # Restore the mute role if user left and joined the guild again
     async def on_member_join(self, member):
+        key = (member.guild.id, member.id)
+        if key not in self.muted:
+            return
+
+        until = self.muted[key]
+        if until is not None and until <= dt.now():
+            return
+
         mgr = GuildConfiguration.get_instance(member.guild)
         guild = member.guild
         sv_role = mgr.get(Mute.cfg_muted_role, Mute.default_muted_role)
@@ -143,7 +176,6 @@ class Mute(Command):
                 mgr.unset(Mute.cfg_muted_role)
             return
 
-        sv_role = mgr.get(Mute.cfg_muted_role, Mute.default_muted_role)
         if sv_role == '':
             return
 
@@ -153,66 +185,120 @@ class Mute(Command):
             mgr.unset(Mute.cfg_muted_role)
             return
 
-        try:
-            MutedUser.get((MutedUser.until > dt.now()) | MutedUser.until.is_null(),
-                          MutedUser.userid == member.id)
-            member.add_roles(role)
-            self.log.info('Muted role added to "%s", guild "%s"', member.display_name, guild)
+        await member.add_roles(role)
+        self.log.info('Muted role added to "%s", guild "%s"', member.display_name, guild)
+
+    def track_mute(self, guildid, userid, until, schedule=True):
+        """
+        Registers an active mute in memory. It must be already stored on the database.
+        :param guildid: The guild ID.
+        :param userid: The muted user ID.
+        :param until: The mute end time, or None if the mute is permanent.
+        :param schedule: Reschedule the expiration task if this mute ends before the next scheduled one.
+        """
+        self.muted[(guildid, userid)] = until
+        if until is None:
             return
-        except MutedUser.DoesNotExist:
-            pass
+
+        item = (until, guildid, userid)
+        if not schedule:
+            self.expiry_heap.append(item)
+            return
+
+        heapq.heappush(self.expiry_heap, item)
+        if self.expiry_heap[0] is item:
+            self.schedule_expiry()
+
+    def untrack_mute(self, guildid, userid):
+        """
+        Removes a mute from memory. The heap item is discarded when it reaches the top of the heap.
+        :param guildid: The guild ID.
+        :param userid: The user ID.
+        """
+        self.muted.pop((guildid, userid), None)
+
+    def schedule_expiry(self):
+        # Discard items from mutes that were removed or changed
+        heap = self.expiry_heap
+        while len(heap) > 0 and self.muted.get((heap[0][1], heap[0][2]), None) != heap[0][0]:
+            heapq.heappop(heap)
+
+        if len(heap) > 0:
+            self.bot.manager.schedule_at(self.mute_task, heap[0][0], force=True)
 
     # Removes muted role once the mute time has ended
     async def mute_task(self):
-        muted = MutedUser.select().where((MutedUser.until <= dt.now()) & MutedUser.until.is_null(False))
-        for muteduser in muted:
-            guildid = auto_int(muteduser.serverid)
-            mutedid = auto_int(muteduser.userid)
-
-            guild = self.bot.get_guild(guildid)
-            if guild is None:
-                self.log.debug('Guild ID %s not found', guildid)
+        now = dt.now()
+        expired = {}
+        heap = self.expiry_heap
+        while len(heap) > 0 and heap[0][0] <= now:
+            until, guildid, userid = heapq.heappop(heap)
+            if self.muted.get((guildid, userid), None) != until:
                 continue
 
-            config = GuildConfiguration.get_instance(guild)
+            del self.muted[(guildid, userid)]
+            expired.setdefault(guildid, []).append(userid)
 
-            if not guild.me.guild_permissions.manage_roles:
-                self.log.warning('I can\'t manage roles on guild: %s. Mute disabled on this guild.', guild)
-                config.set(Mute.cfg_muted_role, '')
-                continue
+        try:
+            for guildid, userids in expired.items():
+                await self.expire_guild_mutes(guildid, userids)
+        finally:
+            self.schedule_expiry()
+
+    async def expire_guild_mutes(self, guildid, userids):
+        # The database entries are removed anyways, on_member_join ignores expired mutes
+        MutedUser.delete().where(
+            (MutedUser.serverid == str(guildid)) & (MutedUser.userid << [str(u) for u in userids])
+        ).execute()
+
+        guild = self.bot.get_guild(guildid)
+        if guild is None:
+            self.log.debug('Guild ID %s not found', guildid)
+            return
 
-            guild_role = config.get(Mute.cfg_muted_role, Mute.default_muted_role)
-            if guild_role == '':
-                return
+        config = GuildConfiguration.get_instance(guild)
+        if not guild.me.guild_permissions.manage_roles:
+            self.log.warning('I can\'t manage roles on guild: %s. Mute disabled on this guild.', guild)
+            config.set(Mute.cfg_muted_role, '')
+            return
 
-            member = guild.get_member(mutedid)
-            role = utils.get_guild_role(guild, guild_role)
+        guild_role = config.get(Mute.cfg_muted_role, Mute.default_muted_role)
+        if guild_role == '':
+            return
 
-            if role is None:
-                self.log.warning('Role "%s" does not exist (guild: %s). Mute disabled on this guild.', guild_role, guild)
-                config.uet(Mute.cfg_muted_role, '')
-                continue
-            elif member is None:
-                # self.log.warning('Member ID %s not found (guild: %s)', mutedid, guild)
+        role = utils.get_guild_role(guild, guild_role)
+        if role is None:
+            self.log.warning('Role "%s" does not exist (guild: %s). Mute disabled on this guild.', guild_role, guild)
+            config.set(Mute.cfg_muted_role, '')
+            return
+
+        for userid in userids:
+            member = guild.get_member(userid)
+            if member is None:
                 continue
-            else:
+
+            try:
                 await member.remove_roles(role)
-                MutedUser.delete_instance(muteduser)
                 self.log.info('Muted role removed from "%s", guild "%s"', member.display_name, guild)
-
-    def current_deltas_for(self, userid):
-        muted = MutedUser.select().where(MutedUser.userid == userid, MutedUser.until > dt.now())
-        return [(self.bot.get_server(f.serverid) or f.serverid, utils.deltatime_to_str(f.until - dt.now()))
-                for f in muted]
+            except discord.errors.HTTPException as e:
+                self.log.exception(e)
 
     def current_server_deltas(self, serverid):
-        muted = MutedUser.select().where(MutedUser.serverid == serverid, MutedUser.until > dt.now())
-        server = self.bot.get_server(serverid)
+        server = self.bot.get_guild(serverid)
         if server is None:
             return []
 
-        return [(server.get_member(f.userid) or f.userid, utils.deltatime_to_str(f.until - dt.now()))
-                for f in muted]
+        now = dt.now()
+        return [(server.get_member(userid) or userid, utils.deltatime_to_str(until - now))
+                for (guildid, userid), until in self.muted.items()
+                if guildid == serverid and until is not None and until > now]
+
+    def current_delta(self, userid, serverid):
+        until = self.muted.get((serverid, userid), None)
+        if until is None or dt.now() > until:
+            return None
+
+        return utils.deltatime_to_str(until - dt.now())
 
     @staticmethod
     def timediff_parse(timediff):
@@ -232,18 +318,6 @@ class Mute(Command):
 
         return datetime.timedelta(seconds=ds['s'], minutes=ds['m'], hours=ds['h'], days=ds['d'])
 
-    @staticmethod
-    def current_delta(userid, serverid):
-        try:
-            muted = MutedUser.get(MutedUser.userid == userid, MutedUser.serverid == serverid)
-
-            if dt.now() > muted.until:
-                return None
-            else:
-                return utils.deltatime_to_str(muted.until - dt.now())
-        except MutedUser.DoesNotExist:
-            return None
-
 
 class Unmute(Command):
     def __init__(self, bot):
@@ -269,7 +343,7 @@ class Unmute(Command):
         mutedrole = utils.get_guild_role(cmd.message.guild, sv_role)
 
         if mutedrole is None:
-            await cmd.answer('$[unmute-no-muted-role]'.format(sv_role), locales={'role_name'})
+            await cmd.answer('$[unmute-no-muted-role]', locales={'role_name': sv_role})
             return
 
         try:
@@ -278,11 +352,11 @@ class Unmute(Command):
             await cmd.answer('$[unmute-err-perms]')
             return
 
-        try:
-            muteduser = MutedUser.get(MutedUser.userid == member.id)
-            muteduser.delete()
-        except MutedUser.DoesNotExist:
-            pass
+        MutedUser.delete().where(
+            (MutedUser.userid == member.id) & (MutedUser.serverid == cmd.guild.id)).execute()
+        mute_mod = self.bot.manager.get_mod('Mute')
+        if mute_mod is not None:
+            mute_mod.untrack_mute(cmd.guild.id, member.id)
 
         await cmd.answer('$[unmute-done]')
 
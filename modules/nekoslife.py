@@ -93,7 +93,7 @@ class OwOify(Command):
         # get converted text from api
         url = base_url + 'owoify?' + urlencode({'text': text})
         await cmd.typing()
-        async with self.http.get(url) as r:
+        async with self.http.get(url, cache=3600) as r:
             data = await r.json()
 
             if 'msg' in data:
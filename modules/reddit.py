@@ -1,10 +1,15 @@
+import asyncio
 import html
+import time
+from collections import deque
 
+import aiohttp
 import discord
 import peewee
 from discord import Embed
 
 from bot import Command, BaseModel, categories
+from bot.lib.message_queue import PRIORITY_LOW
 from bot.utils import text_cut, auto_int
 from bot.regex import pat_channel, pat_subreddit
 
@@ -15,16 +20,53 @@ class RedditLastPost(BaseModel):
     timestamp = peewee.IntegerField(default=0)
 
 
+class RedditSeenPost(BaseModel):
+    subreddit = peewee.CharField()
+    post_id = peewee.CharField()
+    timestamp = peewee.IntegerField(default=0)
+
+    class Meta:
+        indexes = (
+            (('subreddit', 'timestamp'), False),
+        )
+
+
 class ChannelFollow(BaseModel):
     subreddit = peewee.TextField()
     serverid = peewee.TextField()
     channelid = peewee.TextField()
 
 
+class SubredditState:
+    """
+    Polling state for a followed subreddit.
+    """
+    __slots__ = ('name', 'next_check', 'interval', 'avg_gap', 'solo')
+
+    def __init__(self, name, interval):
+        self.name = name
+        self.next_check = 0
+        self.interval = interval
+        self.avg_gap = None
+        self.solo = False
+
+
 class RedditFollow(Command):
     __author__ = 'makzk'
-    __version__ = '1.2.2'
-    db_models = [RedditLastPost, ChannelFollow]
+    __version__ = '1.3.0'
+    db_models = [RedditLastPost, RedditSeenPost, ChannelFollow]
+
+    # Polling intervals limits, in seconds. Each subreddit is checked more often if it has more activity.
+    min_interval = 15
+    max_interval = 600
+    # Amount of subreddits requested together (as in r/a+b+c), and simultaneous requests
+    batch_size = 10
+    max_requests = 4
+    posts_limit = 100
+    max_etags = 500
+    # Amount of recently seen post IDs kept per subreddit, and maximum amount of posts delivered per check
+    seen_window = 200
+    max_catchup = 10
 
     def __init__(self, bot):
         super().__init__(bot)
@@ -33,10 +75,15 @@ class RedditFollow(Command):
         self.help = '$[reddit-help]'
         self.format = '$[reddit-format]'
         self.chans = {}
+        self.states = {}
+        self.seen = {}
+        self.etags = {}
+        self.stats = {'cycles': 0, 'last_duration': 0, 'max_duration': 0, 'requests': 0, 'not_modified': 0,
+                      'errors': 0, 'posts_sent': 0}
         self.allow_pm = False
         self.owner_only = True
         self.category = categories.STAFF
-        self.schedule = (self.load_task, 15)
+        self.schedule = (self.load_task, RedditFollow.min_interval)
 
     def on_loaded(self):
         self.load_channels()
@@ -51,6 +98,16 @@ class RedditFollow(Command):
             await cmd.answer('$[reddit-reloaded]')
             return
 
+        if cmd.args[0] == 'stats' and cmd.bot_owner:
+            await cmd.answer('$[reddit-stats]', locales={
+                'subs': len(self.chans), 'cycles': self.stats['cycles'],
+                'last_duration': '{:.3f}'.format(self.stats['last_duration']),
+                'max_duration': '{:.3f}'.format(self.stats['max_duration']),
+                'requests': self.stats['requests'], 'not_modified': self.stats['not_modified'],
+                'errors': self.stats['errors'], 'posts_sent': self.stats['posts_sent']
+            })
+            return
+
         if cmd.args[0] in ['set', 'follow', 'remove', 'unfollow']:
             if cmd.argc < 2:
                 await cmd.answer('$[format]: $[reddit-format-set]')
@@ -84,7 +141,7 @@ class RedditFollow(Command):
                     if chan.subreddit not in self.chans:
                         self.chans[chan.subreddit] = []
 
-                    self.chans[chan.subreddit].append(chan.channelid)
+                    self.chans[chan.subreddit].append(str(channel.id))
                     return
                 else:
                     await cmd.answer('$[reddit-error-sub-already-added]')
@@ -95,14 +152,7 @@ class RedditFollow(Command):
                                             ChannelFollow.serverid == cmd.message.guild.id,
                                             ChannelFollow.channelid == channel.id)
                     asd.delete_instance()
-
-                    if cmd.args[1] in self.chans:
-                        for tup in self.chans[cmd.args[1]]:
-                            if tup == (cmd.message.guild.id, channel.id):
-                                self.chans[cmd.args[1]].remove(tup)
-                                break
-                        if len(self.chans[cmd.args[1]]) == 0:
-                            del self.chans[cmd.args[1]]
+                    self.remove_follow(cmd.args[1], asd.channelid)
 
                     await cmd.answer('$[reddit-sub-removed]')
                     return
@@ -123,51 +173,218 @@ class RedditFollow(Command):
             await cmd.answer('$[format]: $[reddit-format]')
 
     async def load_task(self):
-        for (subname, subchannels) in self.chans.items():
-            post = await self.get_last_post(subname)
-            if not post:
-                self.log.warning('Error fetching post from r/%s', subname)
-                continue
-
-            ins, updated = RedditLastPost.get_or_create(subreddit=subname, defaults={
-                'post_id': post['id'], 'timestamp': post['created']})
-
-            if not updated and ins.post_id != post['id'] and ins.timestamp < post['created']:
-                ins.post_id = post['id']
-                ins.timestamp = post['created']
-                ins.save()
-                updated = True
-
-            if updated:
-                embed = self.post_to_embed(post)
-
-                for channel in subchannels:
-                    chan = self.bot.get_channel(auto_int(channel))
-                    if chan is not None:
-                        try:
-                            await self.bot.send_message(chan, content='$[reddit-message-title]', embed=embed,
-                                                        locales={'sub': subname})
-                        except discord.Forbidden:
-                            self.log.debug('Could not sent a r/%s post to %s (%s) #%s (%s) due to missing permissions',
-                                           subname, chan.guild.name, chan.guild.id, chan.name, chan.id)
-                    else:
-                        self.log.warning('Channel ID %s not found for subreddit subscription r/%s, removing',
-                                         channel, subname)
-                        to_del = ChannelFollow.get_or_none(
-                            ChannelFollow.subreddit == subname, ChannelFollow.channelid == channel)
-                        if to_del is not None:
-                            to_del.delete_instance()
-                            self.chans[subname].remove(channel)
-
-    async def get_last_post(self, sub):
-        url = 'https://www.reddit.com/r/{}/new.json?limit=1'.format(sub)
-        async with self.http.get(url) as r:
-            if not r.status == 200:
-                return None
+        start = time.perf_counter()
+        now = time.monotonic()
+
+        # Group the subreddits to check on this cycle in batches, to request them together
+        due = [self.get_state(sub) for sub in list(self.chans.keys())]
+        due = [state for state in due if state.next_check <= now]
+        batches = [[state] for state in due if state.solo]
+        shared = [state for state in due if not state.solo]
+        batches += [shared[i:i + self.batch_size] for i in range(0, len(shared), self.batch_size)]
+
+        semaphore = asyncio.Semaphore(self.max_requests)
+
+        async def check(batch):
+            async with semaphore:
+                posts = await self.fetch_batch([state.name for state in batch])
+            await self.process_batch(batch, posts)
+
+        results = await asyncio.gather(*[check(batch) for batch in batches], return_exceptions=True)
+        for batch, result in zip(batches, results):
+            if isinstance(result, Exception):
+                self.log.exception('Error checking subreddits %s', ', '.join(s.name for s in batch), exc_info=result)
+
+        # Batches change with the subreddits' intervals, so old ETags are dropped from time to time
+        if len(self.etags) > self.max_etags:
+            self.etags = {}
+
+        duration = time.perf_counter() - start
+        self.stats['cycles'] += 1
+        self.stats['last_duration'] = duration
+        self.stats['max_duration'] = max(self.stats['max_duration'], duration)
+        if len(batches) > 0:
+            self.log.debug('Checked %i subreddits in %i requests, took %.3f seconds', len(due), len(batches), duration)
+
+    async def process_batch(self, batch, posts):
+        now = time.monotonic()
+        if posts is None:
+            # Request failed, check them later
+            for state in batch:
+                state.next_check = now + state.interval
+            return
 
-            data = await r.json()
-            posts = data['data']['children']
-            return posts[0]['data'] if len(posts) > 0 else None
+        by_sub = {}
+        for post in posts:
+            by_sub.setdefault(post['subreddit'].lower(), []).append(post)
+
+        # If the listing was full, the subreddits without posts could have been left out by more active ones
+        full = len(posts) >= self.posts_limit and len(batch) > 1
+        sends = []
+        for state in batch:
+            sub_posts = by_sub.get(state.name.lower(), [])
+            state.solo = full and len(sub_posts) == 0
+            new_posts = self.process_posts(state, sub_posts)
+            state.next_check = now + (0 if state.solo else state.interval)
+
+            embeds = [embed for embed in map(self.post_to_embed, new_posts) if embed is not None]
+            if len(embeds) > 0:
+                channels = list(self.chans.get(state.name, []))
+                sends += [self.send_posts(state.name, channel, embeds) for channel in channels]
+
+        for result in await asyncio.gather(*sends, return_exceptions=True):
+            if isinstance(result, Exception):
+                self.log.exception('Error sending reddit posts', exc_info=result)
+
+    def process_posts(self, state, posts):
+        """
+        Determines the posts from a subreddit that were not delivered yet, and updates the polling interval
+        given the subreddit's activity.
+        :param state: The SubredditState instance.
+        :param posts: The subreddit posts from the fetched listing, newest first.
+        :return: The list of new posts, in chronological order.
+        """
+        if len(posts) == 0:
+            state.interval = min(self.max_interval, state.interval * 1.25)
+            return []
+
+        last = RedditLastPost.get_or_none(RedditLastPost.subreddit == state.name)
+        seen_ids, window = self.get_seen(state.name)
+        if len(window) == window.maxlen:
+            floor = window[0][0]
+        elif len(window) == 0 and last is not None:
+            # Subscriptions created before the seen posts were stored
+            floor = last.timestamp + 1
+        else:
+            floor = 0
+
+        new_posts = [p for p in posts if p['id'] not in seen_ids and p['created'] >= floor]
+        if len(new_posts) == 0:
+            state.interval = min(self.max_interval, state.interval * 1.25)
+            return []
+
+        newest = new_posts[0]
+        if last is None:
+            RedditLastPost.create(subreddit=state.name, post_id=newest['id'], timestamp=newest['created'])
+        elif last.timestamp < newest['created']:
+            gap = (newest['created'] - last.timestamp) / len(new_posts)
+            state.avg_gap = gap if state.avg_gap is None else state.avg_gap * 0.7 + gap * 0.3
+            state.interval = max(self.min_interval, min(self.max_interval, state.avg_gap / 2))
+
+            last.post_id = newest['id']
+            last.timestamp = newest['created']
+            last.save()
+
+        self.mark_seen(state.name, new_posts)
+
+        # On a new subscription, only the newest post is delivered
+        deliver = new_posts[:1] if last is None else new_posts[:self.max_catchup]
+        deliver.reverse()
+        return deliver
+
+    def get_seen(self, subname):
+        """
+        Retrieves the recently seen posts of a subreddit, loading them from the database if needed.
+        :param subname: The subreddit name.
+        :return: A tuple with the set of seen post IDs and a (timestamp, post_id) deque, oldest first.
+        """
+        if subname not in self.seen:
+            query = RedditSeenPost.select().where(RedditSeenPost.subreddit == subname).order_by(
+                RedditSeenPost.timestamp.desc()).limit(self.seen_window)
+            window = deque(reversed([(p.timestamp, p.post_id) for p in query]), maxlen=self.seen_window)
+            self.seen[subname] = ({post_id for _, post_id in window}, window)
+
+        return self.seen[subname]
+
+    def mark_seen(self, subname, posts):
+        seen_ids, window = self.get_seen(subname)
+        for post in sorted(posts, key=lambda p: p['created']):
+            if len(window) == window.maxlen:
+                seen_ids.discard(window[0][1])
+            window.append((post['created'], post['id']))
+            seen_ids.add(post['id'])
+
+        RedditSeenPost.insert_many([
+            {'subreddit': subname, 'post_id': p['id'], 'timestamp': p['created']} for p in posts
+        ]).execute()
+
+        # Keep the stored window bounded too
+        if len(window) == window.maxlen:
+            RedditSeenPost.delete().where(
+                (RedditSeenPost.subreddit == subname) & (RedditSeenPost.timestamp < window[0][0])).execute()
+
+    async def send_posts(self, subname, channel, embeds):
+        chan = self.bot.get_channel(auto_int(channel))
+        if chan is None:
+            self.log.warning('Channel ID %s not found for subreddit subscription r/%s, removing', channel, subname)
+            to_del = ChannelFollow.get_or_none(ChannelFollow.subreddit == subname, ChannelFollow.channelid == channel)
+            if to_del is not None:
+                to_del.delete_instance()
+            self.remove_follow(subname, channel)
+            return
+
+        # Posts are sent in order on each channel
+        for embed in embeds:
+            try:
+                await self.bot.send_message(chan, content='$[reddit-message-title]', embed=embed.copy(),
+                                            locales={'sub': subname}, priority=PRIORITY_LOW, max_age=3600)
+                self.stats['posts_sent'] += 1
+            except discord.Forbidden:
+                self.log.debug('Could not sent a r/%s post to %s (%s) #%s (%s) due to missing permissions',
+                               subname, chan.guild.name, chan.guild.id, chan.name, chan.id)
+                return
+            except discord.HTTPException as e:
+                self.log.debug('Could not sent a r/%s post to %s (%s) #%s (%s): %s',
+                               subname, chan.guild.name, chan.guild.id, chan.name, chan.id, str(e))
+                return
+
+    def remove_follow(self, subname, channel_id):
+        # Channel IDs are stored as strings, like they're read from the database
+        channel_id = str(channel_id)
+        if channel_id in self.chans.get(subname, []):
+            self.chans[subname].remove(channel_id)
+        if subname in self.chans and len(self.chans[subname]) == 0:
+            del self.chans[subname]
+            self.states.pop(subname, None)
+            self.seen.pop(subname, None)
+
+    async def fetch_batch(self, subs):
+        """
+        Fetches the newest posts from one or more subreddits with a single request, using conditional requests.
+        :param subs: A list of subreddit names.
+        :return: A list of posts data, newest first, or None if the request failed.
+        """
+        url = 'https://www.reddit.com/r/{}/new.json?limit={}'.format('+'.join(sorted(subs)), self.posts_limit)
+        headers = {}
+        if url in self.etags:
+            headers['If-None-Match'] = self.etags[url]
+
+        self.stats['requests'] += 1
+        try:
+            async with self.http.get(url, headers=headers, timeout=aiohttp.ClientTimeout(total=15)) as r:
+                if r.status == 304:
+                    self.stats['not_modified'] += 1
+                    return []
+
+                if r.status != 200:
+                    self.stats['errors'] += 1
+                    self.log.warning('Error fetching posts from r/%s (HTTP %i)', '+'.join(subs), r.status)
+                    return None
+
+                if 'ETag' in r.headers:
+                    self.etags[url] = r.headers['ETag']
+
+                data = await r.json()
+                return [post['data'] for post in data['data']['children']]
+        except (aiohttp.ClientError, asyncio.TimeoutError, KeyError, ValueError) as e:
+            self.stats['errors'] += 1
+            self.log.warning('Error fetching posts from r/%s: %s', '+'.join(subs), str(e))
+            return None
+
+    def get_state(self, sub):
+        if sub not in self.states:
+            self.states[sub] = SubredditState(sub, self.min_interval)
+        return self.states[sub]
 
     def load_channels(self):
         self.chans = {}
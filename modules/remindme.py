@@ -1,10 +1,12 @@
-from datetime import datetime
+import asyncio
+import heapq
+from datetime import datetime, timedelta
 
 from discord import Embed
 
 from bot import Command, BaseModel, categories
 from peewee import DateTimeField, TextField, BooleanField
-from bot.utils import timediff_parse, no_tags, deltatime_to_str, format_date, auto_int
+from bot.utils import timediff_parse, no_tags, deltatime_to_str, format_date, auto_int, is_int
 from bot.regex import pat_delta
 
 
@@ -15,48 +17,98 @@ class RemindMeEvent(BaseModel):
     alerttime = DateTimeField()
     sent = BooleanField(default=False)
 
+    class Meta:
+        indexes = (
+            (('userid', 'sent'), False),
+            (('sent', 'alerttime'), False),
+        )
+
 
 class RemindMe(Command):
     __author__ = 'makzk'
-    __version__ = '1.0.2'
+    __version__ = '1.1.0'
     db_models = [RemindMeEvent]
 
+    # Maximum time to wait between checks, so system clock changes are noticed
+    max_wait = 60
+    # Maximum amount of reminders being delivered at the same time
+    max_parallel = 10
+
     def __init__(self, bot):
         super().__init__(bot)
         self.name = 'remindme'
         self.help = '$[remindme-help]'
         self.usage = '$[remindme-usage]'
         self.category = categories.UTILITY
-        self.schedule = (self.remind_task, 5)
         self.default_config = {
-            'remindme_text_limit': 150
+            'remindme_text_limit': 150,
+            'remindme_max_active': 10
         }
 
+        # Pending reminders by their ID, and a (alerttime, id) heap to know which one is the next
+        self.pending = {}
+        self.heap = []
+
+    def on_loaded(self):
+        # Also called when the module is enabled, so reminders are available before any event is handled
+        self.load_pending()
+        if self.bot.initialized:
+            self.schedule_next()
+
+    async def on_ready(self):
+        self.schedule_next()
+
+    def load_pending(self):
+        self.pending = {e.id: e for e in RemindMeEvent.select().where(RemindMeEvent.sent == False)}
+        self.heap = [(e.alerttime, e.id) for e in self.pending.values()]
+        heapq.heapify(self.heap)
+        self.log.debug('Loaded %i pending reminders', len(self.pending))
+
     async def handle(self, evt):
         text_limit = self.bot.config.get('remindme_text_limit', 150)
-        last = RemindMeEvent.get_or_none((RemindMeEvent.userid == evt.author.id) & (RemindMeEvent.sent == False))
+        max_active = self.bot.config.get('remindme_max_active', 10)
+        active = list(RemindMeEvent.select().where(
+            (RemindMeEvent.userid == evt.author.id) & (RemindMeEvent.sent == False)
+        ).order_by(RemindMeEvent.alerttime))
+
+        if evt.argc == 0:
+            if len(active) == 0:
+                await evt.answer('$[remindme-no-active]')
+            else:
+                items = ['`{}` {} ({}): {}'.format(e.id, format_date(e.alerttime),
+                                                   deltatime_to_str(e.alerttime - datetime.now()), e.description)
+                         for e in active]
+                await evt.answer(Embed(title='$[remindme-list-title]', description='\n'.join(items)))
+            return
 
-        if evt.argc < 2:
-            if evt.argc == 0:
-                if last is None:
-                    await evt.answer('$[remindme-no-active]')
-                else:
-                    await evt.answer('$[remindme-already-active]')
+        if evt.args[0] == 'cancel':
+            if len(active) == 0:
+                await evt.answer('$[remindme-no-active]')
+                return
+
+            if evt.argc == 1 and len(active) == 1:
+                event = active[0]
+            elif evt.argc == 2 and is_int(evt.args[1]):
+                event = next((e for e in active if e.id == int(evt.args[1])), None)
             else:
-                if evt.args[0] == 'cancel':
-                    if last is None:
-                        await evt.answer('$[remindme-no-active]')
-                    else:
-                        last.sent = True
-                        last.save()
-                        await evt.answer('$[remindme-cancelled]')
-                else:
-                    await evt.answer('$[format]: $[remindme-usage]')
+                await evt.answer('$[format]: $[remindme-usage]')
+                return
+
+            if event is None:
+                await evt.answer('$[remindme-not-found]')
+                return
 
+            RemindMeEvent.update(sent=True).where(RemindMeEvent.id == event.id).execute()
+            self.pending.pop(event.id, None)
+            await evt.answer('$[remindme-cancelled]')
             return
 
-        if last is not None:
-            await evt.answer('$[remindme-already-active]')
+        if evt.argc < 2:
+            await evt.answer('$[format]: $[remindme-usage]')
+            return
+
+        if len(active) >= max_active:
+            await evt.answer('$[remindme-error-max-active]', locales={'max': max_active})
             return
 
         if not pat_delta.match(evt.args[0]):
@@ -74,23 +126,63 @@ class RemindMe(Command):
             return
 
         time = datetime.now() + dt
-        RemindMeEvent.create(userid=evt.author.id, description=text, alerttime=time)
+        event = RemindMeEvent.create(userid=evt.author.id, description=text, alerttime=time)
+        self.add_pending(event)
 
         await evt.answer('$[remindme-success]', locales={
             'delta': deltatime_to_str(dt), 'datetime': format_date(time)
         })
 
+    def add_pending(self, event):
+        self.pending[event.id] = event
+        item = (event.alerttime, event.id)
+        heapq.heappush(self.heap, item)
+        if self.heap[0] is item:
+            self.schedule_next()
+
+    def schedule_next(self):
+        # Discard cancelled reminders from the top of the heap
+        while len(self.heap) > 0 and self.heap[0][1] not in self.pending:
+            heapq.heappop(self.heap)
+
+        if len(self.heap) == 0:
+            return
+
+        # The wait is limited to notice changes on the system clock
+        when = min(self.heap[0][0], datetime.now() + timedelta(seconds=self.max_wait))
+        self.bot.manager.schedule_at(self.remind_task, when, force=True)
+
     async def remind_task(self):
-        query = RemindMeEvent.select().where(
-            (RemindMeEvent.alerttime <= datetime.now()) &
-            (RemindMeEvent.sent == False)
-        )
-        for event in query:
-            user = self.bot.get_user(auto_int(event.userid))
-            if user is not None:
-                emb = Embed(title='RemindMe!', description=event.description)
-                emb.set_footer(text='$[remindme-footer]')
-                await self.bot.send_message(user, embed=emb, locales={'date': format_date(event.created)})
-
-            event.sent = True
-            event.save()
+        now = datetime.now()
+        due = []
+        while len(self.heap) > 0 and self.heap[0][0] <= now:
+            _, event_id = heapq.heappop(self.heap)
+            event = self.pending.pop(event_id, None)
+            if event is not None:
+                due.append(event)
+
+        try:
+            if len(due) > 0:
+                semaphore = asyncio.Semaphore(self.max_parallel)
+
+                async def deliver(reminder):
+                    async with semaphore:
+                        await self.send_reminder(reminder)
+
+                await asyncio.gather(*[deliver(e) for e in due])
+                RemindMeEvent.update(sent=True).where(RemindMeEvent.id << [e.id for e in due]).execute()
+                self.log.debug('%i reminders delivered', len(due))
+        finally:
+            self.schedule_next()
+
+    async def send_reminder(self, event):
+        user = self.bot.get_user(auto_int(event.userid))
+        if user is None:
+            return
+
+        try:
+            emb = Embed(title='RemindMe!', description=event.description)
+            emb.set_footer(text='$[remindme-footer]')
+            await self.bot.send_message(user, embed=emb, locales={'date': format_date(event.created)})
+        except Exception as e:
+            self.log.exception(e)
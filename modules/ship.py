@@ -9,6 +9,8 @@ heart_url = 'https://i.imgur.com/80c3IKZ.png'
 
 
 class ShipperUwU(Command):
+    http_coalesce = True
+
     def __init__(self, bot):
         super().__init__(bot)
         self.name = 'ship'
@@ -19,7 +21,7 @@ class ShipperUwU(Command):
         self.heart_path = None
 
     async def on_ready(self):
-        self.heart_path = await download('heart.png', heart_url)
+        self.heart_path = await download('heart.png', heart_url, session=self.http)
         if self.heart_path is None:
             self.log.warning('Could not retrieve the heart picture')
             return
@@ -1,4 +1,4 @@
-from aiohttp import ClientSession, ContentTypeError
+from aiohttp import ContentTypeError
 from bot import Command, categories, BotMentionEvent
 
 
@@ -85,22 +85,14 @@ class SimSimiCmd(Command):
     def lang(self):
         return self.bot.config['simsimi_lang']
 
-    _sessions = {}
     api_url = 'https://wsapi.simsimi.com/190410/talk'
 
-    def get_session(self, channel=None):
-        channelid = 'global' if not channel else channel.id
-        if channelid not in self._sessions:
-            self._sessions[channelid] = ClientSession(headers={'x-api-key': self.key})
-        return self._sessions[channelid]
-
     async def talk(self, channel, language, country, text):
-        session = self.get_session(channel)
         data = {'lang': language, 'utext': text}
         if country:
             data['country'] = country if isinstance(country, list) else [country]
 
-        async with session.post(self.api_url, json=data) as r:
+        async with self.http.post(self.api_url, json=data, headers={'x-api-key': self.key}) as r:
             resp = await r.json()
 
             if r.status != 200:
@@ -1,17 +1,24 @@
+import asyncio
+import time
 from datetime import datetime
+
+import discord
 from discord import Embed
 
 from bot import Command, categories
-from bot.utils import format_date
+from bot.lib.guild_configuration import GuildConfiguration
+from bot.utils import format_date, auto_int
 from bot.regex import pat_channel
 from bot.database import ServerConfig
 
 
 class Sismos(Command):
-    __version__ = '1.0.3'
+    __version__ = '1.1.0'
     __author__ = 'makzk'
     cfg_channel_name = 'sismos_channel'
     api_url = 'https://api.mak.wtf/sismos'
+    # Maximum amount of alerts being sent at the same time
+    max_parallel = 20
 
     def __init__(self, bot):
         super().__init__(bot)
@@ -23,7 +30,39 @@ class Sismos(Command):
         self.category = categories.INFORMATION
         self.schedule = (self.update_info, 20)
 
+        # Alert channel IDs by guild ID
+        self.subscribers = {}
+        self.last_alert = None
+        GuildConfiguration.add_listener(self.on_config_change)
+
+    def on_loaded(self):
+        # Also called when the module is enabled, so alerts are sent without waiting for a reconnection
+        query = ServerConfig.select().where(ServerConfig.name == Sismos.cfg_channel_name, ServerConfig.value != '')
+        self.subscribers = {c.serverid: c.value for c in query}
+        self.log.debug('%i alert channels loaded', len(self.subscribers))
+
+    def on_unload(self):
+        GuildConfiguration.remove_listener(self.on_config_change)
+
+    def on_config_change(self, guild_id, name):
+        if name != Sismos.cfg_channel_name:
+            return
+
+        guild = self.bot.get_guild(auto_int(guild_id))
+        value = '' if guild is None else GuildConfiguration.get_instance(guild).get(name, '')
+        if value == '':
+            self.subscribers.pop(guild_id, None)
+        else:
+            self.subscribers[guild_id] = value
+
     async def handle(self, cmd):
+        if cmd.argc > 0 and cmd.args[0] == 'stats' and cmd.bot_owner:
+            if self.last_alert is None:
+                await cmd.answer('$[sismos-stats-none]')
+            else:
+                await cmd.answer('$[sismos-stats]', locales=self.last_alert)
+            return
+
         if self.last_events is None:
             await cmd.answer('$[sismos-not-loaded]')
             return
@@ -79,25 +118,51 @@ class Sismos(Command):
                 self.last_update = datetime.now()
 
                 if not first and len(self.last_events) > 0 and self.last_events[0]['magnitud'] >= 5:
-                    query = ServerConfig.select().where(
-                        ServerConfig.name == Sismos.cfg_channel_name, ServerConfig.value != ''
-                    )
-
-                    for server_config in query:
-                        sv = self.bot.get_server(server_config.serverid)
-                        if sv is None:
-                            ServerConfig.delete_instance(server_config)
-                            continue
-
-                        chan = sv.get_channel(server_config.value)
-                        if chan is None:
-                            continue
-
-                        await self.bot.send_message(
-                            destination=chan,
-                            content='$[sismos-alert-title]',
-                            embed=Sismos.make_embed(self.last_events[0])
-                        )
+                    await self.send_alerts(self.last_events[0])
+
+    async def send_alerts(self, data):
+        """
+        Sends an earthquake alert to all the subscribed channels at the same time. The message is
+        rendered once for each language.
+        :param data: The earthquake data.
+        """
+        start = time.perf_counter()
+        targets = []
+        for guild_id, channel_id in list(self.subscribers.items()):
+            guild = self.bot.get_guild(auto_int(guild_id))
+            chan = None if guild is None else guild.get_channel(auto_int(channel_id))
+            if chan is not None:
+                targets.append((chan, self.get_lang(guild, chan)))
+
+        # Languages instances are shared, unless a guild has custom strings
+        rendered = {}
+        for _, lang in targets:
+            if lang not in rendered:
+                rendered[lang] = (lang.format('$[sismos-alert-title]'), lang.format(Sismos.make_embed(data)))
+
+        semaphore = asyncio.Semaphore(self.max_parallel)
+        results = {'sent': 0, 'failed': 0}
+
+        async def send(channel, lang):
+            content, embed = rendered[lang]
+            async with semaphore:
+                try:
+                    # Rate limits are handled by discord.py for each channel
+                    await self.bot.send_message(channel, content, embed=embed.copy())
+                    results['sent'] += 1
+                except discord.HTTPException as e:
+                    results['failed'] += 1
+                    self.log.debug('Could not send the alert to #%s (%s): %s', channel.name, channel.id, str(e))
+
+        await asyncio.gather(*[send(chan, lang) for chan, lang in targets])
+
+        duration = time.perf_counter() - start
+        self.last_alert = {
+            'id': data['id'], 'channels': len(targets), 'sent': results['sent'], 'failed': results['failed'],
+            'duration': '{:.3f}'.format(duration), 'date': format_date(datetime.now())
+        }
+        self.log.info('Earthquake alert %s sent to %i of %i channels, took %.3f seconds',
+                      data['id'], results['sent'], len(targets), duration)
 
     @staticmethod
     def make_embed(data):
@@ -1,14 +1,17 @@
+import asyncio
 import re
+import time
+from collections import OrderedDict
 from datetime import datetime
 
 import discord
 import peewee
 import emoji
-from discord import Emoji, Embed
+from discord import Embed
 
 from bot import Command, categories, BaseModel
 from bot.lib.guild_configuration import GuildConfiguration
-from bot.utils import auto_int, compare_ids
+from bot.utils import auto_int
 
 
 class Starboard(BaseModel):
@@ -22,14 +25,61 @@ cfg_starboard_emojis = 'starboard_emojis'
 cfg_starboard_channel = 'starboard_channel'
 cfg_starboard_tcount = 'starboard_trigger_count'
 cfg_starboard_nsfw = 'starboard_watch_nsfw'
-pat_emoji = re.compile(r'^<:[a-zA-Z0-9\-_]+:[0-9]+>$')
+pat_emoji_id = re.compile(r'^<a?:[a-zA-Z0-9\-_]+:([0-9]+)>$')
+
+
+class StarboardSettings:
+    """
+    A guild's starboard settings, with the trigger emojis parsed.
+    """
+    __slots__ = ('channel_id', 'count', 'nsfw', 'emoji_ids', 'emoji_names')
+
+    def __init__(self, config):
+        chanid = config.get(cfg_starboard_channel)
+        self.channel_id = None if chanid == '' else auto_int(chanid)
+        self.nsfw = config.get(cfg_starboard_nsfw, '0') == '1'
+
+        ct_config = str(config.get(cfg_starboard_tcount, default_count))
+        if not ct_config.isdigit():
+            config.set(cfg_starboard_tcount, default_count)
+            ct_config = default_count
+        self.count = int(ct_config)
+
+        # Custom emojis are compared by ID, and unicode emojis by their value
+        self.emoji_ids = set()
+        self.emoji_names = set()
+        for react in (config.get(cfg_starboard_emojis) or '').split(' '):
+            m = pat_emoji_id.match(react)
+            if m:
+                self.emoji_ids.add(int(m.group(1)))
+            elif react != '':
+                self.emoji_names.add(react)
+
+    def is_trigger(self, emoji_react):
+        """
+        :param emoji_react: A str, discord.Emoji or discord.PartialEmoji instance.
+        :return: True if the emoji counts for the starboard. If no emojis are set, every emoji counts.
+        """
+        if len(self.emoji_ids) == 0 and len(self.emoji_names) == 0:
+            return True
+
+        emoji_id = getattr(emoji_react, 'id', None)
+        if emoji_id is not None:
+            return emoji_id in self.emoji_ids
+
+        return str(getattr(emoji_react, 'name', emoji_react)) in self.emoji_names
 
 
 class StarboardHook(Command):
     __author__ = 'makzk'
-    __version__ = '1.1.3'
+    __version__ = '1.2.0'
     db_models = [Starboard]
 
+    # Seconds to wait for more reactions before checking a message, and minimum seconds between checks of a message
+    debounce = 2
+    update_interval = 10
+    max_last_checks = 1000
+
     def __init__(self, bot):
         super().__init__(bot)
         self.allow_pm = False
@@ -39,6 +89,12 @@ class StarboardHook(Command):
         self.format = '$[starboard-format]'
         self.category = categories.STAFF
 
+        self.settings = {}
+        self.starred = set()
+        self.pending = {}
+        self.last_checks = OrderedDict()
+        GuildConfiguration.add_listener(self.on_config_change)
+
     async def handle(self, cmd):
         args = [] if cmd.argc == 0 else cmd.args[1:]
         argc = len(args)
@@ -92,12 +148,12 @@ class StarboardHook(Command):
                 await cmd.answer('$[format]: $[starboard-emoji-format]')
                 return
 
-            for arg in cmd.args:
-                if not pat_emoji.match(arg) and arg not in emoji.UNICODE_EMOJI:
+            for arg in args:
+                if not pat_emoji_id.match(arg) and arg not in emoji.UNICODE_EMOJI:
                     await cmd.answer('$[format]: $[starboard-emoji-format]')
                     return
 
-            res = cmd.config.set(cfg_starboard_emojis, cmd.text)
+            res = cmd.config.set(cfg_starboard_emojis, ' '.join(args))
             await cmd.answer('$[starboard-emoji-set]', locales={'emojis': res})
         elif subcmd == 'delemojis':
             cmd.config.set(cfg_starboard_emojis, '')
@@ -120,93 +176,137 @@ class StarboardHook(Command):
         else:
             await cmd.answer('$[starboard-format]', locales={'command_name': cmd.cmdname})
 
-    async def on_reaction_add(self, reaction, user: discord.Member):
-        message = reaction.message
-        config = GuildConfiguration.get_instance(user.guild)
-
-        # Load allowed reactions
-        emojis = config.get(cfg_starboard_emojis)
-        reaction_triggers = []
-        if emojis:
-            reaction_filtered = emojis.split(' ')
-            for react in reaction_filtered:
-                if pat_emoji.match(react):
-                    idx = react.rfind(':') + 1
-                    reaction_triggers.append(react[idx:-2])
-                else:
-                    reaction_triggers.append(react)
-            reaction_triggers = reaction_filtered
+    def on_config_change(self, guild_id, name):
+        if name in [cfg_starboard_emojis, cfg_starboard_channel, cfg_starboard_tcount, cfg_starboard_nsfw]:
+            self.settings.pop(auto_int(guild_id), None)
 
-        # Get the starboard channel
-        starboard_chanid = config.get(cfg_starboard_channel)
-        if starboard_chanid == '':
+    def on_loaded(self):
+        # Also called when the module is enabled, so starred messages are tracked without waiting for a reconnection
+        self.starred = {auto_int(s.message_id) for s in Starboard.select(Starboard.message_id)}
+        self.log.debug('%i starboard messages loaded', len(self.starred))
+
+    def on_unload(self):
+        GuildConfiguration.remove_listener(self.on_config_change)
+        for task in self.pending.values():
+            task.cancel()
+        self.pending.clear()
+
+    async def on_raw_reaction_add(self, payload):
+        self.reaction_event(payload)
+
+    async def on_raw_reaction_remove(self, payload):
+        # Removed reactions only update the messages already on the starboard
+        if payload.message_id in self.starred:
+            self.reaction_event(payload)
+
+    def reaction_event(self, payload):
+        if payload.guild_id is None:
             return
 
-        ct_config = str(config.get(cfg_starboard_tcount, default_count))
-        if not ct_config.isdigit():
-            config.set(cfg_starboard_tcount, default_count)
-            count_trigger = default_count
-        else:
-            count_trigger = int(ct_config)
+        guild = self.bot.get_guild(payload.guild_id)
+        if guild is None:
+            return
 
-        # Ignore messages on the starboard channel or from the bot itself
-        if compare_ids(starboard_chanid, message.channel.id) or message.author.id == self.bot.user.id:
+        settings = self.get_settings(guild)
+        # Ignore reactions on the starboard channel or without a trigger emoji
+        if settings.channel_id is None or settings.channel_id == payload.channel_id \
+                or not settings.is_trigger(payload.emoji):
+            return
+
+        # Reactions received while a check is scheduled are seen by that check
+        if payload.message_id in self.pending:
+            return
+
+        last = self.last_checks.get(payload.message_id, 0)
+        delay = max(self.debounce, last + self.update_interval - time.monotonic())
+        self.pending[payload.message_id] = self.bot.loop.create_task(
+            self.check_later(guild, payload.channel_id, payload.message_id, delay))
+
+    async def check_later(self, guild, channel_id, message_id, delay):
+        try:
+            await asyncio.sleep(delay)
+        finally:
+            self.pending.pop(message_id, None)
+
+        self.last_checks[message_id] = time.monotonic()
+        self.last_checks.move_to_end(message_id)
+        while len(self.last_checks) > self.max_last_checks:
+            self.last_checks.popitem(last=False)
+
+        try:
+            await self.check_message(guild, channel_id, message_id)
+        except discord.HTTPException as e:
+            self.log.debug('Could not update the starboard for message %s: %s', message_id, str(e))
+
+    async def check_message(self, guild, channel_id, message_id):
+        settings = self.get_settings(guild)
+        if settings.channel_id is None:
+            return
+
+        channel = guild.get_channel(channel_id)
+        if not isinstance(channel, discord.TextChannel):
             return
 
         # Ignore NSFW channels if they are ignored
-        if message.channel.is_nsfw() and config.get(cfg_starboard_nsfw, '0') == '0':
+        if channel.is_nsfw() and not settings.nsfw:
             return
 
         try:
-            star_item = Starboard.get(Starboard.message_id == str(message.id))
-            is_update = True
-        except peewee.DoesNotExist:
-            star_item = None
-            is_update = False
-
-        max_count = 0
-        for reaction in message.reactions:
-            emoji_react = reaction.emoji
-            if len(reaction_triggers) != 0:
-                if isinstance(emoji_react, str) and emoji_react not in reaction_triggers:
-                    continue
-
-                if isinstance(emoji_react, Emoji) and str(emoji_react.id) not in reaction_triggers:
-                    continue
-
-            if reaction.count > max_count:
-                max_count = reaction.count
-
-        if max_count < count_trigger:
+            message = await channel.fetch_message(message_id)
+        except (discord.NotFound, discord.Forbidden):
+            return
+
+        # Ignore messages from the bot itself
+        if message.author.id == self.bot.user.id:
+            return
+
+        # Messages already on the starboard are updated even if they have less reactions now
+        max_count = max([r.count for r in message.reactions if settings.is_trigger(r.emoji)] or [0])
+        if max_count < settings.count and message.id not in self.starred:
             return
 
-        guild = message.channel.guild
-        starboard_chan = guild.get_channel(auto_int(starboard_chanid))
+        starboard_chan = guild.get_channel(settings.channel_id)
+        star_item = Starboard.get_or_none(Starboard.message_id == str(message.id))
         if starboard_chan is None:
             if star_item is not None:
                 star_item.delete_instance()
-            self.log.debug('Channel ID %s not found for guild %s, starboard disabled.', starboard_chanid, user.guild)
-            config.set(cfg_starboard_channel, '')
+                self.starred.discard(message.id)
+            self.log.debug('Channel ID %s not found for guild %s, starboard disabled.', settings.channel_id, guild)
+            GuildConfiguration.get_instance(guild).set(cfg_starboard_channel, '')
             return
 
-        footer_text = self.get_lang(message.guild, starboard_chan).get('starboard-reactions')
+        footer_text = self.get_lang(guild, starboard_chan).get('starboard-reactions')
 
-        if is_update:
+        if star_item is not None:
             if not star_item.starboard_id:
                 return
 
-            starboard_msg = await starboard_chan.fetch_message(auto_int(star_item.starboard_id))
-            if starboard_msg is None:
-                return
-
+            # Edit the starboard message without fetching it
             new_embed = self.create_embed(message, star_item.timestamp, footer_text)
-            await starboard_msg.edit(embed=new_embed)
+            starboard_id = auto_int(star_item.starboard_id)
+            if hasattr(starboard_chan, 'get_partial_message'):
+                await starboard_chan.get_partial_message(starboard_id).edit(embed=new_embed)
+            else:
+                # discord.py < 1.6 has no PartialMessage, so its internal HTTP client is used instead. It only
+                # takes the channel and message IDs and the JSON fields to change.
+                await self.bot.http.edit_message(starboard_chan.id, starboard_id, embed=new_embed.to_dict())
         else:
             timestamp = datetime.now()
             embed = self.create_embed(message, timestamp, footer_text)
             starboard_msg = await starboard_chan.send(embed=embed)
             Starboard.insert(
                 message_id=message.id, timestamp=timestamp, starboard_id=starboard_msg.id).execute()
+            self.starred.add(message.id)
+
+    def get_settings(self, guild):
+        """
+        Retrieves the starboard settings of a guild, parsed once until they change.
+        :param guild: The discord.Guild instance.
+        :return: The StarboardSettings instance.
+        """
+        if guild.id not in self.settings:
+            self.settings[guild.id] = StarboardSettings(GuildConfiguration.get_instance(guild))
+        return self.settings[guild.id]
 
     def create_embed(self, msg, ts, footer_txt):
         embed = Embed()
@@ -219,7 +319,5 @@ class StarboardHook(Command):
             embed.set_image(url=msg.attachments[0].url)
 
         reactions = ' | '.join(['{}: {}'.format(str(r.emoji), r.count) for r in msg.reactions])
-        self.get_lang(msg.guild)
-
         embed.add_field(name=footer_txt, value=reactions)
         return embed
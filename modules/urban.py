@@ -28,7 +28,7 @@ class Urban(Command):
             self.log.debug('Loading %s ...', (baseurl + text))
 
             await cmd.typing()
-            async with self.http.get(baseurl + text) as urlresp:
+            async with self.http.get(baseurl + text, cache=3600) as urlresp:
                 data = await urlresp.json()
                 if 'list' not in data or len(data['list']) == 0:
                     await cmd.answer('$[urban-error-fetch]')
@@ -147,7 +147,7 @@ class Value(Command):
         while attempts < 10:
             self.log.debug('Loading currency data, attempt ' + str(attempts + 1))
             self.log.debug('Loading URL %s', url)
-            async with self.http.get(url) as r:
+            async with self.http.get(url, cache=120) as r:
                 data = await r.json()
                 if r.status != 200:
                     attempts += 1
@@ -184,7 +184,7 @@ class Value(Command):
         url = baseurl_sbif.format(api.lower(), self.bot.config['sbif_apikey'])
 
         while attempts < 10:
-            async with self.http.get(url) as r:
+            async with self.http.get(url, cache=3600) as r:
                 try:
                     data = await r.json(content_type='text/json')
                 except TypeError:
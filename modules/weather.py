@@ -37,7 +37,7 @@ class Weather(Command):
         self.log.debug('Loading ' + url)
 
         await cmd.typing()
-        async with self.http.get(url) as r:
+        async with self.http.get(url, cache=600) as r:
             if r.status != 200:
                 if r.status == 404:
                     await cmd.answer('$[weather-error-not-found]')
@@ -23,14 +23,14 @@ class XKCD(Command):
         if arg.isdigit():
             if 0 < int(arg) <= self.xkcd_current['num']:
                 await cmd.typing()
-                async with self.http.get(baseurl.format(arg)) as r:
+                async with self.http.get(baseurl.format(arg), cache=86400) as r:
                     self.xkcd_comic = await r.json()
             else:
                 await cmd.answer('$[xkcd-err-outofbounds]')
                 return
         elif arg == 'random':
             xkcd_random = random.randint(1, self.xkcd_current['num'])
-            async with self.http.get(baseurl.format(xkcd_random)) as r:
+            async with self.http.get(baseurl.format(xkcd_random), cache=86400) as r:
                 self.xkcd_comic = await r.json()
         elif len(arg) == 0 or arg == 'current':
             await cmd.typing()
@@ -48,6 +48,6 @@ class XKCD(Command):
 
     async def on_ready(self):
         self.log.debug('Loading last xkcd comic...')
-        async with self.http.get('https://xkcd.com/info.0.json') as r:
+        async with self.http.get('https://xkcd.com/info.0.json', cache=1800) as r:
             self.xkcd_current = await r.json()
             self.log.debug('Last xkcd comic loaded')
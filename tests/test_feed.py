@@ -0,0 +1,91 @@
+import asyncio
+
+import pytest
+
+for _name in ['discord', 'aiohttp', 'feedparser', 'bs4', 'peewee', 'ruamel.yaml']:
+    pytest.importorskip(_name)
+
+from peewee import SqliteDatabase  # noqa: E402
+
+from modules.feed import Feed, FeedSeenEntry, FeedSource  # noqa: E402
+
+URL = 'https://example.com/rss'
+
+
+def make_entries(start, stop):
+    """
+    :return: Feed entries with IDs from *start* to *stop* - 1, newest first like most feeds.
+    """
+    return [{'id': 'entry-{}'.format(i), 'title': 'Entry {}'.format(i), 'link': 'https://example.com/{}'.format(i),
+             'summary': '', 'timestamp': 0, 'image': None} for i in reversed(range(start, stop))]
+
+
+def run(coro):
+    return asyncio.get_event_loop().run_until_complete(coro)
+
+
+@pytest.fixture
+def feed():
+    db = SqliteDatabase(':memory:')
+    with db.bind_ctx([FeedSeenEntry, FeedSource]):
+        db.create_tables([FeedSeenEntry, FeedSource])
+
+        mod = Feed.__new__(Feed)
+        mod.seen = {}
+        mod.sources = {URL: FeedSource(url=URL, title='Test')}
+        mod.chans = {URL: ['1']}
+        mod.sent = []
+
+        async def send_entries(url, channel, embeds):
+            mod.sent.extend(embeds)
+
+        mod.send_entries = send_entries
+        yield mod
+
+
+def follow(mod, entries):
+    mod.mark_seen(URL, mod.unseen_entries(URL, entries), entries)
+
+
+def test_long_feed_is_not_sent_again(feed):
+    entries = make_entries(0, 150)
+    follow(feed, entries)
+
+    for _ in range(4):
+        run(feed.process_entries(URL, entries))
+
+    assert feed.sent == []
+
+
+def test_long_feed_is_not_sent_again_after_reload(feed):
+    entries = make_entries(0, 150)
+    follow(feed, entries)
+
+    # Seen entries are loaded again from the database
+    feed.seen.clear()
+    run(feed.process_entries(URL, entries))
+
+    assert feed.sent == []
+
+
+def test_only_new_entries_are_sent(feed):
+    follow(feed, make_entries(0, 150))
+
+    entries = make_entries(0, 153)
+    run(feed.process_entries(URL, entries))
+    run(feed.process_entries(URL, entries))
+
+    assert [e.title for e in feed.sent] == ['Entry 150', 'Entry 151', 'Entry 152']
+
+
+def test_seen_window_is_bounded(feed):
+    # A 10 entries feed that gets a new entry on every check
+    follow(feed, make_entries(0, 10))
+    for i in range(1, 300):
+        run(feed.process_entries(URL, make_entries(i, i + 10)))
+
+    seen_ids, window = feed.get_seen(URL)
+    assert len(window) == Feed.seen_window
+    assert len(seen_ids) == Feed.seen_window
+    assert FeedSeenEntry.select().count() == Feed.seen_window
+    assert len(feed.sent) == 299